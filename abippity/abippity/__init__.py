@@ -0,0 +1 @@
+from .programs import compile, cache_info
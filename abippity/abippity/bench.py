@@ -0,0 +1,794 @@
+#!/bin/env python
+"""Benchmarks for abippity, run on synthetic ABAP sources.
+
+Usage: python -m abippity.bench BENCHMARK [LINES...]
+e.g.:  python -m abippity.bench lex 10000 100000 1000000
+"""
+
+import io
+import os
+import random
+import time
+import tracemalloc
+
+from abippity.lex import lex, lex_states, to_stmts, iter_lex, iter_stmts
+from abippity.parse import (get_keywords, parse, group,
+    iter_parse, iter_group, get_keywords_text, build_keywords,
+    load_keywords, parse_stmt, get_keyword_matchers, compile_keywords,
+    MemoStmt, iter_parse_parallel)
+from abippity.incremental import IncrementalParser
+from abippity.programs import ProgramCache
+from abippity.nodes import build_block, Do
+from abippity.run import Runner
+from abippity.internals import (SCREENS, StreamScreen, Report, Type, Value,
+    get_type)
+from abippity.tables import TableType, Table
+
+# One "paragraph" of synthetic source: a bit of everything the lexer
+# has to deal with (comments, chains, char & string literals with
+# escaped quotes, structure components, operators...)
+SOURCE_LINES = [
+    "* Generated report, paragraph {i}",
+    "DATA: a{i} TYPE i VALUE {i},",
+    "      b{i}(10) TYPE c VALUE 'It''s {i}'.",
+    "DATA: c{i} TYPE i, d{i} TYPE i, e{i} TYPE i, f{i} TYPE i.",
+    "MOVE a{i} TO point-x. \" trailing comment",
+    "text_string = `A ``string`` {i}`.",
+    "IF a{i} LT 100 AND ( b{i} CA 'xyz' OR NOT a{i} <= 1 ).",
+    "    WRITE: / 'a:', a{i} NO-GAP, 'b:', b{i}.",
+    "ENDIF.",
+]
+
+
+def make_source(n_lines):
+    """Returns at least n_lines lines of source: whole paragraphs of
+    SOURCE_LINES, so no statement is cut off"""
+    lines = []
+    i = 0
+    while len(lines) < n_lines:
+        for line in SOURCE_LINES:
+            lines.append(line.format(i=i))
+        i += 1
+    return '\n'.join(lines) + '\n'
+
+
+def timed(f, *args, **kwargs):
+    """Returns (result, seconds) of calling f"""
+    t0 = time.perf_counter()
+    result = f(*args, **kwargs)
+    t1 = time.perf_counter()
+    return result, t1 - t0
+
+
+def traced(f, *args, **kwargs):
+    """Returns (result, seconds, peak bytes allocated) of calling f"""
+    tracemalloc.start()
+    try:
+        result, seconds = timed(f, *args, **kwargs)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def bench_grammar(n_times):
+    """NOTE: n_times isn't a number of lines, it's how many times to
+    load the grammar"""
+    text = get_keywords_text()
+    load_keywords(text) # make sure there's a snapshot
+
+    def repeat(f, *args):
+        for i in range(n_times): f(*args)
+
+    _, t_build = timed(repeat, build_keywords, text)
+    _, t_load = timed(repeat, load_keywords, text)
+    _, t_get = timed(repeat, get_keywords)
+    print("grammar x{}: build {:8.3f}ms, load snapshot {:8.3f}ms, "
+        "get_keywords {:8.3f}ms (each)"
+        .format(n_times, t_build / n_times * 1e3, t_load / n_times * 1e3,
+            t_get / n_times * 1e3))
+
+
+def bench_lex(n_lines):
+    text = make_source(n_lines)
+    lexemes, t_states = timed(lex_states, text)
+    new_lexemes, t_regex = timed(lex, text)
+    if new_lexemes != lexemes:
+        raise AssertionError("lex() and lex_states() disagree!")
+    print("lex {:>8} lines, {:>9} lexemes: "
+        "state machine {:8.3f}s, regex {:8.3f}s ({:.1f}x)"
+        .format(n_lines, len(lexemes), t_states, t_regex,
+            t_states / t_regex))
+
+
+def bench_stmts(n_lines):
+    text = make_source(n_lines)
+    lexemes = lex(text)
+
+    tracemalloc.start()
+    try:
+        stmts, t = timed(to_stmts, lexemes)
+        size, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    print("stmts {:>8} lines, {:>7} stmts: {:8.3f}s, {:8.1f}MB "
+        "({:.1f}MB per 100k stmts)"
+        .format(n_lines, len(stmts), t, size / 1e6,
+            size / len(stmts) * 100000 / 1e6))
+
+
+def bench_pipeline(n_lines):
+    text = make_source(n_lines)
+    keywords = get_keywords()
+
+    def run_lists():
+        lexemes = lex(text)
+        stmts = to_stmts(lexemes)
+        parsed_stmts = parse(stmts, keywords=keywords)
+        return len(group(parsed_stmts))
+
+    def run_generators():
+        source = io.StringIO(text)
+        lexemes = iter_lex(source)
+        stmts = iter_stmts(lexemes)
+        parsed_stmts = iter_parse(stmts, keywords=keywords)
+        return sum(1 for grouped_stmt in iter_group(parsed_stmts))
+
+    n, t_lists, peak_lists = traced(run_lists)
+    n, t_generators, peak_generators = traced(run_generators)
+    print("pipeline {:>8} lines, {:>7} toplevel stmts: "
+        "lists {:8.3f}s {:8.1f}MB, generators {:8.3f}s {:8.1f}MB"
+        .format(n_lines, n,
+            t_lists, peak_lists / 1e6,
+            t_generators, peak_generators / 1e6))
+
+
+def run_matchers(matchers, todo):
+    results = []
+    for stmt, keyword in todo:
+        captures = {}
+        matchers[keyword](stmt, 0, captures)
+        results.append(captures)
+    return results
+
+
+def bench_parse(n_lines):
+    text = make_source(n_lines)
+    keywords = get_keywords()
+    stmts = to_stmts(lex(text))
+    # (stmt, keyword) pairs, the way iter_parse looks keywords up
+    # (skipping 'x = y' stmts, which it doesn't use the grammar for)
+    keyword_names = {keyword.lower(): keyword for keyword in keywords
+        if keyword.upper() == keyword}
+    todo = [(stmt, keyword_names[stmt[0]]) for stmt in stmts
+        if stmt[0] in keyword_names]
+
+    def run_interpreter():
+        return [parse_stmt(stmt, 0, keywords, keywords[keyword])[2]
+            for stmt, keyword in todo]
+
+    def run_compiled():
+        return run_matchers(get_keyword_matchers(keywords), todo)
+
+    get_keyword_matchers(keywords) # compile outside of the timing
+    captures, t_interpreter = timed(run_interpreter)
+    new_captures, t_compiled = timed(run_compiled)
+    if new_captures != captures:
+        raise AssertionError("Interpreter and compiled grammar disagree!")
+    print("parse {:>8} lines, {:>7} stmts: "
+        "interpreter {:8.3f}s, compiled {:8.3f}s ({:.1f}x)"
+        .format(n_lines, len(stmts), t_interpreter, t_compiled,
+            t_interpreter / t_compiled))
+
+    # How much backtracking the FIRST sets save us
+    for predict in (False, True):
+        stats = {}
+        matchers = compile_keywords(keywords, predict=predict, stats=stats)
+        for stmt, keyword in todo:
+            matchers[keyword](stmt, 0, {})
+        uncounted_matchers = compile_keywords(keywords, predict=predict)
+        _, t = timed(run_matchers, uncounted_matchers, todo)
+        print("    {:<13}: {:>9} alternatives tried, {:>9} backtracked "
+            "({:8.3f}s)".format(
+                "predictive" if predict else "not predictive",
+                stats['tried'], stats['failed'], t))
+
+
+# A syntax which backtracks as badly as it gets: every '(' makes us
+# match the rest of the stmt twice
+BACKTRACKING_SYNTAX = """
+NESTED nested.
+nested {( nested AND}|{( nested OR}|x.
+"""
+MAX_BACKTRACKING_DEPTH = 20
+
+
+def bench_boolean(n_terms):
+    """NOTE: n_terms isn't a number of lines, it's the number of terms
+    in the boolean expression"""
+    keywords = get_keywords()
+    terms = []
+    for i in range(n_terms):
+        if i % 3 == 0: terms.append("a{} = b{}".format(i, i))
+        elif i % 3 == 1: terms.append("( NOT a{} BETWEEN b AND c )".format(i))
+        else: terms.append("( a{} < 1 OR b{} IS INITIAL )".format(i, i))
+    stmt, = to_stmts(lex("IF " + " AND ".join(terms) + "."))
+
+    # (without memoizing, this takes 2**depth matches)
+    depth = min(n_terms, MAX_BACKTRACKING_DEPTH)
+    backtracking_keywords = build_keywords(BACKTRACKING_SYNTAX)
+    backtracking_stmt, = to_stmts(lex(
+        "NESTED " + "( " * depth + "y" + " OR" * depth + "."))
+
+    for name, keywords, stmt, n_times in (
+            ('IF', keywords, stmt, 100),
+            ('NESTED', backtracking_keywords, backtracking_stmt, 1)):
+        results = []
+        for memo in (False, True):
+            stats = {}
+            matchers = compile_keywords(keywords, memo=memo, stats=stats)
+            matchers[name](MemoStmt(stmt), 0, {})
+            matchers = compile_keywords(keywords, memo=memo)
+            def run():
+                for i in range(n_times):
+                    captures = {}
+                    lexeme_i = matchers[name](MemoStmt(stmt), 0, captures)
+                return lexeme_i, captures
+            result, t = timed(run)
+            results.append(result)
+            print("boolean {:>5} terms, {:<6} {:>4} lexemes, {:<7}: "
+                "{:8.3f}ms, {:>8} alternatives tried, {:>5} memo hits"
+                .format(n_terms, name, len(stmt),
+                    "memo" if memo else "no memo", t / n_times * 1e3,
+                    stats['tried'], stats.get('memo_hits', 0)))
+        if results[0] != results[1] or results[0][0] != len(stmt):
+            raise AssertionError("Memoizing and non-memoizing disagree!")
+
+
+# Typical repeated stmts, as in generated code
+REPEATED_LINES = [
+    "ADD 1 TO counter.",
+    "WRITE / x.",
+    "ULINE.",
+    "WRITE: / 'Total:', total.",
+    "IF counter GT 10.",
+    "  counter = 0.",
+    "ENDIF.",
+]
+
+
+def bench_memo(n_lines):
+    text = '\n'.join(REPEATED_LINES[i % len(REPEATED_LINES)]
+        for i in range(n_lines)) + '\n'
+    keywords = get_keywords()
+    stmts = to_stmts(lex(text))
+    unique_stmts = to_stmts(lex(make_source(n_lines)))
+
+    for name, stmts in (('repeated', stmts), ('synthetic', unique_stmts)):
+        parsed_stmts, t_unmemoized = timed(parse, stmts,
+            keywords=keywords, memo_size=0)
+        new_parsed_stmts, t_memoized = timed(parse, stmts,
+            keywords=keywords)
+        if new_parsed_stmts != parsed_stmts:
+            raise AssertionError("Memoized and unmemoized parse disagree!")
+        n_unique = len(set(stmts))
+        print("memo {:>8} lines, {:<9} ({:>7} distinct stmts): "
+            "not memoized {:8.3f}s, memoized {:8.3f}s ({:.1f}x)"
+            .format(n_lines, name, n_unique, t_unmemoized, t_memoized,
+                t_unmemoized / t_memoized))
+
+
+def bench_cache(n_lines):
+    text = make_source(n_lines)
+    cache = ProgramCache()
+    program, t_miss = timed(cache.compile, text)
+    new_program, t_hit = timed(cache.compile, text)
+    if new_program is not program:
+        raise AssertionError("Cache didn't return the cached program!")
+    print("cache {:>8} lines: miss {:8.3f}s, hit {:8.3f}ms ({})"
+        .format(n_lines, t_miss, t_hit * 1e3, cache.info()))
+
+
+def bench_jobs(n_lines):
+    text = make_source(n_lines)
+    keywords = get_keywords()
+    stmts = to_stmts(lex(text))
+
+    parsed_stmts, t_serial = timed(parse, stmts, keywords=keywords)
+    times = []
+    for jobs in (2, 4):
+        # NOTE: unlike parse(..., jobs=N), iter_parse_parallel doesn't
+        # care how many CPUs we have
+        new_parsed_stmts, t = timed(list, iter_parse_parallel(stmts, jobs))
+        if new_parsed_stmts != parsed_stmts:
+            raise AssertionError("Serial and parallel parse disagree!")
+        times.append("{} jobs {:8.3f}s ({:.1f}x)".format(jobs, t,
+            t_serial / t))
+    print("jobs {:>8} lines, {} CPUs: serial {:8.3f}s, {}".format(
+        n_lines, os.cpu_count(), t_serial, ', '.join(times)))
+
+
+# A loop-heavy program, for timing the Runner
+LOOP_PROGRAM = """REPORT zbench.
+DATA: x TYPE i VALUE 0, y TYPE i VALUE 0, z TYPE i VALUE 0.
+DO {n} TIMES.
+  ADD 1 TO x.
+  IF x > 5 AND y < 3.
+    y = 0.
+  ELSEIF x = 3.
+    MOVE x TO z.
+  ELSE.
+    SUBTRACT 1 FROM z.
+  ENDIF.
+  ADD 2 TO y.
+ENDDO.
+WRITE: / x, y, z.
+"""
+
+
+def bench_nodes(n_lines):
+    """Compares the size of the grouped stmts of a synthetic source with
+    that of their nodes, and times running LOOP_PROGRAM with n_lines
+    iterations"""
+    stmts = to_stmts(lex(make_source(n_lines)))
+    keywords = get_keywords()
+
+    # NOTE: nodes share their strings with the captures, so we only
+    # count the memory used by captures, tuples & nodes themselves
+    tracemalloc.start()
+    try:
+        grouped_stmts = group(parse(stmts, keywords=keywords, memo_size=0))
+        size_grouped, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    tracemalloc.start()
+    try:
+        nodes = build_block(grouped_stmts)
+        size_nodes, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    program = build_block(group(parse(to_stmts(lex(
+        LOOP_PROGRAM.format(n=n_lines))), keywords=keywords)))
+    runner = Runner(40, 20)
+    _, t_run = timed(runner.run, program, toplevel=True)
+    print("nodes {:>8} lines: captures {:8.1f}MB, nodes {:8.1f}MB, "
+        "{} loop iterations {:8.3f}s".format(n_lines,
+            size_grouped / 1e6, size_nodes / 1e6, n_lines, t_run))
+
+
+def bench_allocs(n_lines):
+    """Measures the memory allocated by each iteration of LOOP_PROGRAM's
+    loop (over n_lines iterations), with tracemalloc: the peak memory
+    used while running each stmt of its block, summed up.
+    NOTE: for an IF, that's the peak of its biggest stmt, not the sum."""
+    program = build_block(group(parse(to_stmts(lex(
+        LOOP_PROGRAM.format(n=0))), keywords=get_keywords())))
+    runner = Runner(40, 20)
+    runner.run(program, toplevel=True) # declares the variables
+    loop = next(node for node in program if type(node) is Do)
+    stmt_runners = runner.stmt_runners
+
+    allocated = 0
+    tracemalloc.start()
+    try:
+        for i in range(n_lines):
+            for node in loop.block:
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                stmt_runners[type(node)](node, 1)
+                _, peak = tracemalloc.get_traced_memory()
+                allocated += peak - current
+    finally:
+        tracemalloc.stop()
+    print("allocs {:>8} loop iterations: {:8.1f} bytes per iteration"
+        .format(n_lines, allocated / n_lines))
+
+
+# A WHILE loop with AND/OR chains, for timing conditions
+CONDITION_PROGRAM = """REPORT zbench.
+DATA: i TYPE i VALUE 0, n TYPE i VALUE {n}, x TYPE i VALUE 0,
+      s TYPE string VALUE `abc`.
+WHILE i < n AND ( x < n OR s CA 'xyz' ) AND NOT i = n.
+  ADD 1 TO i.
+  IF i < 0 AND s CS 'q' AND x = 1.
+    x = 1.
+  ELSEIF i = 1 OR x = 0 OR s CO 'abc' OR s CA 'a'.
+    ADD 1 TO x.
+  ENDIF.
+ENDWHILE.
+"""
+
+
+def bench_conditions(n_lines):
+    """Times CONDITION_PROGRAM's loop of n_lines iterations"""
+    program = build_block(group(parse(to_stmts(lex(
+        CONDITION_PROGRAM.format(n=n_lines))), keywords=get_keywords())))
+    runner = Runner(40, 20)
+    _, t = timed(runner.run, program, toplevel=True)
+    print("conditions {:>8} loop iterations: {:8.3f}s".format(n_lines, t))
+
+
+def bench_limits(n_lines):
+    """Times LOOP_PROGRAM & CONDITION_PROGRAM's loops of n_lines
+    iterations, by a Runner without limits and one with (high) limits on
+    everything, i.e. the cost of checking them"""
+    keywords = get_keywords()
+    limits = dict(max_stmts=10**12, max_time=10**6, max_lines=10**6,
+        max_memory=10**6)
+    times = []
+    for name, text in [('loop', LOOP_PROGRAM),
+            ('conditions', CONDITION_PROGRAM)]:
+        program = build_block(group(parse(to_stmts(lex(
+            text.format(n=n_lines))), keywords=keywords)))
+        _, t_free = timed(Runner(40, 20).run, program, toplevel=True)
+        _, t_limited = timed(Runner(40, 20, **limits).run, program,
+            toplevel=True)
+        times.append("{}: no limits {:8.3f}s, limits {:8.3f}s".format(
+            name, t_free, t_limited))
+    print("limits {:>8} loop iterations: {}".format(n_lines,
+        ', '.join(times)))
+
+
+# Loops reading sy fields, for timing SystemStruct
+SY_PROGRAMS = [
+    ('sy-linsz', """REPORT zbench.
+DATA: x TYPE i VALUE 0, w TYPE i VALUE 0.
+DO {n} TIMES.
+  IF sy-linsz > x.
+    ADD 1 TO x.
+  ENDIF.
+  w = sy-linsz.
+ENDDO.
+"""),
+    ('sy-datum', """REPORT zbench.
+DATA: x TYPE i VALUE 0, d TYPE d.
+DO {n} TIMES.
+  d = sy-datum.
+  ADD 1 TO x.
+ENDDO.
+"""),
+]
+
+
+def bench_system(n_lines):
+    """Times loops of n_lines iterations reading sy fields"""
+    keywords = get_keywords()
+    times = []
+    for name, text in SY_PROGRAMS:
+        program = build_block(group(parse(to_stmts(lex(
+            text.format(n=n_lines))), keywords=keywords)))
+        runner = Runner(40, 20)
+        _, t = timed(runner.run, program, toplevel=True)
+        times.append("{} {:8.3f}s".format(name, t))
+    print("system {:>8} loop iterations: {}".format(n_lines,
+        ', '.join(times)))
+
+
+def bench_tables(n_rows):
+    """Times adding n_rows rows to a table of each kind (with a secondary
+    sorted key), then reading rows by key.
+    NOTE: n_rows isn't a number of lines. Standard tables get fewer reads
+    (of the last rows added), since they look at every row before."""
+    line_type = Type('struct')
+    line_type.add_field('k', get_type('i'))
+    line_type.add_field('v', get_type('i'))
+    rows = []
+    for k in range(n_rows):
+        row = Value(line_type)
+        row.get_field('k').data = k
+        row.get_field('v').data = k % 1000
+        rows.append(row)
+    random.Random(0).shuffle(rows)
+
+    results = []
+    for kind in ('standard', 'sorted', 'hashed'):
+        table = Table(TableType(kind, line_type, [
+            (None, None, kind != 'standard', ('k',)),
+            ('by_v', 'sorted', False, ('v',))]))
+
+        def fill():
+            for row in rows: table.add(row)
+
+        n_reads = 100 if kind == 'standard' else 10000
+        read_keys = [row.get_field('k').data for row in rows[-n_reads:]]
+        def read():
+            for k in read_keys:
+                if table.find(('k',), (k,)) is None:
+                    raise AssertionError("Row not found: {}".format(k))
+
+        _, t_fill = timed(fill)
+        _, t_read = timed(read)
+        results.append("{} add {:6.3f}us, read {:8.3f}us".format(kind,
+            t_fill / n_rows * 1e6, t_read / len(read_keys) * 1e6))
+    print("tables {:>8} rows: {}".format(n_rows, ', '.join(results)))
+
+
+def make_struct_program(n_fields):
+    """Returns a program declaring n_fields variables, a struct wide with
+    n_fields fields, and a struct deep nested n_fields levels deep (with
+    a field at each level)"""
+    lines = ["REPORT zbench."]
+    lines.extend("DATA v{} TYPE i.".format(i) for i in range(n_fields))
+    lines.append("DATA BEGIN OF wide.")
+    lines.extend("DATA f{} TYPE i.".format(i) for i in range(n_fields))
+    lines.append("DATA END OF wide.")
+    for i in range(n_fields):
+        lines.append("DATA BEGIN OF {}.".format('deep' if i == 0
+            else 's{}'.format(i)))
+        lines.append("DATA f{} TYPE i.".format(i))
+    for i in reversed(range(n_fields)):
+        lines.append("DATA END OF {}.".format('deep' if i == 0
+            else 's{}'.format(i)))
+    return '\n'.join(lines) + '\n'
+
+
+def allocated(f, *args, **kwargs):
+    """Returns (result, bytes allocated by calling f which are still
+    allocated after it returns)"""
+    tracemalloc.start()
+    try:
+        result = f(*args, **kwargs)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, current
+
+
+def bench_structs(n_fields):
+    """Reports the bytes per variable (of n_fields variables) and per
+    instance of a struct with n_fields fields, either wide (all at one
+    level) or deep (one per level).
+    NOTE: n_fields isn't a number of lines"""
+    program = build_block(group(parse(to_stmts(lex(
+        make_struct_program(n_fields))), keywords=get_keywords())))
+    runner = Runner(40, 20)
+    n_instances = 100
+
+    # NOTE: runs allocate other things too (e.g. the screen), hence the
+    # subtraction of an empty run
+    _, empty_bytes = allocated(Runner(40, 20).run, program[:1],
+        toplevel=True)
+    _, vars_bytes = allocated(Runner(40, 20).run,
+        program[:1 + n_fields], toplevel=True)
+    runner.run(program, toplevel=True)
+    results = []
+    for name in ('wide', 'deep'):
+        type = runner.get_var(name).type
+        _, bytes = allocated(lambda: [Value(type)
+            for i in range(n_instances)])
+        results.append("{} {:8.0f}B/instance".format(name,
+            bytes / n_instances))
+    print("structs {:>6} fields: {:8.0f}B/var, {}".format(n_fields,
+        (vars_bytes - empty_bytes) / n_fields, ', '.join(results)))
+
+
+# Moves of a struct with a nested struct, for timing struct copies:
+# the {change} is (or isn't) made to the copy after each move
+MOVE_PROGRAM = """REPORT zbench.
+DATA: BEGIN OF a,
+{fields}
+        BEGIN OF inner,
+{fields}
+        END OF inner,
+      END OF a.
+DATA b LIKE a.
+DO {n} TIMES.
+  MOVE a TO b.
+  {change}
+ENDDO.
+"""
+
+MOVE_CHANGES = [
+    ('move', ''),
+    ('change', 'ADD 1 TO b-f0.'),
+    ('nested change', 'ADD 1 TO b-inner-f0.'),
+]
+
+
+def bench_moves(n_lines):
+    """Times loops of n_lines struct moves (of 2 * 50 fields), with &
+    without changing the copy"""
+    keywords = get_keywords()
+    fields = '\n'.join("        f{} TYPE i,".format(i) for i in range(50))
+    times = []
+    for name, change in MOVE_CHANGES:
+        program = build_block(group(parse(to_stmts(lex(
+            MOVE_PROGRAM.format(fields=fields, n=n_lines,
+                change=change))), keywords=keywords)))
+        runner = Runner(40, 20)
+        _, t = timed(runner.run, program, toplevel=True)
+        times.append("{} {:8.3f}s".format(name, t))
+    print("moves {:>8} loop iterations: {}".format(n_lines,
+        ', '.join(times)))
+
+
+FIELD_SYMBOL_PROGRAM = """REPORT zbench.
+DATA: BEGIN OF big,
+{fields}
+      END OF big.
+DATA wa LIKE big.
+DATA itab LIKE STANDARD TABLE OF big.
+DATA r LIKE REF TO big.
+FIELD-SYMBOLS <fs> LIKE big.
+ASSIGN big TO <fs>.
+GET REFERENCE OF big INTO r.
+DO {n} TIMES.
+  {update}
+ENDDO.
+{after}
+"""
+
+FIELD_SYMBOL_UPDATES = [
+    ('copy in/out', 'wa = big. ADD 1 TO wa-f0. big = wa.'),
+    ('field symbol', 'ADD 1 TO <fs>-f0.'),
+    ('data ref', 'ADD 1 TO r->*-f0.'),
+]
+
+# (name, loop over itab's rows) to run after FIELD_SYMBOL_PROGRAM's DO
+# loop fills itab
+FIELD_SYMBOL_LOOPS = [
+    ('into', 'LOOP AT itab INTO wa. ADD 1 TO wa-f0. ENDLOOP.'),
+    ('assigning', 'LOOP AT itab ASSIGNING <fs>. ADD 1 TO <fs>-f0. ENDLOOP.'),
+    ('reference into',
+        'LOOP AT itab REFERENCE INTO r. ADD 1 TO r->*-f0. ENDLOOP.'),
+]
+
+
+def bench_fieldsymbols(n_lines):
+    """Times n_lines updates of a field of a struct (of 50 fields) in
+    place, through a field symbol or data reference, against copying
+    it in & out of a work area.
+    Also times loops over a table of n_lines such structs, updating
+    each row: LOOP AT ... INTO can only change a copy of it.
+    The first loop changing the rows in place copies their fields (which
+    they share with the struct they were appended from, see Value.copy),
+    so we time it separately from the next one."""
+    keywords = get_keywords()
+    fields = '\n'.join("        f{} TYPE i,".format(i) for i in range(50))
+
+    def build(update, after=''):
+        return build_block(group(parse(to_stmts(lex(
+            FIELD_SYMBOL_PROGRAM.format(fields=fields, n=n_lines,
+                update=update, after=after))), keywords=keywords)))
+
+    check = "ASSERT big-f0 = {}.".format(n_lines)
+    times = []
+    for name, update in FIELD_SYMBOL_UPDATES:
+        runner = Runner(40, 20)
+        _, t = timed(runner.run, build(update, check), toplevel=True)
+        times.append("{} {:8.3f}s".format(name, t))
+    print("fieldsymbols {:>8} updates: {}".format(n_lines,
+        ', '.join(times)))
+
+    times = []
+    for name, loop in FIELD_SYMBOL_LOOPS:
+        # Fill itab, then time the two loops after that
+        program = build('APPEND big TO itab.', loop + '\n' + loop)
+        runner = Runner(40, 20)
+        runner.run(program[:-2], toplevel=True)
+        _, t_first = timed(runner.run_block, program[-2:-1], 0)
+        _, t_second = timed(runner.run_block, program[-1:], 0)
+        times.append("{} {:8.3f}s then {:8.3f}s".format(name,
+            t_first, t_second))
+    print("fieldsymbols {:>8} rows:    {}".format(n_lines,
+        ', '.join(times)))
+
+
+SCREEN_PROGRAM = """REPORT zbench.
+DATA: x TYPE i, text TYPE string VALUE `Lorem ipsum dolor sit amet`.
+DO {n} TIMES.
+  ADD 1 TO x.
+  WRITE: / 'Line', x, text.
+  WRITE text.
+ENDDO.
+"""
+
+SCREEN_TEXT = "Lorem ipsum dolor sit amet, consectetur adipiscing elit"
+
+
+def bench_screen(n_lines):
+    """Times writing n_lines lines of text (wrapping at 80 columns) to
+    each kind of Screen (see SCREENS), directly & by WRITEs, and
+    printing the report. "stream" is a StreamScreen, which prints (well,
+    throws away) lines as they're written.
+    Also shows the peak memory (as seen by tracemalloc, so not counting
+    MmapScreen's mapped file) allocated while writing directly."""
+    program = build_block(group(parse(to_stmts(lex(
+        SCREEN_PROGRAM.format(n=n_lines))), keywords=get_keywords())))
+
+    def write(screen):
+        for i in range(n_lines):
+            screen.puts(SCREEN_TEXT)
+            screen.spacebar()
+            screen.puts(SCREEN_TEXT)
+            screen.newline()
+
+    def discard(line): pass
+
+    screens = list(SCREENS.items()) + [
+        ('stream', lambda w, h: StreamScreen(w, h, discard))]
+    for name, Screen in screens:
+        screen = Screen(80, 20)
+        _, t_write, peak = traced(write, screen)
+        with open(os.devnull, 'w') as file:
+            _, t_print = timed(Report('zbench', screen).print, file=file)
+        screen.close()
+
+        if name == 'stream':
+            runner = Runner(80, 20, stream=discard)
+        else:
+            runner = Runner(80, 20, screen=name)
+        _, t_run = timed(runner.run, program, toplevel=True)
+        runner.screen.close()
+        print("screen {:>8} lines, {:>6}: puts {:8.3f}s ({:7.0f} KiB), "
+            "print {:8.3f}s, WRITE {:8.3f}s".format(n_lines, name,
+                t_write, peak / 1024, t_print, t_run))
+
+
+def bench_incremental(n_lines):
+    text = make_source(n_lines)
+    keywords = get_keywords()
+
+    # Edit one line (well, stmt) in the middle
+    lines = text.splitlines(True)
+    i = len(lines) // 2
+    while not lines[i].startswith('MOVE'): i += 1
+    lines[i] = lines[i].replace('MOVE a', 'MOVE b', 1)
+    new_text = ''.join(lines)
+
+    def run_full():
+        return group(iter_parse(iter_stmts(iter_lex(new_text)),
+            keywords=keywords))
+
+    parser = IncrementalParser(keywords)
+    grouped_stmts, t_full = timed(run_full)
+    _, t_first = timed(parser.update, text)
+    new_grouped_stmts, t_edit = timed(parser.update, new_text)
+    if new_grouped_stmts != grouped_stmts:
+        raise AssertionError("Incremental and full runs disagree!")
+    print("incremental {:>8} lines: full {:8.3f}s, "
+        "first update {:8.3f}s, 1-line edit {:8.3f}s "
+        "({} sentence(s) re-parsed, {:.0f}x)"
+        .format(n_lines, t_full, t_first, t_edit, parser.n_reparsed,
+            t_full / t_edit))
+
+
+# name -> (function, default numbers of lines)
+BENCHMARKS = {
+    'grammar': (bench_grammar, [100]),
+    'lex': (bench_lex, [10000, 100000, 1000000]),
+    'stmts': (bench_stmts, [10000, 100000, 1000000]),
+    'pipeline': (bench_pipeline, [1000, 10000, 30000]),
+    'parse': (bench_parse, [1000, 10000, 100000]),
+    'boolean': (bench_boolean, [10, 15, 20]),
+    'memo': (bench_memo, [1000, 10000, 100000]),
+    'cache': (bench_cache, [1000, 10000, 100000]),
+    'jobs': (bench_jobs, [10000, 100000]),
+    'nodes': (bench_nodes, [1000, 10000, 100000]),
+    'system': (bench_system, [1000, 10000, 100000]),
+    'allocs': (bench_allocs, [1000, 10000]),
+    'conditions': (bench_conditions, [1000, 10000, 100000]),
+    'limits': (bench_limits, [1000, 10000, 100000]),
+    'incremental': (bench_incremental, [1000, 10000, 50000]),
+    'structs': (bench_structs, [10, 100, 200]),
+    'moves': (bench_moves, [1000, 10000, 100000]),
+    'fieldsymbols': (bench_fieldsymbols, [1000, 10000, 100000]),
+    'screen': (bench_screen, [1000, 10000, 100000]),
+    'tables': (bench_tables, [1000, 10000, 100000, 1000000]),
+}
+
+
+def main(args):
+    if not args or args[0] not in BENCHMARKS:
+        raise ValueError("Expected one of: {}".format(
+            ', '.join(BENCHMARKS)))
+    bench, default_lines = BENCHMARKS[args[0]]
+    lines = [int(arg) for arg in args[1:]] or default_lines
+    for n_lines in lines:
+        bench(n_lines)
+
+
+if __name__ == '__main__':
+    from sys import argv
+    main(argv[1:])
@@ -0,0 +1,146 @@
+
+import re
+
+from .internals import Value
+from .assertions import *
+
+
+def covers_pattern(s, pat):
+    """It's like a regex or a glob... kind of.
+
+    NOTE: In the following, "operand1" corresponds to our "s", "operand2"
+    to our "pattern".
+    from https://help.sap.com/doc/abapdocu_750_index_htm/7.50/en-US/abenlogexp_strings.htm:
+      Covers Pattern: True, if the content of operand1 fits the pattern in
+      operand2.
+      Wildcard characters can be used to create the operand2 pattern, where
+      "*" represents any character string (including a blank string) and "+"
+      represents any character.
+      It is not case-sensitive.
+      Trailing blanks in the left operand are respected.
+      If the comparison is true, sy-fdpos contains the offset of operand2 in
+      operand1.
+      Here, leading wildcard characters "*" in operand2 are ignored if
+      operand2 also contains other characters.
+      If the comparison is false, sy-fdpos contains the length of operand1.
+      Characters in operand2 can be selected for direct comparisons by
+      prefixing them with the escape character "#".
+      For characters flagged in this way in operand2, the operator is
+      case-sensitive.
+      Also, wildcard characters and the escape character are not subject to
+      special handling and trailing blanks are relevant."""
+
+    # nnnnope
+    return re.fullmatch(pat, s) is not None
+
+
+# Conditions (see nodes.Condition) are compiled into predicates:
+# functions taking a Runner and returning a bool, which ask the
+# condition's operands for their values and compare them with the
+# function REL_OPS has for the condition's rel_op.
+# AND & OR only evaluate their right-hand side if they need to.
+
+
+def textual(compare):
+    """Wraps compare, so it checks that both its values are textual"""
+    def compare_textual(lhs, rhs):
+        assertTrue(lhs.type.is_textual())
+        assertTrue(rhs.type.is_textual())
+        return compare(lhs, rhs)
+    return compare_textual
+
+# rel_op -> function(lhs, rhs) comparing two Values
+# See https://help.sap.com/doc/abapdocu_750_index_htm/7.50/en-US/abenlogexp_strings.htm
+REL_OPS = {
+    'eq': Value.eq,
+    'ne': Value.ne,
+    'lt': Value.lt,
+    'gt': Value.gt,
+    'le': Value.le,
+    'ge': Value.ge,
+
+    # Contains Only
+    'co': textual(lambda lhs, rhs: not set(lhs.data) - set(rhs.data)),
+    # Contains Not Only
+    'cn': textual(lambda lhs, rhs: bool(set(lhs.data) - set(rhs.data))),
+    # Contains Any
+    'ca': textual(lambda lhs, rhs: bool(set(lhs.data) & set(rhs.data))),
+    # Contains Not Any
+    'na': textual(lambda lhs, rhs: not set(lhs.data) & set(rhs.data)),
+    # Contains String
+    'cs': textual(lambda lhs, rhs: rhs.data in lhs.data),
+    # Contains No String
+    'ns': textual(lambda lhs, rhs: rhs.data not in lhs.data),
+    # Covers Pattern
+    'cp': textual(lambda lhs, rhs: covers_pattern(lhs.data, rhs.data)),
+    # No Pattern
+    'np': textual(lambda lhs, rhs: not covers_pattern(lhs.data, rhs.data)),
+}
+
+def is_bound(operand, runner):
+    value = operand.get_value(runner)
+    assertTrue(value.type.is_ref())
+    return value.data is not None
+
+# test -> function(operand, runner) checking the operand of e.g.
+# "operand IS INITIAL"
+TESTS = {
+    'initial': lambda operand, runner: operand.get_value(runner).is_initial(),
+    'bound': is_bound,
+    'assigned': lambda operand, runner: operand.is_assigned(runner),
+}
+
+def get_compare(cond):
+    """Returns the function comparing the operands of cond"""
+    compare = REL_OPS.get(cond.op)
+    if compare is None:
+        def compare(lhs, rhs):
+            raise AssertionError("Weird comparison: {}".format(cond))
+    return compare
+
+def always_true(runner):
+    return True
+
+def compile_condition(cond):
+    """Returns cond's predicate. Its sub_cond & rhs_cond (if any) must
+    already have theirs."""
+    if cond.sub_cond is not None:
+        sub_predicate = cond.sub_cond.predicate
+        if cond.negate:
+            predicate = lambda runner: not sub_predicate(runner)
+        else:
+            predicate = sub_predicate
+    elif cond.op is not None:
+        compare = get_compare(cond)
+        get_lhs = cond.operand1.get_value
+        get_rhs = cond.operand2.get_value
+        predicate = lambda runner: compare(get_lhs(runner),
+            get_rhs(runner))
+    elif cond.test is not None:
+        test = TESTS[cond.test]
+        operand = cond.operand1
+        if cond.negate:
+            predicate = lambda runner: not test(operand, runner)
+        else:
+            predicate = lambda runner: test(operand, runner)
+    else:
+        # NOTE: empty conditions (e.g. for an ELSE) are true
+        predicate = always_true
+
+    if cond.rhs_cond is None:
+        return predicate
+
+    lhs_predicate = predicate
+    rhs_predicate = cond.rhs_cond.predicate
+    connective = cond.connective
+    if connective == 'and':
+        return lambda runner: (lhs_predicate(runner)
+            and rhs_predicate(runner))
+    elif connective == 'or':
+        return lambda runner: (lhs_predicate(runner)
+            or rhs_predicate(runner))
+    elif connective == 'equiv':
+        return lambda runner: (lhs_predicate(runner)
+            == rhs_predicate(runner))
+    else:
+        raise AssertionError("Weird connective: {}".format(connective))
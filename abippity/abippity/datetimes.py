@@ -3,8 +3,13 @@ import pytz
 from datetime import datetime
 from tzlocal import get_localzone
 
-def get_local_now():
-    local_tz = get_localzone()
+def get_local_tz():
+    return get_localzone()
+
+def get_local_now(local_tz=None):
+    """Returns the current local datetime; looking up the local timezone
+    is slow, so pass local_tz (see get_local_tz) if you have it"""
+    if local_tz is None: local_tz = get_local_tz()
     utc_now = datetime.utcnow()
     local_now = utc_now.replace(tzinfo=pytz.utc).astimezone(local_tz)
     return local_now
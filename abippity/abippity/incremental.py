@@ -0,0 +1,150 @@
+
+from bisect import bisect_right
+
+from .lex import iter_stmts, iter_lex_ends
+from .parse import get_keywords, iter_parse, group
+
+
+# How many chars at a time to compare when diffing texts
+DIFF_CHUNK_SIZE = 4096
+
+
+def common_prefix_length(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n:
+        j = min(i + DIFF_CHUNK_SIZE, n)
+        if a[i:j] != b[i:j]: break
+        i = j
+    while i < n and a[i] == b[i]: i += 1
+    return i
+
+def common_suffix_length(a, b):
+    len_a = len(a)
+    len_b = len(b)
+    n = min(len_a, len_b)
+    i = 0
+    while i < n:
+        j = min(i + DIFF_CHUNK_SIZE, n)
+        if a[len_a-j:len_a-i] != b[len_b-j:len_b-i]: break
+        i = j
+    while i < n and a[len_a-i-1] == b[len_b-i-1]: i += 1
+    return i
+
+
+class IncrementalParser:
+    """Lexes, parses and groups successive versions of a text (e.g. a
+    document being edited), only redoing the work for the parts of it
+    which changed since the previous version.
+
+    The unit of work is the "sentence": the lexemes up to and including
+    a '.', i.e. a stmt or a chain of stmts.
+    Right after a '.', the lexer and to_stmts are both back in their
+    initial state, so each sentence's stmts depend only on its own text.
+    When the text changes, we keep the sentences which end before the
+    first changed char, and re-lex from there until we reach the end of
+    a sentence from which on the new text is the same as the old one,
+    right after the end of an old sentence: the rest of the old
+    sentences can then be kept as well (just shifted).
+
+    Grouping is redone from scratch every time, it's cheap."""
+
+    def __init__(self, keywords=None):
+        if keywords is None: keywords = get_keywords()
+        self.keywords = keywords
+
+        self.text = ''
+        self.ends = [] # index in self.text just after each sentence's '.'
+        self.sentences = [] # list of parsed_stmts, one list per sentence
+        self.grouped_stmts = []
+
+        # number of sentences re-lexed & re-parsed by the last update
+        self.n_reparsed = 0
+
+    def get_parsed_stmts(self):
+        return [parsed_stmt
+            for parsed_stmts in self.sentences
+            for parsed_stmt in parsed_stmts]
+
+    def update(self, text):
+        """Returns the same thing as group(iter_parse(iter_stmts(
+        iter_lex(text)))), and raises the same exceptions.
+        If an exception is raised, we keep our previous state, so the
+        next update will be diffed against the last text which worked."""
+        old_text = self.text
+        old_ends = self.ends
+        old_sentences = self.sentences
+        delta = len(text) - len(old_text)
+
+        # Keep the sentences which end before the first change
+        prefix_len = common_prefix_length(old_text, text)
+        n_kept = bisect_right(old_ends, prefix_len)
+        pos = old_ends[n_kept-1] if n_kept else 0
+
+        # From suffix_start on, text is the same as the end of old_text
+        suffix_start = len(text) - common_suffix_length(old_text, text)
+
+        new_ends = []
+        new_sizes = [] # number of stmts in each new sentence
+        new_parsed_stmts = []
+        resync_i = None # index of old sentence whose end we caught up with
+        sentence_end = None # set while iter_stmts is at the end of one
+
+        def iter_new_lexemes():
+            nonlocal sentence_end
+            for lexeme, end in iter_lex_ends(text, pos):
+                sentence_end = end if lexeme == '.' else None
+                yield lexeme
+
+        def iter_new_stmts():
+            nonlocal resync_i
+            size = 0
+            for stmt in iter_stmts(iter_new_lexemes()):
+                yield stmt
+                size += 1
+                if sentence_end is None: continue
+
+                end = sentence_end
+                new_ends.append(end)
+                new_sizes.append(size)
+                size = 0
+
+                if end >= suffix_start:
+                    old_i = bisect_right(old_ends, end - delta) - 1
+                    if old_i >= 0 and old_ends[old_i] == end - delta:
+                        resync_i = old_i
+                        return
+
+        def iter_parsed_stmts():
+            # NOTE: we chain everything into one generator, so that
+            # errors are raised in the same order as by a full run
+            for parsed_stmts in old_sentences[:n_kept]:
+                yield from parsed_stmts
+            for parsed_stmt in iter_parse(iter_new_stmts(),
+                    keywords=self.keywords):
+                new_parsed_stmts.append(parsed_stmt)
+                yield parsed_stmt
+            if resync_i is not None:
+                for parsed_stmts in old_sentences[resync_i+1:]:
+                    yield from parsed_stmts
+
+        grouped_stmts = group(iter_parsed_stmts())
+
+        new_sentences = []
+        i = 0
+        for size in new_sizes:
+            new_sentences.append(new_parsed_stmts[i:i+size])
+            i += size
+
+        ends = old_ends[:n_kept] + new_ends
+        sentences = old_sentences[:n_kept] + new_sentences
+        if resync_i is not None:
+            ends += [end + delta for end in old_ends[resync_i+1:]]
+            sentences += old_sentences[resync_i+1:]
+
+        self.text = text
+        self.ends = ends
+        self.sentences = sentences
+        self.grouped_stmts = grouped_stmts
+        self.n_reparsed = len(new_sentences)
+        return grouped_stmts
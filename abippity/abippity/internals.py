@@ -1,12 +1,16 @@
 
+import mmap
+import inspect
+import tempfile
 from collections import OrderedDict
+from datetime import date, datetime
 
 from .assertions import *
 
 
 
 BASETYPES = {'x', 'c', 'n', 'd', 't', 'i', 'f', 'p',
-    'string', 'xstring', 'struct'}
+    'string', 'xstring', 'struct', 'table', 'ref'}
 FIXED_LENGTH_BASETYPES = {'x', 'c', 'n', 'p'}
 DEFAULT_BASETYPE_LENGTHS = {'c': 1, 'n': 1}
 FORCED_BASETYPE_LENGTHS = {'d': 8, 't': 6}
@@ -32,17 +36,60 @@ https://help.sap.com/doc/saphelp_470/4.7/en-US/fc/eb3434358411d1829f0000e829fbfe
 
 
 class Screen:
+    """What a report writes: w columns of text, wrapping onto as many
+    rows as it needs.
+    Rows are lists of characters (so text can be written into them a
+    slice at a time), allocated when something is first written on them:
+    rows which were skipped over are None.
+    h is the number of rows the cursor (x, y) has been on so far (or the
+    height it was created with, if more)."""
     def __init__(self, w, h):
         self.w = w
         self.h = h
-        self.data = [[' '] * w for i in range(h)]
+        self.rows = []
         self.x = 0
         self.y = 0
+    def get_row(self, y):
+        """Returns row y, allocating it (& any before it) if need be"""
+        rows = self.rows
+        if y >= len(rows):
+            rows.extend([None] * (y + 1 - len(rows)))
+        row = rows[y]
+        if row is None:
+            row = rows[y] = [' '] * self.w
+        return row
+    def write_row(self, y, x, text):
+        """Writes text (which fits) at column x of row y"""
+        self.get_row(y)[x:x + len(text)] = text
+    def get_line(self, y):
+        """Returns the text of row y"""
+        rows = self.rows
+        row = rows[y] if y < len(rows) else None
+        if row is None: return ' ' * self.w
+        return ''.join(row)
+    def get_n_lines(self):
+        """The number of rows, up to the last one anything was written
+        on"""
+        return len(self.rows)
     def putc(self, c):
-        self.data[self.y][self.x] = c
+        self.write_row(self.y, self.x, c)
         self.spacebar()
     def puts(self, text):
-        for c in text: self.putc(c)
+        # NOTE: wraps exactly like putting each character in turn: the
+        # cursor moves to the next row as soon as this one is full
+        w = self.w
+        i = 0
+        n = len(text)
+        while i < n:
+            x = self.x
+            chunk = text[i:i + w - x]
+            self.write_row(self.y, x, chunk)
+            i += len(chunk)
+            x += len(chunk)
+            if x >= w:
+                self.newline()
+            else:
+                self.x = x
     def put_value(self, value, **kwargs):
         self.puts(value.to_text(**kwargs))
     def spacebar(self):
@@ -52,31 +99,205 @@ class Screen:
         self.x = 0
         self.y += 1
         if self.y >= self.h:
-            self.h += 1
-            self.data.append([' '] * self.w)
+            self.h = self.y + 1
     def uline(self):
         if self.x != 0:
             self.newline()
-        for i in range(self.w):
-            self.putc('-')
+        self.puts('-' * self.w)
+    def count_lines(self):
+        """The number of rows, leaving out the empty ones at the end"""
+        n = self.get_n_lines()
+        blank = ' ' * self.w
+        while n and self.get_line(n - 1) == blank: n -= 1
+        return n
+    def iter_lines(self):
+        """Yields the text of each row, leaving out the empty ones at
+        the end"""
+        for y in range(self.count_lines()):
+            yield self.get_line(y)
     def as_lines(self):
-        return [''.join(line_data) for line_data in self.data]
+        return list(self.iter_lines())
+    def close(self):
+        pass
+
+
+# The encoding of MmapScreen's rows: every character takes the same
+# number of bytes, so we know where each one goes
+MMAP_SCREEN_ENCODING = 'utf-32-le'
+MMAP_SCREEN_CHAR_SIZE = 4
+
+# How many bytes of its file an MmapScreen maps into memory at a time
+MMAP_SCREEN_WINDOW_SIZE = 1 << 20
+
+# How many rows MmapScreen.iter_lines reads from its file at a time
+MMAP_SCREEN_READ_ROWS = 1000
+
+class MmapScreen(Screen):
+    """A Screen keeping its rows in a temporary file instead of in
+    memory, for reports with lots of lines.
+    Rows are w characters each, at y * row_size in the file; the bytes
+    around the one being written are mapped into memory (a "window" of
+    window_size bytes), so writing to a row is just writing to memory,
+    and memory use doesn't grow with the number of rows.
+    Bytes which were never written are zeros, which read as blanks."""
+    def __init__(self, w, h, window_size=MMAP_SCREEN_WINDOW_SIZE):
+        super().__init__(w, h)
+        self.row_size = w * MMAP_SCREEN_CHAR_SIZE
+        self.window_size = window_size
+        self.file = tempfile.TemporaryFile()
+        self.file_size = 0
+        self.n_rows = 0
+        self.window = None # mmap of file, from window_start to window_end
+        self.window_start = 0
+        self.window_end = 0
+    def map_window(self, start, end):
+        """Maps the bytes of the file from (around) start to end"""
+        if self.window is not None: self.window.close()
+        start -= start % mmap.ALLOCATIONGRANULARITY
+        end = max(end, start + self.window_size)
+        # NOTE: windows end where a row does, so the file has all of any
+        # row written to
+        end += -end % self.row_size
+        if end > self.file_size:
+            self.file.truncate(end)
+            self.file_size = end
+        self.window = mmap.mmap(self.file.fileno(), end - start,
+            offset=start)
+        self.window_start = start
+        self.window_end = end
+    def write_row(self, y, x, text):
+        start = y * self.row_size + x * MMAP_SCREEN_CHAR_SIZE
+        data = text.encode(MMAP_SCREEN_ENCODING)
+        end = start + len(data)
+        if not self.window_start <= start or end > self.window_end:
+            self.map_window(start, end)
+        offset = start - self.window_start
+        self.window[offset:offset + len(data)] = data
+        if y >= self.n_rows: self.n_rows = y + 1
+    def decode(self, data):
+        return data.decode(MMAP_SCREEN_ENCODING).replace('\0', ' ')
+    def get_line(self, y):
+        if y >= self.n_rows: return ' ' * self.w
+        row_size = self.row_size
+        start = y * row_size
+        if self.window_start <= start and start + row_size <= self.window_end:
+            offset = start - self.window_start
+            return self.decode(self.window[offset:offset + row_size])
+        self.file.seek(start)
+        return self.decode(self.file.read(row_size))
+    def get_n_lines(self):
+        return self.n_rows
+    def iter_lines(self):
+        # NOTE: reads the file a few rows at a time, rather than one row
+        # at a time (like Screen.iter_lines, which would work too)
+        n = self.count_lines()
+        if not n: return
+        w = self.w
+        file = self.file
+        if self.window is not None: self.window.flush()
+        file.seek(0)
+        for y in range(0, n, MMAP_SCREEN_READ_ROWS):
+            n_rows = min(MMAP_SCREEN_READ_ROWS, n - y)
+            text = self.decode(file.read(n_rows * self.row_size))
+            for i in range(0, n_rows * w, w):
+                yield text[i:i + w]
+    def close(self):
+        if self.window is not None:
+            self.window.close()
+            self.window = None
+            self.window_start = self.window_end = 0
+        self.file.close()
+
+def get_line_sink(sink):
+    """Returns function(line) handing a line of a report to sink, which
+    may be a file object (which is written & flushed, so e.g. a pipe
+    gets each line as soon as it comes), a generator (which is sent each
+    line) or a function(line)"""
+    if hasattr(sink, 'write'):
+        def write_line(line):
+            sink.write(line + '\n')
+            sink.flush()
+        return write_line
+    if hasattr(sink, 'send'):
+        # Run it up to its first yield, ready for a line
+        if inspect.getgeneratorstate(sink) == inspect.GEN_CREATED:
+            next(sink)
+        return sink.send
+    assertTrue(callable(sink))
+    return sink
+
+class StreamScreen(Screen):
+    """A Screen which hands each row to sink (see get_line_sink) as soon
+    as the cursor leaves it, so it only keeps the row the cursor is on.
+    Blank rows are held back (well, counted) until a row which isn't
+    blank comes along, so that the empty rows at the end are left out,
+    as by Screen.iter_lines.
+    The row the cursor is on when we're done is handed over by close."""
+    def __init__(self, w, h, sink):
+        super().__init__(w, h)
+        self.sink = get_line_sink(sink)
+        self.row = None # the row the cursor is on, once written on
+        self.n_blank_rows = 0 # held back
+    def write_row(self, y, x, text):
+        # NOTE: rows the cursor has left are gone
+        assertEqual(y, self.y)
+        row = self.row
+        if row is None: row = self.row = [' '] * self.w
+        row[x:x + len(text)] = text
+    def get_line(self, y):
+        raise AssertionError("Rows of a StreamScreen are gone once "
+            "they're handed over")
+    def get_n_lines(self):
+        return 0
+    def send_row(self):
+        row = self.row
+        self.row = None
+        line = None if row is None else ''.join(row)
+        if line is None or not line.strip(' '):
+            self.n_blank_rows += 1
+            return
+        sink = self.sink
+        if self.n_blank_rows:
+            blank = ' ' * self.w
+            for i in range(self.n_blank_rows): sink(blank)
+            self.n_blank_rows = 0
+        sink(line)
+    def newline(self):
+        self.send_row()
+        super().newline()
+    def close(self):
+        if self.row is not None: self.send_row()
+
+# name -> Screen class, e.g. for Runner(screen='mmap')
+SCREENS = {
+    'memory': Screen,
+    'mmap': MmapScreen,
+}
 
 class Report:
     def __init__(self, title, screen):
         self.title = title
         self.screen = screen
+    def get_header(self):
+        """The lines printed before the screen's"""
+        return ["REPORT: {}".format(self.title.upper()),
+            '*' * self.screen.w]
+    def get_trailer(self):
+        """The lines printed after the screen's"""
+        return ['*' * self.screen.w]
+    def iter_lines(self):
+        yield from self.get_header()
+        yield from self.screen.iter_lines()
+        yield from self.get_trailer()
     def print(self, file=None):
-        print("REPORT: {}".format(self.title.upper()), file=file)
-        screen = self.screen
-        uline = '*' * screen.w
-        print(uline, file=file)
-        for line in screen.as_lines():
+        for line in self.iter_lines():
             print(line, file=file)
-        print(uline, file=file)
 
 
 class Type:
+    __slots__ = ('basetype', 'length', 'min_int', 'max_int', 'fields',
+        'offsets')
+
     def __init__(self, basetype, length=None):
         assertIn(basetype, BASETYPES)
         if length is None:
@@ -86,8 +307,16 @@ class Type:
             length = FORCED_BASETYPE_LENGTHS[basetype]
         self.basetype = basetype
         self.length = length
+
+        # The smallest & biggest integers which fit in length chars
+        # (see check_number_length)
+        if length is not None:
+            self.min_int = -(10 ** (length - 1) - 1)
+            self.max_int = 10 ** length - 1
+
         if self.is_struct():
-            self.fields = OrderedDict()
+            self.fields = OrderedDict() # name -> Type
+            self.offsets = {} # name -> index in the data of Values
     def __str__(self):
         if self.is_struct():
             return "BEGIN {} END".format(
@@ -104,50 +333,54 @@ class Type:
         assertTrue(type2.is_numeric())
         return type1
     def convert(self, value, allow_structs=False):
+        """Returns value converted to this type: value itself if it's
+        already of this type, otherwise see CONVERTERS"""
+        if self.basetype == 'struct' and not allow_structs:
+            raise AssertionError("Struct conversion not allowed: "
+                "{} to {}"
+                .format(repr(value), repr(self)))
 
-        # WARNING: This method needs a loooot of work.
-        # See: https://help.sap.com/doc/abapdocu_752_index_htm/7.52/en-US/abenconversion_rules.htm
-        # See also: https://www.tutorialspoint.com/sap_abap/sap_abap_operators.htm:
-        #     Following is the order of preference −
-        #     If one field is of type I, then the other is converted to type I.
-        #     If one field is of type P, then the other is converted to type P.
-        #     If one field is of type D, then the other is converted to type D. But C and N types are not converted and they are compared directly. Similar is the case with type T.
-        #     If one field is of type N and the other is of type C or X, both the fields are converted to type P.
-        #     If one field is of type C and the other is of type X, the X type is converted to type C.
-
-        if not allow_structs:
-            if self.is_struct():
-                raise AssertionError("Struct conversion not allowed: "
-                    "{} to {}"
-                    .format(repr(value), repr(self)))
-
-        if self.length is not None:
-            assertGreaterEqual(self.length, value.get_length())
+        value_type = value.type
+        if value_type is self: return value
 
-        if self.is_numeric() and value.is_numeric():
-            return Value(self, value.data)
-
-        if self.is_textual() and value.is_textual():
-            return Value(self, value.data)
-
-        assertEqual(self.basetype, value.type.basetype)
-        return value
+        converter = CONVERTERS.get((value_type.basetype, self.basetype))
+        if converter is None:
+            assertEqual(self.basetype, value_type.basetype)
+        return converter(self, value)
 
     def is_struct(self):
         return self.basetype == 'struct'
+    def is_table(self):
+        return self.basetype == 'table'
     def is_numeric(self):
         return self.basetype in NUMERIC_BASETYPES
     def is_textual(self):
         return self.basetype in TEXTUAL_BASETYPES
+    def is_ref(self):
+        return self.basetype == 'ref'
+    def is_compatible(self, other):
+        """Whether values of other type can be used as values of this
+        one as they are, e.g. by a field symbol of this type"""
+        if self is other: return True
+        if self.basetype != other.basetype or self.length != other.length:
+            return False
+        if not self.is_struct(): return True
+        return list(self.fields) == list(other.fields) and all(
+            field_type.is_compatible(other_field_type)
+            for field_type, other_field_type in zip(self.fields.values(),
+                other.fields.values()))
     def get_initial(self):
         """Returns the \"initial\" value for the given ABAP type
         (that is, the value for which the ABAP expression
         \"<value> IS INITIAL\" is true)"""
-        basetype = self.basetype
+        return Value(self, self.get_initial_data())
+    def get_initial_data(self):
         if self.is_numeric():
-            return Value(self, 0)
+            return 0
         elif self.is_textual():
-            return Value(self, "")
+            return ""
+        elif self.is_struct():
+            return [Value(type) for type in self.fields.values()]
         else:
             raise ValueError("Not implemented for type: {}"
                 .format(self))
@@ -155,30 +388,72 @@ class Type:
     def add_field(self, name, type):
         assertTrue(self.is_struct())
         assertNotIn(name, self.fields)
+        self.offsets[name] = len(self.fields)
         self.fields[name] = type
 
 
+# (basetype, length) -> Type, see get_type
+TYPES = {}
+
+def get_type(basetype, length=None):
+    """Returns the shared Type for an elementary type, or a new one for a
+    struct (since fields get added to those).
+    Elementary Types are never modified, so everyone can use the same
+    one, e.g. every literal number has the same Type('i')."""
+    type = TYPES.get((basetype, length))
+    if type is None:
+        type = Type(basetype, length)
+        if type.is_struct(): return type
+        # NOTE: e.g. Type('c') & Type('c', 1) are the same type
+        type = TYPES.setdefault((basetype, type.length), type)
+        TYPES[basetype, length] = type
+    return type
+
+
+class RefType(Type):
+    """REF TO target_type, or REF TO data if target_type is None.
+    The data of its values are refs (e.g. VarRef), or None if they're
+    not bound."""
+    __slots__ = ('target_type',)
+
+    def __init__(self, target_type=None):
+        super().__init__('ref')
+        self.target_type = target_type
+    def __str__(self):
+        return "REF TO {}".format(self.target_type or 'data')
+    def is_compatible(self, other):
+        if self is other: return True
+        if not other.is_ref(): return False
+        target_type = self.target_type
+        other_target_type = other.target_type
+        if target_type is None or other_target_type is None:
+            return target_type is other_target_type
+        return target_type.is_compatible(other_target_type)
+    def get_initial_data(self):
+        return None
+
+
 class Value:
+    """The data of a struct is a list of its fields' Values, in the order
+    of its type's fields (see Type.offsets), or a tuple of them if they're
+    shared with copies of it (see copy)"""
+    __slots__ = ('type', 'data')
+
     def __init__(self, type, data=None):
         self.type = type
-        if type.is_struct():
-            self.fields = OrderedDict(
-                (name, Value(subtype))
-                for name, subtype in type.fields.items())
-        else:
-            if data is None: data = type.get_initial()
-            self.data = data
+        if data is None: data = type.get_initial_data()
+        self.data = data
     def __str__(self):
         if self.is_struct():
             return "BEGIN {} END".format(
                 ' '.join("{} = {},".format(name, value)
-                    for name, value in self.fields.items()))
+                    for name, value in self.iter_fields()))
         return "{}".format(repr(self.data))
     def __repr__(self):
         if self.is_struct():
             return "Value(BEGIN {} END)".format(
                 ', '.join("{} = {}".format(name, value)
-                for name, value in self.fields.items()))
+                for name, value in self.iter_fields()))
         return "Value({} TYPE {})".format(repr(self.data), self.type)
     @classmethod
     def create_struct(Value, items):
@@ -192,6 +467,39 @@ class Value:
     def is_numeric(self): return self.type.is_numeric()
     def is_textual(self): return self.type.is_textual()
     def is_struct(self): return self.type.is_struct()
+    def is_table(self): return self.type.is_table()
+    def is_initial(self):
+        type = self.type
+        data = self.data
+        if type.is_struct():
+            return all(field.is_initial() for field in data)
+        if type.is_table():
+            return not data
+        if type.basetype in ('d', 't', 'n'):
+            return not data.strip('0 ')
+        if type.is_textual():
+            return not data.strip(' ')
+        return data == type.get_initial_data()
+    def copy(self):
+        """Returns a copy of this value which can be changed without
+        changing it, and vice versa.
+        Structs are copied on write: the copy shares our fields (as a
+        tuple, so nobody changes them) until one of us changes one, see
+        get_own_data."""
+        type = self.type
+        if type.is_struct():
+            data = self.data
+            if data.__class__ is not tuple: data = self.data = tuple(data)
+            return Value(type, data)
+        if type.is_table(): return Value(type, self.data.copy())
+        return Value(type, self.data)
+    def get_own_data(self):
+        """Returns the fields of a struct as a list we can change, copying
+        them first if they're shared (see copy)"""
+        data = self.data
+        if data.__class__ is tuple:
+            data = self.data = [field.copy() for field in data]
+        return data
     def get_length(self):
         type = self.type
         if type.length is not None:
@@ -233,23 +541,223 @@ class Value:
             if length is not None and not nozero:
                 s = s.rjust(length, '0')
         return s
+    def iter_fields(self):
+        """Yields (name, Value) for each field of a struct"""
+        assertTrue(self.is_struct())
+        return zip(self.type.fields, self.data)
     def get_field(self, name):
+        """Returns the Value of a field of a struct.
+        Don't change it! See get_field_to_change."""
         assertTrue(self.is_struct())
-        assertIn(name, self.fields)
-        return self.fields[name]
+        offsets = self.type.offsets
+        assertIn(name, offsets)
+        return self.data[offsets[name]]
+    def get_field_to_change(self, name):
+        """Like get_field, but the Value is ours to change in place"""
+        assertTrue(self.is_struct())
+        offsets = self.type.offsets
+        assertIn(name, offsets)
+        return self.get_own_data()[offsets[name]]
     def set_field(self, name, value, allow_structs=False):
         assertTrue(self.is_struct())
-        assertIn(name, self.fields)
-        value = self.type.fields[name].convert(value,
+        type = self.type
+        assertIn(name, type.offsets)
+        value = type.fields[name].convert(value,
             allow_structs=allow_structs)
-        self.fields[name] = value
+        data = self.get_own_data()
+        offset = type.offsets[name]
+        if value.type.is_struct():
+            data[offset] = value.copy()
+        elif value.type.is_table():
+            # NOTE: tables are changed in place, so we need our own
+            data[offset].data = value.data.copy()
+        else:
+            # NOTE: we keep our own Value, see Var.set
+            data[offset].data = value.data
+    def set_field_data(self, name, data):
+        """Sets the data of a field in place, see VarRef.set_data"""
+        self.get_field_to_change(name).data = data
+
+# Conversions between basetypes.
+# See: https://help.sap.com/doc/abapdocu_752_index_htm/7.52/en-US/abenconversion_rules.htm
+# See also: https://www.tutorialspoint.com/sap_abap/sap_abap_operators.htm:
+#     Following is the order of preference −
+#     If one field is of type I, then the other is converted to type I.
+#     If one field is of type P, then the other is converted to type P.
+#     If one field is of type D, then the other is converted to type D. But C and N types are not converted and they are compared directly. Similar is the case with type T.
+#     If one field is of type N and the other is of type C or X, both the fields are converted to type P.
+#     If one field is of type C and the other is of type X, the X type is converted to type C.
+# WARNING: Only some of the rules are here, & those only partly (e.g.
+# values which don't fit are an error, they're never truncated).
+
+def check_length(type, length):
+    if type.length is not None:
+        assertGreaterEqual(type.length, length)
+
+def check_number_length(type, data):
+    """Checks that str(data) fits in type's length (without formatting
+    data, if it's an int)"""
+    if type.length is None: return
+    if data.__class__ is int:
+        if type.min_int <= data <= type.max_int: return
+    check_length(type, len(str(data)))
+
+def check_value_length(type, value):
+    """Checks that value fits in type's length, like
+    check_length(type, value.get_length()), but quicker"""
+    if type.length is None: return
+    value_type = value.type
+    if value_type.length is not None:
+        assertGreaterEqual(type.length, value_type.length)
+    elif value_type.is_numeric():
+        check_number_length(type, value.data)
+    else:
+        check_length(type, value.get_length())
+
+def convert_number_to_number(type, value):
+    check_value_length(type, value)
+    return Value(type, value.data)
+
+def convert_text_to_text(type, value):
+    check_value_length(type, value)
+    return Value(type, value.data)
+
+def convert_text_to_number(type, value):
+    # The text must be a number (blank counts as 0)
+    text = value.data.strip()
+    try:
+        if not text: data = 0
+        elif type.basetype == 'f': data = float(text)
+        else: data = int(text)
+    except ValueError:
+        raise AssertionError("Not a number: {}".format(repr(value.data)))
+    check_number_length(type, data)
+    return Value(type, data)
+
+def convert_number_to_text(type, value):
+    # For c, the number is right-aligned, with its sign after it
+    # ("commercial notation"); for string, it's just the number
+    data = value.data
+    if type.basetype == 'c':
+        text = "{}{}".format(abs(data), '-' if data < 0 else ' ')
+        check_length(type, len(text))
+        text = text.rjust(type.length)
+    else:
+        text = str(data)
+        check_length(type, len(text))
+    return Value(type, text)
+
+def convert_date_to_number(type, value):
+    # The number of days since 01.01.0001 (0 if the date isn't valid)
+    try:
+        days = datetime.strptime(value.data, '%Y%m%d').toordinal() - 1
+    except ValueError:
+        days = 0
+    return convert_number_to_number(type, Value(INT_TYPE, days))
+
+def convert_number_to_date(type, value):
+    # The reverse of convert_date_to_number ('00000000' if out of range)
+    days = int(value.data)
+    if 0 < days <= MAX_DATE_DAYS:
+        day = date.fromordinal(days + 1)
+        text = '{:04}{:02}{:02}'.format(day.year, day.month, day.day)
+    else:
+        text = '00000000'
+    return Value(type, text)
+
+def convert_time_to_number(type, value):
+    # The number of seconds since midnight (0 if the time isn't valid)
+    text = value.data
+    if len(text) == 6 and text.isdigit():
+        seconds = (int(text[0:2]) * 3600 + int(text[2:4]) * 60
+            + int(text[4:6]))
+    else:
+        seconds = 0
+    return convert_number_to_number(type, Value(INT_TYPE, seconds))
+
+def convert_number_to_time(type, value):
+    # The reverse of convert_time_to_number, modulo 24 hours
+    minutes, seconds = divmod(int(value.data) % 86400, 60)
+    hours, minutes = divmod(minutes, 60)
+    text = '{:02}{:02}{:02}'.format(hours, minutes, seconds)
+    return Value(type, text)
+
+def convert_struct_to_struct(type, value):
+    # Field by field, so they need the same fields
+    assertEqual(list(type.fields), list(value.type.fields))
+    struct = Value(type)
+    for name, field in value.iter_fields():
+        struct.set_field(name, field, allow_structs=True)
+    return struct
+
+def convert_ref_to_ref(type, value):
+    # A ref to anything fits REF TO data
+    target_type = type.target_type
+    ref = value.data
+    if target_type is not None and ref is not None:
+        assertTrue(target_type.is_compatible(ref.get().type))
+    return Value(type, ref)
+
+def convert_same_basetype(type, value):
+    check_value_length(type, value)
+    return value
+
+def build_converters():
+    converters = {}
+    for source in BASETYPES:
+        for target in BASETYPES:
+            if source in NUMERIC_BASETYPES:
+                if target in NUMERIC_BASETYPES:
+                    converter = convert_number_to_number
+                elif target == 'd':
+                    converter = convert_number_to_date
+                elif target == 't':
+                    converter = convert_number_to_time
+                elif target in TEXTUAL_BASETYPES and target != 'xstring':
+                    converter = convert_number_to_text
+                else:
+                    converter = None
+            elif source in TEXTUAL_BASETYPES:
+                if target in TEXTUAL_BASETYPES:
+                    converter = convert_text_to_text
+                elif target not in NUMERIC_BASETYPES or source == 'xstring':
+                    converter = None
+                elif source == 'd':
+                    converter = convert_date_to_number
+                elif source == 't':
+                    converter = convert_time_to_number
+                else:
+                    converter = convert_text_to_number
+            elif source == 'struct' and target == 'struct':
+                converter = convert_struct_to_struct
+            elif source == 'ref' and target == 'ref':
+                converter = convert_ref_to_ref
+            else:
+                converter = None
+            if converter is None and source == target:
+                converter = convert_same_basetype
+            if converter is not None:
+                converters[source, target] = converter
+    return converters
+
+# (source basetype, target basetype) -> function(type, value) returning
+# value converted to type
+CONVERTERS = build_converters()
+
+INT_TYPE = get_type('i')
+
+# The number of days from 01.01.0001 to 31.12.9999
+MAX_DATE_DAYS = date(9999, 12, 31).toordinal() - 1
+
 
 class Var:
+    __slots__ = ('name', 'type', 'value')
+
     def __init__(self, name, type, value=None):
         self.name = name.lower()
         self.type = type
-        if value is None: value = Value(type)
-        self.set(value, allow_structs=True)
+        self.value = Value(type)
+        if value is not None: self.set(value, allow_structs=True)
     def __str__(self):
         s = "{}".format(self.name)
         length = self.type.length
@@ -263,32 +771,111 @@ class Var:
     def set(self, value, allow_structs=False):
         value = self.type.convert(value,
             allow_structs=allow_structs)
-        self.value = value
+        if value.type.is_struct():
+            # NOTE: this doesn't copy any fields until one of them is
+            # changed, see Value.copy
+            self.value = value.copy()
+        elif value.type.is_table():
+            # NOTE: tables are changed in place (e.g. by APPEND), so we
+            # need our own
+            self.value.data = value.data.copy()
+        else:
+            # NOTE: we keep our own Value, since value may be someone
+            # else's (see Type.convert), and ours gets changed in place
+            # (see VarRef.set_data)
+            self.value.data = value.data
 
 class Ref:
+    __slots__ = ()
+
     def __init__(self):
         raise NotImplementedError("Don't use Ref directly, use its subclasses!")
     def __repr__(self):
         return "Ref({})".format(self)
 
-class VarRef:
+# Refs say where a value is kept (a Var, a field of a struct a ref
+# refers to, a row of a table...), so it can be read & changed in place.
+# They're what field symbols & data references (values of a RefType)
+# refer to: so they look up the value every time they're used, since
+# e.g. a struct's fields get copied when it's changed (see Value.copy).
+
+class VarRef(Ref):
+    __slots__ = ('var',)
+
     def __init__(self, var):
         self.var = var
     def __str__(self):
         return "REF TO {}".format(self.var)
     def get(self):
         return self.var.get()
-    def set(self, value):
-        self.var.set(value)
+    def get_to_change(self):
+        """Returns the value, for changing its fields in place"""
+        return self.var.get()
+    def set(self, value, allow_structs=False):
+        self.var.set(value, allow_structs=allow_structs)
+    def set_data(self, data):
+        """Sets the data of the value in place: only for data which
+        doesn't need converting to the value's type"""
+        self.var.get().data = data
+    def check_change(self, field_name=None):
+        """Raises an error if the value (or the given field of it) can't
+        be changed"""
+        pass
+
+class StructFieldRef(Ref):
+    """A field of the struct which parent (a ref) refers to"""
+    __slots__ = ('parent', 'field_name')
 
-class StructFieldRef:
-    def __init__(self, struct, field_name):
-        self.struct = struct
+    def __init__(self, parent, field_name):
+        self.parent = parent
         self.field_name = field_name
     def __str__(self):
-        return "REF TO FIELD {} OF {}".format(self.field_name, self.struct)
+        return "REF TO FIELD {} OF {}".format(self.field_name, self.parent)
     def get(self):
-        return self.struct.get_field(self.field_name)
-    def set(self, value):
-        self.struct.set_field(self.field_name, value)
+        return self.parent.get().get_field(self.field_name)
+    def get_to_change(self):
+        return self.parent.get_to_change().get_field_to_change(
+            self.field_name)
+    def set(self, value, allow_structs=False):
+        self.parent.check_change(self.field_name)
+        self.parent.get_to_change().set_field(self.field_name, value,
+            allow_structs=allow_structs)
+    def set_data(self, data):
+        self.parent.check_change(self.field_name)
+        self.parent.get_to_change().set_field_data(self.field_name, data)
+    def check_change(self, field_name=None):
+        self.parent.check_change(self.field_name)
+
+
+class FieldSymbol:
+    """An alias for whatever its ref refers to (if it's assigned).
+    If it has a type, it can only be assigned values of that type."""
+    __slots__ = ('name', 'type', 'ref')
+
+    def __init__(self, name, type=None):
+        self.name = name
+        self.type = type
+        self.ref = None
+    def __str__(self):
+        s = "{} TYPE {}".format(self.name, self.type or 'any')
+        if self.ref is None: return "{} (NOT ASSIGNED)".format(s)
+        return "{} ASSIGNED TO {}".format(s, self.ref)
+    def __repr__(self):
+        return "FieldSymbol({})".format(self)
+    def assign(self, ref):
+        type = self.type
+        if type is not None:
+            value_type = ref.get().type
+            if not type.is_compatible(value_type):
+                raise AssertionError("Can't assign {} to {}".format(
+                    value_type, self.name))
+        self.ref = ref
+    def unassign(self):
+        self.ref = None
+    def get_ref(self):
+        ref = self.ref
+        if ref is None:
+            raise AssertionError("Field symbol not assigned: {}"
+                .format(self.name))
+        return ref
 
@@ -1,95 +1,223 @@
 
 
 
+import re
+import sys
+
+
+# Characters which always form a lexeme on their own
+SINGLE_CHAR_LEXEMES = '.,:'
+SYNTAX_SINGLE_CHAR_LEXEMES = '()[]{}|.'
+
+# How much to read() at a time when lexing a file object
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_chunks(source):
+    """Yields chunks of text from source, which may be a str, a file
+    object, or an iterable of str chunks (e.g. lines)"""
+    if isinstance(source, str):
+        yield source
+    elif hasattr(source, 'read'):
+        yield from iter(lambda: source.read(CHUNK_SIZE), '')
+    else:
+        yield from source
+
+
+def compile_lexer(single_char_lexemes):
+    """Returns a compiled regex whose findall() yields every lexeme of a
+    text (plus an empty string for every comment), in order.
+
+    Whitespace is never matched, so findall() just skips over it.
+    Char literals ('...') and string literals (`...`) are yielded with
+    their closing quote (if any) and doubled quotes still in them;
+    see unquote()."""
+    singles = re.escape(single_char_lexemes)
+    return re.compile(r"""
+          ^\*[^\n]*              # comment: '*' at start of line
+        | "[^\n]*                # comment: '"' until end of line
+        | (   [{singles}]         # single-char lexeme
+            | '(?:[^']|'')*'?     # char literal
+            | `(?:[^`]|``)*`?     # string literal
+            | [^\s{singles}]+     # word
+          )
+    """.format(singles=singles), re.MULTILINE | re.VERBOSE)
+
+LEXER_REGEX = compile_lexer(SINGLE_CHAR_LEXEMES)
+SYNTAX_LEXER_REGEX = compile_lexer(SYNTAX_SINGLE_CHAR_LEXEMES)
+
+
+def unquote(token):
+    """Turns a literal as matched by the lexer regex into a lexeme:
+    the opening quote is kept, the closing one (if any) is dropped,
+    and doubled quotes are collapsed into single ones."""
+    quote = token[0]
+    body = token[1:]
+    n_trailing_quotes = len(body) - len(body.rstrip(quote))
+    if n_trailing_quotes % 2 == 1:
+        # odd number of trailing quotes: the last one closes the literal
+        body = body[:-1]
+    return quote + body.replace(quote + quote, quote)
+
+
+def tokens_to_lexemes(tokens):
+    return [unquote(token) if token[0] in '\'`' else token
+        for token in tokens if token]
+
+
+def iter_lex(source, verbose=False, syntax=False, file=None):
+    """Generator version of lex(), yielding lexemes as soon as source
+    (see iter_chunks) has been read far enough to be sure of them"""
+    if verbose:
+        # Only the state machine knows how to explain itself
+        yield from iter_lex_states(source, verbose=verbose, syntax=syntax,
+            file=file)
+        return
+
+    regex = SYNTAX_LEXER_REGEX if syntax else LEXER_REGEX
+    buffer = ''
+    for chunk in iter_chunks(source):
+        buffer += chunk
+
+        # Only lex complete lines, the last one may continue in the
+        # next chunk
+        cut = buffer.rfind('\n') + 1
+        if not cut: continue
+        tokens = regex.findall(buffer, 0, cut)
+
+        # ...except that literals may contain newlines, so if the last
+        # one runs up to the cut, we need to see the next chunk too
+        carry = ''
+        last_token = tokens[-1] if tokens else ''
+        if last_token[:1] in ('\'', '`') and last_token[-1:] == '\n':
+            carry = tokens.pop()
+
+        yield from tokens_to_lexemes(tokens)
+        buffer = carry + buffer[cut:]
+
+    yield from tokens_to_lexemes(regex.findall(buffer))
+
 def lex(text, verbose=False, syntax=False, file=None):
+    return list(iter_lex(text, verbose=verbose, syntax=syntax, file=file))
+
+def iter_lex_ends(text, pos=0, syntax=False):
+    """Like iter_lex(text[pos:]), but yields (lexeme, end) pairs, where end
+    is the index in text just after the lexeme"""
+    regex = SYNTAX_LEXER_REGEX if syntax else LEXER_REGEX
+    for match in regex.finditer(text, pos):
+        token = match.group(1)
+        if not token: continue
+        lexeme = unquote(token) if token[0] in '\'`' else token
+        yield lexeme, match.end()
+
+
+def iter_lex_states(source, verbose=False, syntax=False, file=None):
+    """The original character-by-character lexer, kept around for
+    --lex-verbose (which prints every state it goes through) and as the
+    reference which lex() must agree with."""
     state = 'newline'
-    lexemes = []
     lexeme = ''
 
     if syntax:
-        SINGLE_CHAR_LEXEMES = '()[]{}|.'
+        single_char_lexemes = SYNTAX_SINGLE_CHAR_LEXEMES
     else:
-        SINGLE_CHAR_LEXEMES = '.,:'
-
-    for i, c in enumerate(text):
-        if verbose: print('{}'.format(repr(c)), file=file)
-        while True:
-            if verbose: print('  {}'.format(state), file=file)
-            if state == 'newline':
-                if c == '*': state = 'eat_comment'
-                else: state = 'eat_whitespace'; continue
-            elif state == 'eat_comment':
-                if c == '\n': state = 'newline'
-                else: pass
-            elif state == 'eat_whitespace':
-                if c == '\n': state = 'newline'
-                elif c.isspace(): pass
-                elif c in SINGLE_CHAR_LEXEMES: lexemes += c
-                elif c == '"': state = 'eat_comment'
-                elif c == '\'': lexeme += c; state = 'eat_char'
-                elif c == '`': lexeme += c; state = 'eat_string'
-                else: state = 'eat_word'; continue
-            elif state == 'eat_char':
-                if c == '\'': state = 'eat_char_escaped'
-                else: lexeme += c
-            elif state == 'eat_char_escaped':
-                if c == '\'': lexeme += c; state = 'eat_char'
-                else:
-                    lexemes.append(lexeme)
-                    lexeme = ''
-                    state = 'eat_whitespace'
-                    continue
-            elif state == 'eat_string':
-                if c == '`': state = 'eat_string_escaped'
-                else: lexeme += c
-            elif state == 'eat_string_escaped':
-                if c == '`': lexeme += c; state = 'eat_string'
-                else:
-                    lexemes.append(lexeme)
-                    lexeme = ''
-                    state = 'eat_whitespace'
-                    continue
-            elif state == 'eat_word':
-                if c.isspace() or c in SINGLE_CHAR_LEXEMES:
-                    lexemes.append(lexeme)
-                    lexeme = ''
-                    state = 'eat_whitespace'
-                    continue
-                else: lexeme += c
-            break
-
-    if lexeme: lexemes.append(lexeme)
-    return lexemes
+        single_char_lexemes = SINGLE_CHAR_LEXEMES
 
+    for chunk in iter_chunks(source):
+        for c in chunk:
+            if verbose: print('{}'.format(repr(c)), file=file)
+            while True:
+                if verbose: print('  {}'.format(state), file=file)
+                if state == 'newline':
+                    if c == '*': state = 'eat_comment'
+                    else: state = 'eat_whitespace'; continue
+                elif state == 'eat_comment':
+                    if c == '\n': state = 'newline'
+                    else: pass
+                elif state == 'eat_whitespace':
+                    if c == '\n': state = 'newline'
+                    elif c.isspace(): pass
+                    elif c in single_char_lexemes: yield c
+                    elif c == '"': state = 'eat_comment'
+                    elif c == '\'': lexeme += c; state = 'eat_char'
+                    elif c == '`': lexeme += c; state = 'eat_string'
+                    else: state = 'eat_word'; continue
+                elif state == 'eat_char':
+                    if c == '\'': state = 'eat_char_escaped'
+                    else: lexeme += c
+                elif state == 'eat_char_escaped':
+                    if c == '\'': lexeme += c; state = 'eat_char'
+                    else:
+                        yield lexeme
+                        lexeme = ''
+                        state = 'eat_whitespace'
+                        continue
+                elif state == 'eat_string':
+                    if c == '`': state = 'eat_string_escaped'
+                    else: lexeme += c
+                elif state == 'eat_string_escaped':
+                    if c == '`': lexeme += c; state = 'eat_string'
+                    else:
+                        yield lexeme
+                        lexeme = ''
+                        state = 'eat_whitespace'
+                        continue
+                elif state == 'eat_word':
+                    if c.isspace() or c in single_char_lexemes:
+                        yield lexeme
+                        lexeme = ''
+                        state = 'eat_whitespace'
+                        continue
+                    else: lexeme += c
+                break
 
-def to_stmts(lexemes, syntax=False):
-    stmts = []
+    if lexeme: yield lexeme
+
+def lex_states(text, verbose=False, syntax=False, file=None):
+    return list(iter_lex_states(text, verbose=verbose, syntax=syntax,
+        file=file))
+
+
+def iter_stmts(lexemes, syntax=False):
+    """Generator version of to_stmts()
+
+    Stmts are tuples of interned lexemes: e.g. all the 'type' lexemes in
+    a program are the same str object (so comparing them is an identity
+    check), and the stmts of a chain all point at the same lexemes of
+    their common prefix."""
     stmt = []
-    chain_prefix = []
+    chain_prefix = ()
 
-    for i, lexeme in enumerate(lexemes):
+    # lexeme as lexed -> interned lexeme as it goes into stmts
+    interned = {}
+
+    for lexeme in lexemes:
         if lexeme == ':':
             if chain_prefix:
                 raise ValueError("Unexpected ':' "
                     "(can't have more than 1 in same statement)")
-            chain_prefix = stmt
+            chain_prefix = tuple(stmt)
             stmt = []
         elif lexeme == ',' or lexeme == '.':
             if lexeme == ',' and not chain_prefix:
                 raise ValueError("Unexpected ',' "
                     "(need to start a chained statement with ':')")
-            stmts.append(chain_prefix + stmt)
+            yield chain_prefix + tuple(stmt)
             stmt = []
             if lexeme == '.':
-                chain_prefix = []
-        elif lexeme.startswith('\'') or lexeme.startswith('`'):
-            stmt.append(lexeme)
+                chain_prefix = ()
         else:
-            if syntax: stmt.append(lexeme)
-            else: stmt.append(lexeme.lower())
+            stmt_lexeme = interned.get(lexeme)
+            if stmt_lexeme is None:
+                if syntax or lexeme[0] in '\'`':
+                    stmt_lexeme = sys.intern(lexeme)
+                else:
+                    stmt_lexeme = sys.intern(lexeme.lower())
+                interned[lexeme] = stmt_lexeme
+            stmt.append(stmt_lexeme)
 
     if chain_prefix or stmt:
         raise ValueError("Missing '.' at end of statement")
 
-    return stmts
-
+def to_stmts(lexemes, syntax=False):
+    return list(iter_stmts(lexemes, syntax=syntax))
@@ -1,13 +1,19 @@
 #!/bin/env python
 
-from abippity.lex import lex, to_stmts
-from abippity.parse import (get_keywords, parse, group,
+import sys
+
+from abippity.lex import iter_lex, iter_stmts
+from abippity.parse import (get_keywords, iter_parse, iter_group,
     print_keywords, print_grouped_stmts)
 from abippity.run import Runner
+from abippity.programs import compile, cache_info
 
+# (name, arg) for boolean options, (name, arg, type) for options taking
+# a value, e.g. "--parse-jobs 4"
 OPTIONS = [
     # general
     ('PRINT_KEYWORDS', '--keywords'),
+    ('PRINT_CACHE_INFO', '--cache-info'),
 
     # lexing arguments
     ('LEX', '--lex'),
@@ -19,6 +25,7 @@ OPTIONS = [
     # parsing options
     ('PARSE', '--parse'),
     ('PARSE_VERBOSE', '--parse-verbose'),
+    ('PARSE_JOBS', '--parse-jobs', int),
     ('PRINT_PARSED_STMTS', '--parsed-stmts'),
 
     # grouping options
@@ -30,27 +37,70 @@ OPTIONS = [
     ('RUN', '--run'),
     ('RUN_VERBOSE', '--run-verbose'),
     ('PRINT_REPORT', '--report'),
+    ('STREAM_REPORT', '--stream'), # print report's lines as they're written
     ('PRINT_VARS', '--vars'),
     ('VERBOSE_BOOLS', '--verbose-bools'),
+    ('SCREEN', '--screen', str), # e.g. mmap, see abippity.internals.SCREENS
+
+    # limits, see abippity.run.Runner
+    ('MAX_STMTS', '--max-stmts', int),
+    ('MAX_TIME', '--max-time', int), # seconds
+    ('MAX_LINES', '--max-lines', int),
+    ('MAX_MEMORY', '--max-memory', int), # KiB
 ]
 
 
 
 
-def list_args():
+def list_args(names=None):
+    """Returns the args of OPTIONS, or only of those named in names"""
     args = []
-    for name, arg in OPTIONS:
+    for option in OPTIONS:
+        if names is not None and option[0] not in names: continue
+        arg = option[1]
+        if len(option) > 2: arg += ' N'
         args.append(arg)
     return args
 
-def parse_options(args):
+def parse_options(args, names=None):
+    """Returns a dict of option name -> value, from args.
+    If names is given, only the options named in it may be given in args
+    (e.g. to people running documents on a server)."""
     options = {}
-    for name, arg in OPTIONS:
-        options[name] = arg in args
+    for option in OPTIONS:
+        name, arg = option[:2]
+        if names is not None and name not in names:
+            if arg in args:
+                raise ValueError("Not allowed: {}".format(arg))
+            options[name] = None if len(option) > 2 else False
+        elif len(option) > 2:
+            type = option[2]
+            options[name] = None
+            if arg in args:
+                i = args.index(arg)
+                if i + 1 >= len(args):
+                    raise ValueError("Expected a value after {}"
+                        .format(arg))
+                options[name] = type(args[i + 1])
+        else:
+            options[name] = arg in args
     return options
 
 
 def main(text, options, keywords=None, file=None):
+    """Runs abippity on text, which may also be a file object or an
+    iterable of chunks of text (see abippity.lex.iter_chunks).
+
+    The stages (lexing, parsing, grouping, running) are chained
+    generators, so toplevel stmts start running while text is still
+    being read.
+    A stage is only finished in one go if it's the last one, or if we
+    were asked to print its results or be verbose about it (so that its
+    output isn't interleaved with that of other stages).
+
+    If text is a str and we don't need to print anything before running,
+    the program (already built into nodes, see abippity.nodes) comes from
+    abippity.compile, i.e. it's cached."""
 
     # option chaining
     RUN = options.get('RUN')
@@ -63,10 +113,22 @@ def main(text, options, keywords=None, file=None):
     if options.get('PRINT_KEYWORDS'):
         print_keywords(keywords, file=file)
 
+    # Can we just get the grouped stmts from the cache?
+    COMPILE = GROUP and isinstance(text, str) and not any(
+        options.get(name) for name in (
+            'LEX_VERBOSE', 'LEX_SYNTAX', 'PRINT_LEXEMES', 'PRINT_STMTS',
+            'PARSE_VERBOSE', 'PARSE_JOBS', 'PRINT_PARSED_STMTS',
+            'GROUP_VERBOSE', 'PRINT_GROUPED_STMTS'))
+    if COMPILE:
+        LEX = PARSE = GROUP = False
+        grouped_stmts = compile(text, keywords=keywords)
+
     if LEX:
         # lex text into lexemes
-        lexemes = lex(text, verbose=options.get('LEX_VERBOSE'),
+        lexemes = iter_lex(text, verbose=options.get('LEX_VERBOSE'),
             syntax=options.get('LEX_SYNTAX'), file=file)
+        if options.get('LEX_VERBOSE') or options.get('PRINT_LEXEMES'):
+            lexemes = list(lexemes)
         if options.get('PRINT_LEXEMES'):
             for lexeme in lexemes:
                 print(lexeme, file=file)
@@ -74,15 +136,20 @@ def main(text, options, keywords=None, file=None):
 
     if PARSE:
         # get stmts (lists of lexemes representing ABAP commands)
-        stmts = to_stmts(lexemes)
+        stmts = iter_stmts(lexemes)
         if options.get('PRINT_STMTS'):
+            stmts = list(stmts)
             for stmt in stmts:
                 print(stmt, file=file)
 
         # parse stmts (transform lists of lexemes into pairs of
         # (keyword:str, captures:dict))
-        parsed_stmts = parse(stmts,
-            verbose=options.get('PARSE_VERBOSE'), file=file)
+        parsed_stmts = iter_parse(stmts, keywords=keywords,
+            verbose=options.get('PARSE_VERBOSE'), file=file,
+            jobs=options.get('PARSE_JOBS'))
+        if (not GROUP or options.get('PARSE_VERBOSE') or
+                options.get('PRINT_PARSED_STMTS')):
+            parsed_stmts = list(parsed_stmts)
         if options.get('PRINT_PARSED_STMTS'):
             print("PARSED STATEMENTS:", file=file)
             for parsed_stmt in parsed_stmts:
@@ -91,21 +158,37 @@ def main(text, options, keywords=None, file=None):
     if GROUP:
         # group stmts (stick groups of stmts inside other stmt's captures,
         # forming a hierarchy of blocks of code)
-        grouped_stmts = group(parsed_stmts,
+        grouped_stmts = iter_group(parsed_stmts,
             verbose=options.get('GROUP_VERBOSE'), file=file)
+        if (not RUN or options.get('GROUP_VERBOSE') or
+                options.get('PRINT_GROUPED_STMTS')):
+            grouped_stmts = list(grouped_stmts)
         if options.get('PRINT_GROUPED_STMTS'):
             print("GROUPED STATEMENTS:", file=file)
             print_grouped_stmts(grouped_stmts, 1, file=file)
 
+    if options.get('PRINT_CACHE_INFO'):
+        print("CACHE INFO: {}".format(cache_info()), file=file)
+
     if RUN:
         # run grouped stmts
+        stream = None
+        if options.get('STREAM_REPORT'):
+            stream = sys.stdout if file is None else file
         runner = Runner(40, 20,
             verbose=options.get('RUN_VERBOSE'),
             verbose_bools=options.get('VERBOSE_BOOLS'),
-            file=file)
-        report = runner.run(grouped_stmts, toplevel=True)
-        if options.get('PRINT_REPORT'):
-            report.print(file=file)
+            file=file, screen=options.get('SCREEN') or 'memory',
+            stream=stream, max_stmts=options.get('MAX_STMTS'),
+            max_time=options.get('MAX_TIME'),
+            max_lines=options.get('MAX_LINES'),
+            max_memory=options.get('MAX_MEMORY'))
+        try:
+            report = runner.run(grouped_stmts, toplevel=True)
+            if options.get('PRINT_REPORT') and stream is None:
+                report.print(file=file)
+        finally:
+            runner.screen.close()
         if options.get('PRINT_VARS'):
             for var in runner.vars.values():
                 print("{}".format(var), file=file)
@@ -114,7 +197,6 @@ def main(text, options, keywords=None, file=None):
 
 if __name__ == '__main__':
     from sys import stdin, stdout, argv
-    text = stdin.read()
     args = argv[1:]
     options = parse_options(args)
-    main(text, options)
+    main(stdin, options)
@@ -0,0 +1,530 @@
+
+import re
+import operator
+
+from .symbols import SymbolTable
+from .conditions import compile_condition
+from .assertions import *
+
+
+# The nodes of a compiled program.
+# Grouped stmts are (keyword, captures) pairs, where captures is a dict
+# of whatever the grammar matched; build_node turns each of them into a
+# node, which has just the attributes the Runner needs, already picked
+# out of the captures & worked out.
+# Operands are resolved by the program's SymbolTable into accessors (see
+# symbols.Operand), so the Runner doesn't need to look at their text.
+
+
+class Node:
+    __slots__ = ()
+    hidden_slots = () # left out of repr
+
+    def __repr__(self):
+        hidden_slots = self.hidden_slots
+        names = [name for cls in reversed(type(self).__mro__)
+            for name in getattr(cls, '__slots__', ())
+            if name not in hidden_slots]
+        return "{}({})".format(type(self).__name__, ', '.join(
+            "{}={}".format(name, repr(getattr(self, name)))
+            for name in names))
+
+
+class Condition(Node):
+    """A log_exp (see Runner.eval_bool).
+    An empty one (e.g. for an ELSE) is true.
+    Its predicate is compiled when it's created, see
+    conditions.compile_condition."""
+    __slots__ = ('sub_cond', 'negate', 'op', 'test', 'operand1',
+        'operand2', 'connective', 'rhs_cond', 'predicate')
+    hidden_slots = ('predicate',)
+
+    def __init__(self, sub_cond=None, negate=False, op=None, test=None,
+            operand1=None, operand2=None, connective=None, rhs_cond=None):
+        self.sub_cond = sub_cond # Condition
+        self.negate = negate # whether to negate sub_cond or test
+        self.op = op # e.g. 'eq', 'lt', 'ca'
+        self.test = test # 'initial', 'bound' or 'assigned' (of operand1)
+        self.operand1 = operand1
+        self.operand2 = operand2
+        self.connective = connective # 'and', 'or', 'equiv'
+        self.rhs_cond = rhs_cond # Condition
+        self.predicate = compile_condition(self)
+
+
+class ReportStmt(Node):
+    __slots__ = ('title',)
+    def __init__(self, title):
+        self.title = title
+
+class DataDecl(Node):
+    """DATA var TYPE abap_type... or DATA var LIKE [LINE OF] dobj...
+    or DATA ref TYPE REF TO type|LIKE REF TO dobj"""
+    __slots__ = ('name', 'slot', 'type_text', 'length', 'like', 'line_of',
+        'ref_to', 'value')
+    def __init__(self, name, slot=None, type_text=None, length=None,
+            like=None, line_of=False, ref_to=False, value=None):
+        self.name = name
+        self.slot = slot # None for the fields of a struct
+        self.type_text = type_text
+        self.length = length
+        self.like = like # dobj Operand
+        self.line_of = line_of # whether it's LIKE LINE OF like
+        self.ref_to = ref_to # whether it's a ref to the type
+        self.value = value # value Operand
+
+class FieldSymbolDecl(Node):
+    """FIELD-SYMBOLS <fs> [TYPE type|LIKE [LINE OF] dobj]"""
+    __slots__ = ('name', 'slot', 'type_text', 'like', 'line_of')
+    def __init__(self, name, slot, type_text=None, like=None,
+            line_of=False):
+        self.name = name
+        self.slot = slot
+        self.type_text = type_text # None (or e.g. 'any') for any type
+        self.like = like # dobj Operand
+        self.line_of = line_of # whether it's LIKE LINE OF like
+
+class TableDecl(Node):
+    """DATA itab TYPE|LIKE STANDARD|SORTED|HASHED TABLE OF... [WITH...]"""
+    __slots__ = ('name', 'slot', 'kind', 'type_text', 'like', 'keys')
+    def __init__(self, name, kind, type_text=None, like=None, keys=(),
+            slot=None):
+        self.name = name
+        self.slot = slot # None for the fields of a struct
+        self.kind = kind # 'standard', 'sorted' or 'hashed'
+        self.type_text = type_text # of the lines
+        self.like = like # dobj Operand whose type the lines have
+        # tuple of (name, kind, unique, components), see tables.TableType
+        self.keys = keys
+
+class StructDecl(Node):
+    """DATA BEGIN OF struc... DATA END OF struc"""
+    __slots__ = ('name', 'slot', 'fields')
+    def __init__(self, name, fields, slot=None):
+        self.name = name
+        self.slot = slot # None for the fields of a struct
+        self.fields = fields # tuple of DataDecls & StructDecls
+
+class Move(Node):
+    __slots__ = ('source', 'destination')
+    def __init__(self, source, destination):
+        self.source = source
+        self.destination = destination
+
+class Assign(Node):
+    """lhs = rhs"""
+    __slots__ = ('lhs', 'rhs')
+    def __init__(self, lhs, rhs):
+        self.lhs = lhs
+        self.rhs = rhs
+
+class AssignFieldSymbol(Node):
+    """ASSIGN mem_area TO <fs>"""
+    __slots__ = ('mem_area', 'field_symbol')
+    def __init__(self, mem_area, field_symbol):
+        self.mem_area = mem_area # Operand
+        self.field_symbol = field_symbol # FieldSymbolAccess
+
+class Unassign(Node):
+    __slots__ = ('field_symbol',)
+    def __init__(self, field_symbol):
+        self.field_symbol = field_symbol # FieldSymbolAccess
+
+class GetReference(Node):
+    """GET REFERENCE OF dobj INTO dref"""
+    __slots__ = ('dobj', 'dref')
+    def __init__(self, dobj, dref):
+        self.dobj = dobj
+        self.dref = dref
+
+class CreateData(Node):
+    """CREATE DATA dref [TYPE type|LIKE dobj]"""
+    __slots__ = ('dref', 'type_text', 'like')
+    def __init__(self, dref, type_text=None, like=None):
+        self.dref = dref
+        self.type_text = type_text # None for dref's own type's target
+        self.like = like # dobj Operand
+
+class Arithmetic(Node):
+    """ADD, SUBTRACT, MULTIPLY, DIVIDE: dest = dest <op> src.
+    Subclasses say which function does the op to the values' data."""
+    __slots__ = ('src', 'dest')
+    op = None
+    def __init__(self, src, dest):
+        self.src = src
+        self.dest = dest
+
+class Add(Arithmetic):
+    __slots__ = ()
+    op = operator.add
+
+class Subtract(Arithmetic):
+    __slots__ = ()
+    op = operator.sub
+
+class Multiply(Arithmetic):
+    __slots__ = ()
+    op = operator.mul
+
+class Divide(Arithmetic):
+    __slots__ = ()
+    op = operator.floordiv
+
+class Append(Node):
+    """APPEND wa TO itab"""
+    __slots__ = ('wa', 'itab')
+    def __init__(self, wa, itab):
+        self.wa = wa
+        self.itab = itab
+
+class Insert(Node):
+    """INSERT wa INTO TABLE itab"""
+    __slots__ = ('wa', 'itab')
+    def __init__(self, wa, itab):
+        self.wa = wa
+        self.itab = itab
+
+class ReadTable(Node):
+    """READ TABLE itab INDEX idx|WITH [TABLE] KEY... [USING KEY...]
+    [INTO wa|ASSIGNING <fs>|REFERENCE INTO dref]"""
+    __slots__ = ('itab', 'index', 'components', 'values', 'key_name',
+        'wa', 'assigning', 'reference_into')
+    def __init__(self, itab, index=None, components=(), values=(),
+            key_name=None, wa=None, assigning=None, reference_into=None):
+        self.itab = itab
+        self.index = index # Operand, or None to read by key
+        self.components = components # tuple of component names
+        self.values = values # tuple of Operands, one per component
+        self.key_name = key_name # None for the primary key
+        self.wa = wa # Operand, or None
+        self.assigning = assigning # FieldSymbolAccess, or None
+        self.reference_into = reference_into # Operand, or None
+
+class LoopAt(Node):
+    """LOOP AT itab [INTO wa|ASSIGNING <fs>|REFERENCE INTO dref]
+    [USING KEY...]... ENDLOOP"""
+    __slots__ = ('itab', 'wa', 'assigning', 'reference_into', 'key_name',
+        'block')
+    def __init__(self, itab, block, wa=None, assigning=None,
+            reference_into=None, key_name=None):
+        self.itab = itab
+        self.block = block
+        self.wa = wa # Operand, or None
+        self.assigning = assigning # FieldSymbolAccess, or None
+        self.reference_into = reference_into # Operand, or None
+        self.key_name = key_name # None for the primary key
+
+class Assert(Node):
+    __slots__ = ('cond',)
+    def __init__(self, cond):
+        self.cond = cond
+
+class Check(Node):
+    __slots__ = ('cond',)
+    def __init__(self, cond):
+        self.cond = cond
+
+class If(Node):
+    __slots__ = ('branches',)
+    def __init__(self, branches):
+        # tuple of (Condition, block) for IF, ELSEIFs, ELSE
+        self.branches = branches
+
+class While(Node):
+    __slots__ = ('cond', 'block')
+    def __init__(self, cond, block):
+        self.cond = cond
+        self.block = block
+
+class Do(Node):
+    __slots__ = ('n', 'block')
+    def __init__(self, n, block):
+        self.n = n # Operand for number of times, or None for "forever"
+        self.block = block
+
+class Continue(Node):
+    __slots__ = ()
+
+class Exit(Node):
+    __slots__ = ()
+
+class Write(Node):
+    __slots__ = ('newline', 'dobj', 'nozero', 'nogap')
+    def __init__(self, dobj, newline=False, nozero=False, nogap=False):
+        self.dobj = dobj
+        self.newline = newline
+        self.nozero = nozero
+        self.nogap = nogap
+
+class Uline(Node):
+    __slots__ = ()
+
+class Skip(Node):
+    __slots__ = ('n', 'to_line')
+    def __init__(self, n=1, to_line=None):
+        self.n = n
+        self.to_line = to_line
+
+
+
+# (test, name of its operand's capture), see Runner.eval_bool
+TESTS = (
+    ('initial', 'operand'),
+    ('bound', 'ref'),
+    ('assigned', '<fs>'),
+)
+
+def build_condition(captures, symbols):
+    sub_cond = None
+    negate = False
+    op = None
+    test = None
+    operand1 = operand2 = None
+    if 'sub_exp' in captures:
+        sub_cond = build_condition(captures['sub_exp'], symbols)
+        negate = 'not' in captures
+    elif 'op' in captures:
+        op = list(captures['op'])[0]
+        operand1 = symbols.resolve(captures['operand1'])
+        operand2 = symbols.resolve(captures['operand2'])
+    else:
+        for test, operand_name in TESTS:
+            if test in captures:
+                operand1 = symbols.resolve(captures[operand_name])
+                negate = 'not' in captures
+                break
+        else:
+            test = None
+
+    connective = None
+    rhs_cond = None
+    if 'rhs_exp' in captures:
+        rhs_cond = build_condition(captures['rhs_exp'], symbols)
+        for connective in ('and', 'or', 'equiv'):
+            if connective in captures: break
+        else:
+            raise AssertionError(
+                "Weird right-hand side of condition: {}"
+                .format(captures))
+
+    return Condition(sub_cond=sub_cond, negate=negate, op=op, test=test,
+        operand1=operand1, operand2=operand2,
+        connective=connective, rhs_cond=rhs_cond)
+
+def build_table_keys(captures):
+    keys = []
+    for key_captures in captures.get('tabkeys', ()):
+        if 'empty' in key_captures:
+            keys.append((None, None, False, ()))
+            continue
+        name = key_captures.get('keyname')
+        kind = None
+        for kind in ('sorted', 'hashed'):
+            if kind in key_captures: break
+        else:
+            kind = None
+        components = None # the default key
+        if 'default' not in key_captures:
+            components = tuple(component['comp']
+                for component in key_captures['components'])
+        keys.append((name, kind, 'unique' in key_captures, components))
+    return tuple(keys)
+
+def build_data(keyword, captures, symbols, is_field=False):
+    if keyword == 'data' and 'itab' in captures:
+        name = captures['itab']
+        for kind in ('standard', 'sorted', 'hashed'):
+            if kind in captures: break
+        else:
+            raise AssertionError("Weird table kind: {}".format(captures))
+        if 'refto' in captures:
+            raise ValueError("Not implemented: TABLE OF REF TO")
+        like = captures.get('dobj')
+        if like is not None: like = symbols.resolve(like)
+        return TableDecl(name, kind, type_text=captures.get('type'),
+            like=like, keys=build_table_keys(captures),
+            slot=None if is_field else symbols.get_slot(name))
+    elif keyword == 'data' and 'ref' in captures:
+        name = captures['ref']
+        like = captures.get('dobj')
+        if like is not None: like = symbols.resolve(like)
+        return DataDecl(name,
+            slot=None if is_field else symbols.get_slot(name),
+            type_text=captures.get('type'), like=like, ref_to=True)
+    elif keyword == 'data':
+        var_text = captures['var']
+        value = captures.get('val')
+        if value is not None: value = symbols.resolve(value)
+        if 'dobj' in captures:
+            return DataDecl(var_text,
+                slot=None if is_field else symbols.get_slot(var_text),
+                like=symbols.resolve(captures['dobj']),
+                line_of='lineof' in captures, value=value)
+
+        match = re.fullmatch(
+            r'(?P<name>[a-zA-Z_][a-zA-Z_0-9]*)(\((?P<length>[0-9]+)\))?',
+            var_text)
+        groupdict = match.groupdict()
+        name = groupdict['name']
+        length = groupdict['length']
+        len_text = captures.get('len')
+        assertFalse(length is not None and len_text is not None)
+        if len_text is not None: length = int(len_text)
+        if length: length = int(length)
+        return DataDecl(name,
+            slot=None if is_field else symbols.get_slot(name),
+            type_text=captures['abap_type'], length=length, value=value)
+    elif keyword == 'data_begin':
+        name = captures['struc']
+        fields = []
+        for field_keyword, field_captures in captures['block']:
+            assertIn(field_keyword, {'data', 'data_begin'})
+            fields.append(build_data(field_keyword, field_captures,
+                symbols, is_field=True))
+        return StructDecl(name, tuple(fields),
+            slot=None if is_field else symbols.get_slot(name))
+    else:
+        raise AssertionError("Weird keyword: {}".format(keyword))
+
+def build_field_symbols(keyword, captures, symbols):
+    name = captures['<fs>']
+    like = captures.get('dobj')
+    if like is not None: like = symbols.resolve(like)
+    elif 'lineof' in captures:
+        raise ValueError("Not implemented: TYPE LINE OF")
+    return FieldSymbolDecl(name, symbols.get_slot(name),
+        type_text=captures.get('type'), like=like,
+        line_of='lineof' in captures)
+
+def build_create(keyword, captures, symbols):
+    like = captures.get('dobj')
+    if like is not None: like = symbols.resolve(like)
+    return CreateData(symbols.resolve(captures['dref']),
+        type_text=captures.get('type'), like=like)
+
+def build_assign(keyword, captures, symbols):
+    lhs_list = captures['lhs']
+    rhs_list = captures['rhs']
+    assertEqual(len(lhs_list), 1)
+    if len(rhs_list) == 1:
+        rhs = symbols.resolve(rhs_list[0])
+    else:
+        rhs = symbols.resolve_call(rhs_list)
+    return Assign(symbols.resolve(lhs_list[0]), rhs)
+
+def build_if(keyword, captures, symbols):
+    return If(tuple((build_condition(part, symbols),
+        build_block(part['block'], symbols)) for part in captures))
+
+def build_write(keyword, captures, symbols):
+    at = captures.get('at')
+    nozero = False
+    for option in captures['int_format_options']:
+        if 'nozero' in option:
+            nozero = True
+    return Write(symbols.resolve(captures['dobj']),
+        newline=bool(at and at.startswith('/')),
+        nozero=nozero, nogap='nogap' in captures)
+
+def build_do(keyword, captures, symbols):
+    n = captures.get('n')
+    if n is not None: n = symbols.resolve(n)
+    return Do(n, build_block(captures['block'], symbols))
+
+def build_read(keyword, captures, symbols):
+    keys = captures.get('keys', ())
+    index = captures.get('idx')
+    if index is not None: index = symbols.resolve(index)
+    wa, assigning, reference_into = build_result(captures, symbols)
+    return ReadTable(symbols.resolve(captures['itab']), index=index,
+        components=tuple(key['comp'] for key in keys),
+        values=tuple(symbols.resolve(key['val']) for key in keys),
+        key_name=captures.get('keyname'), wa=wa, assigning=assigning,
+        reference_into=reference_into)
+
+def build_loop(keyword, captures, symbols):
+    wa, assigning, reference_into = build_result(captures, symbols)
+    return LoopAt(symbols.resolve(captures['itab']),
+        build_block(captures['block'], symbols),
+        wa=wa, assigning=assigning, reference_into=reference_into,
+        key_name=captures.get('keyname'))
+
+def build_result(captures, symbols):
+    """Returns the Operands (or None) where READ TABLE or LOOP AT puts
+    rows: (wa, <fs>, dref)"""
+    return tuple(None if text is None else symbols.resolve(text)
+        for text in (captures.get(name) for name in ('wa', '<fs>', 'dref')))
+
+def build_arithmetic(Arithmetic, src_name, dest_name):
+    def build(keyword, captures, symbols):
+        return Arithmetic(symbols.resolve(captures[src_name]),
+            symbols.resolve(captures[dest_name]))
+    return build
+
+# keyword -> function(keyword, captures, symbols) returning its node
+NODE_BUILDERS = {
+    'report': lambda keyword, captures, symbols: ReportStmt(captures['rep']),
+    'data': build_data,
+    'data_begin': build_data,
+    'field-symbols': build_field_symbols,
+    'assign': lambda keyword, captures, symbols: AssignFieldSymbol(
+        symbols.resolve(captures['mem_area']),
+        symbols.resolve(captures['<fs>'])),
+    'unassign': lambda keyword, captures, symbols: Unassign(
+        symbols.resolve(captures['<fs>'])),
+    'get': lambda keyword, captures, symbols: GetReference(
+        symbols.resolve(captures['dobj']), symbols.resolve(captures['dref'])),
+    'create': build_create,
+    'move': lambda keyword, captures, symbols: Move(
+        symbols.resolve(captures['source']),
+        symbols.resolve(captures['destination'])),
+    '=': build_assign,
+    'add': build_arithmetic(Add, 'dobj1', 'dobj2'),
+    'subtract': build_arithmetic(Subtract, 'dobj1', 'dobj2'),
+    'multiply': build_arithmetic(Multiply, 'dobj2', 'dobj1'),
+    'divide': build_arithmetic(Divide, 'dobj2', 'dobj1'),
+    'assert': lambda keyword, captures, symbols: Assert(
+        build_condition(captures, symbols)),
+    'check': lambda keyword, captures, symbols: Check(
+        build_condition(captures, symbols)),
+    'if': build_if,
+    'while': lambda keyword, captures, symbols: While(
+        build_condition(captures, symbols),
+        build_block(captures['block'], symbols)),
+    'do': build_do,
+    'continue': lambda keyword, captures, symbols: Continue(),
+    'exit': lambda keyword, captures, symbols: Exit(),
+    'write': build_write,
+    'uline': lambda keyword, captures, symbols: Uline(),
+    'skip': lambda keyword, captures, symbols: Skip(captures.get('n', 1),
+        captures.get('line')),
+    'append': lambda keyword, captures, symbols: Append(
+        symbols.resolve(captures['wa']), symbols.resolve(captures['itab'])),
+    'insert': lambda keyword, captures, symbols: Insert(
+        symbols.resolve(captures['wa']), symbols.resolve(captures['itab'])),
+    'read': build_read,
+    'loop': build_loop,
+}
+
+def build_node(grouped_stmt, symbols):
+    """Returns the node for grouped_stmt (or grouped_stmt itself, if it's
+    already a node), resolving its operands with symbols (a
+    symbols.SymbolTable)"""
+    if isinstance(grouped_stmt, Node): return grouped_stmt
+    keyword, captures = grouped_stmt
+    builder = NODE_BUILDERS.get(keyword)
+    if builder is None:
+        raise ValueError('Keyword not implemented: {}'
+            .format(keyword))
+    return builder(keyword, captures, symbols)
+
+def iter_nodes(grouped_stmts, symbols):
+    for grouped_stmt in grouped_stmts:
+        yield build_node(grouped_stmt, symbols)
+
+def build_block(grouped_stmts, symbols=None):
+    """Returns the nodes of grouped_stmts, as a tuple.
+    If symbols isn't given, a new SymbolTable is used (so the nodes are a
+    program of their own)"""
+    if symbols is None: symbols = SymbolTable()
+    return tuple(iter_nodes(grouped_stmts, symbols))
@@ -1,5 +1,12 @@
 
+import os
 import re
+import sys
+import marshal
+import hashlib
+import threading
+from itertools import islice
+from collections import OrderedDict, deque
 from .lex import lex, to_stmts
 from .assertions import *
 
@@ -8,14 +15,73 @@ def isidentifier(s):
     return s and all(c == '_' or c.isalnum() for c in s)
 
 
+class KeywordLexemes(dict):
+    """Maps keywords of the syntax (e.g. 'NO-GAP') to the interned
+    lexeme they match (e.g. 'no-gap'), see lex.iter_stmts"""
+    def __missing__(self, syntax_part):
+        lexeme = self[syntax_part] = sys.intern(syntax_part.lower())
+        return lexeme
+
+KEYWORD_LEXEMES = KeywordLexemes()
+
+
+# Bump this whenever the structure returned by build_keywords changes,
+# so that old snapshots of it get ignored
+GRAMMAR_VERSION = 1
+
+
 def get_keywords_text():
-    import os
     filepath = os.path.join(os.path.dirname(__file__), 'syntax.txt')
     with open(filepath) as f: text = f.read()
     return text
 
+def get_keywords_snapshot_path(text):
+    """Returns the path of the snapshot of the keywords built from text.
+    Like .pyc files, snapshots live in __pycache__, and their name says
+    what they were built from & how."""
+    digest = hashlib.sha1(text.encode()).hexdigest()
+    filename = 'syntax.{}.v{}.marshal{}'.format(digest,
+        GRAMMAR_VERSION, marshal.version)
+    return os.path.join(os.path.dirname(__file__), '__pycache__',
+        filename)
+
+def load_keywords(text):
+    """Like build_keywords(text), but from its snapshot if there is one.
+    If there isn't, we try to save one for next time."""
+    path = get_keywords_snapshot_path(text)
+    try:
+        with open(path, 'rb') as f: return marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    keywords = build_keywords(text)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file & rename, so other processes never see a
+        # partially written snapshot
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f: marshal.dump(keywords, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        # e.g. read-only install, whatever, we'll build it next time
+        pass
+    return keywords
+
+_keywords = None
+_keywords_lock = threading.Lock()
+
 def get_keywords():
-    text = get_keywords_text()
+    """Returns the keywords (i.e. the grammar) described by syntax.txt,
+    loading them only once per process.
+    NOTE: They're shared by everyone, so don't modify them!"""
+    global _keywords
+    if _keywords is None:
+        with _keywords_lock:
+            if _keywords is None:
+                _keywords = load_keywords(get_keywords_text())
+    return _keywords
+
+def build_keywords(text):
     lexemes = lex(text, syntax=True)
     stmts = to_stmts(lexemes, syntax=True)
 
@@ -91,22 +157,101 @@ def print_keywords(keywords=None, file=None):
         print_syntax(syntax, 1, file=file)
 
 
-def parse(stmts, verbose=False, keywords=None, file=None):
+# Stmts with at least this many lexemes are parsed with memoizing
+# matchers: they're slower, but can't blow up however much backtracking
+# the syntax makes them do
+MEMO_MIN_STMT_LENGTH = 64
+
+# How many distinct stmts iter_parse remembers the parsed stmts of, so
+# that repeated stmts (like "ULINE." or "ADD 1 TO counter.") are only
+# parsed once
+PARSE_MEMO_SIZE = 1024
+
+
+class FrozenCaptures(dict):
+    """captures which may be shared between parsed stmts, so mustn't be
+    changed: copy() them to get a dict which can be"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("FrozenCaptures can't be changed, copy() them")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        # pickle would otherwise rebuild us with __setitem__
+        return (FrozenCaptures, (dict(self),))
+
+def freeze_captures(captures):
+    """Returns captures, with its dicts made FrozenCaptures and its lists
+    made tuples"""
+    if isinstance(captures, dict):
+        return FrozenCaptures((key, freeze_captures(value))
+            for key, value in captures.items())
+    elif isinstance(captures, list):
+        return tuple(freeze_captures(value) for value in captures)
+    return captures
+
+
+def iter_parse(stmts, verbose=False, keywords=None, file=None,
+        memo_size=PARSE_MEMO_SIZE, jobs=None):
+    """Generator version of parse().
+    Repeated stmts give the very same parsed stmt, so its captures are
+    FrozenCaptures.
+    If jobs > 1, stmts are parsed in that many worker processes (but no
+    more than we have CPUs), see iter_parse_parallel. Not if verbose,
+    though."""
+    if jobs is not None and not verbose:
+        jobs = min(jobs, os.cpu_count() or 1)
+        if jobs > 1:
+            yield from iter_parse_parallel(stmts, jobs, keywords=keywords)
+            return
+
     if keywords is None: keywords = get_keywords()
-    parsed_stmts = []
 
-    for i, stmt in enumerate(stmts):
+    # lexeme -> syntax of the statement it's the keyword of
+    stmt_syntaxes = {KEYWORD_LEXEMES[keyword]: syntax
+        for keyword, syntax in keywords.items()
+        if keyword.upper() == keyword}
+
+    # lexeme -> matcher for the statement it's the keyword of
+    stmt_matchers = {KEYWORD_LEXEMES[keyword]: match
+        for keyword, match in get_keyword_matchers(keywords).items()
+        if keyword.upper() == keyword}
+    # ...same thing, memoizing, for long stmts (compiled if needed)
+    memo_stmt_matchers = None
+
+    # stmt -> parsed stmt, least recently used first
+    memo = OrderedDict()
+    n_hits = 0
+    n_misses = 0
+
+    for stmt in stmts:
+        parsed_stmt = memo.get(stmt)
+        if parsed_stmt is not None:
+            memo.move_to_end(stmt)
+            n_hits += 1
+            if verbose:
+                print(file=file)
+                print("STMT:   {} (memoized)".format(stmt), file=file)
+            yield parsed_stmt
+            continue
+        n_misses += 1
+
         # if '=' in stmt:  # ????
         if '=' in stmt and stmt.index('=') == 1:
             index = stmt.index('=')
             lhs = stmt[:index]
             rhs = stmt[index+1:]
             captures = {'lhs': lhs, 'rhs': rhs}
-            parsed_stmt = ('=', captures)
-            parsed_stmts.append(parsed_stmt)
+            parsed_stmt = ('=', freeze_captures(captures))
+            if memo_size:
+                memo[stmt] = parsed_stmt
+                if len(memo) > memo_size: memo.popitem(last=False)
+            yield parsed_stmt
             continue
         keyword = stmt[0]
-        syntax = keywords.get(keyword.upper())
+        syntax = stmt_syntaxes.get(keyword)
         if syntax is None:
             raise ValueError("Invalid keyword: {}".format(keyword))
 
@@ -115,8 +260,26 @@ def parse(stmts, verbose=False, keywords=None, file=None):
             print("STMT:   {}".format(stmt), file=file)
             print("SYNTAX: {}".format(syntax), file=file)
 
-        ok, lexeme_i, captures = parse_stmt(stmt, 0, keywords, syntax,
-            verbose=verbose, depth=1, file=file)
+        if verbose:
+            ok, lexeme_i, captures = parse_stmt(stmt, 0, keywords, syntax,
+                verbose=verbose, depth=1, file=file)
+        else:
+            captures = {}
+            if len(stmt) < MEMO_MIN_STMT_LENGTH:
+                lexeme_i = stmt_matchers[keyword](stmt, 0, captures)
+            else:
+                if memo_stmt_matchers is None:
+                    memo_stmt_matchers = {KEYWORD_LEXEMES[keyword]: match
+                        for keyword, match in get_keyword_matchers(
+                            keywords, memo=True).items()
+                        if keyword.upper() == keyword}
+                lexeme_i = memo_stmt_matchers[keyword](MemoStmt(stmt), 0,
+                    captures)
+            ok = lexeme_i is not None
+            if not ok:
+                # Let parse_stmt work out where exactly we got stuck
+                ok, lexeme_i, captures = parse_stmt(stmt, 0, keywords,
+                    syntax)
         if lexeme_i < len(stmt):
             raise ValueError("Couldn't parse entire stmt: {}".format(stmt))
         if not ok:
@@ -125,10 +288,90 @@ def parse(stmts, verbose=False, keywords=None, file=None):
         if verbose:
             print("CAPTURES: {}".format(captures), file=file)
 
-        parsed_stmt = (keyword, captures)
-        parsed_stmts.append(parsed_stmt)
+        parsed_stmt = (keyword, freeze_captures(captures))
+        if memo_size:
+            memo[stmt] = parsed_stmt
+            if len(memo) > memo_size: memo.popitem(last=False)
+        yield parsed_stmt
+
+    if verbose:
+        n_stmts = n_hits + n_misses
+        print(file=file)
+        print("PARSE MEMO: {} hits / {} stmts ({:.1f}% hit rate)".format(
+            n_hits, n_stmts, n_hits / n_stmts * 100 if n_stmts else 0),
+            file=file)
+
+def parse(stmts, verbose=False, keywords=None, file=None,
+        memo_size=PARSE_MEMO_SIZE, jobs=None):
+    return list(iter_parse(stmts, verbose=verbose, keywords=keywords,
+        file=file, memo_size=memo_size, jobs=jobs))
+
+
+# How many stmts iter_parse_parallel sends to a worker process at a time
+PARSE_CHUNK_SIZE = 2000
 
-    return parsed_stmts
+# The keywords of a worker process of iter_parse_parallel
+_worker_keywords = None
+
+def init_parse_worker(keywords):
+    """Loads the grammar in a worker process, once and for all"""
+    global _worker_keywords
+    if keywords is None: keywords = get_keywords()
+    get_keyword_matchers(keywords)
+    _worker_keywords = keywords
+
+def parse_chunk(stmts):
+    """Parses stmts in a worker process.
+    Returns (parsed_stmts, error), where parsed_stmts are those before
+    the one which raised error, if any."""
+    parsed_stmts = []
+    try:
+        for parsed_stmt in iter_parse(stmts, keywords=_worker_keywords):
+            parsed_stmts.append(parsed_stmt)
+    except Exception as e:
+        return parsed_stmts, e
+    return parsed_stmts, None
+
+def iter_parse_parallel(stmts, jobs, keywords=None,
+        chunk_size=PARSE_CHUNK_SIZE):
+    """Like iter_parse, but parses chunks of stmts in a pool of jobs
+    worker processes.
+    Parsed stmts come out in the same order as with iter_parse, and so
+    do errors: we only raise one once everything before it has come out,
+    whether it came from parsing a stmt or from getting one out of stmts
+    (e.g. a lexing error)."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    stmts = iter(stmts)
+    stmts_error = None
+
+    def read_chunk():
+        nonlocal stmts_error
+        chunk = []
+        try:
+            for stmt in islice(stmts, chunk_size): chunk.append(stmt)
+        except Exception as e:
+            stmts_error = e
+        return chunk
+
+    executor = ProcessPoolExecutor(jobs, initializer=init_parse_worker,
+        initargs=(keywords,))
+    futures = deque() # of parsed chunks, in order
+    try:
+        while True:
+            # Give each worker a chunk, with another one lined up
+            while stmts_error is None and len(futures) < jobs * 2:
+                chunk = read_chunk()
+                if not chunk: break
+                futures.append(executor.submit(parse_chunk, chunk))
+            if not futures: break
+            parsed_stmts, error = futures.popleft().result()
+            yield from parsed_stmts
+            if error is not None: raise error
+    finally:
+        for future in futures: future.cancel()
+        executor.shutdown()
+    if stmts_error is not None: raise stmts_error
 
 def parse_stmt(stmt, lexeme_i, keywords, syntax_part,
         verbose=False, depth=0, file=None):
@@ -207,7 +450,7 @@ def parse_stmt(stmt, lexeme_i, keywords, syntax_part,
                     return False, lexeme_i, captures
                 captures[capture_name] = lexeme
             elif is_keyword:
-                if lexeme.upper() != syntax_part:
+                if lexeme != KEYWORD_LEXEMES[syntax_part]:
                     return False, lexeme_i, captures
             else:
                 captures[capture_name] = lexeme
@@ -235,7 +478,457 @@ def parse_stmt(stmt, lexeme_i, keywords, syntax_part,
 
 
 
-def group(parsed_stmts, verbose=False, file=None):
+# The compiled grammar: instead of interpreting the syntax over and over
+# like parse_stmt does, we work out once what each part of the syntax
+# means, and turn it into a "matcher" function:
+#
+#     match(stmt, lexeme_i, captures) -> new lexeme_i, or None if no match
+#
+# Matchers write straight into captures, so on failure they may leave
+# junk in there. Parts which need to back out of a failure ('[...]',
+# 'a | b', 'many+', 'named:sub') match into a fresh dict, and only copy
+# it into captures once they know they matched... unless what they're
+# matching is "atomic", i.e. only writes to captures if it matches.
+#
+# Alternatives ('a | b | ...') are "predictive": we work out the FIRST
+# set of each alternative (the lexemes it can start with) and whether
+# it's "nullable" (can match without using up any lexemes), and only try
+# the alternatives which can match the next lexeme.
+#
+# Optionally, they can also "memoize" (packrat parsing): remember what
+# each syntax in keywords matched at each lexeme_i of the stmt, so that
+# however much we backtrack, we never match the same syntax at the same
+# place twice. The memo goes in the stmt (see MemoStmt).
+#
+# They're meant to give the same captures as parse_stmt, but don't say
+# where exactly a stmt stopped matching (parse uses parse_stmt for that).
+
+AT_REGEX = re.compile(r'/?([0-9]+)?(\([0-9]+|(\*\*?)\))?')
+
+# In FIRST sets, stands for "any lexeme" (e.g. what a capture can match)
+ANY_LEXEME = None
+
+def split_syntax_part(syntax_part, keywords):
+    """Returns (kind, capture_name, name) for a syntax_part which is a
+    string, worked out the same way as in parse_stmt.
+    kind is one of: 'flag', 'at', 'keyword', 'capture', 'many', 'named',
+    'reference'; name is the lexeme for a keyword, or the name in
+    keywords of the syntax which many/named/reference refer to."""
+    if syntax_part[:1] == '+' and isidentifier(syntax_part[1:]):
+        return 'flag', syntax_part[1:], None
+
+    is_named = ':' in syntax_part
+    if is_named:
+        capture_name, syntax_part = syntax_part.split(':')
+    else:
+        capture_name = syntax_part
+
+    if syntax_part == '<at>':
+        if not is_named: capture_name = 'at'
+
+    is_many = syntax_part[-1:] == '+' and isidentifier(syntax_part[:-1])
+    if is_many:
+        syntax_part = syntax_part[:-1]
+        if not is_named:
+            # get rid of trailing '+'
+            capture_name = syntax_part
+
+    is_keyword = syntax_part.upper() == syntax_part
+
+    if is_keyword or syntax_part not in keywords:
+        if syntax_part == '<at>':
+            return 'at', capture_name, None
+        elif is_keyword:
+            return 'keyword', None, KEYWORD_LEXEMES[syntax_part]
+        else:
+            return 'capture', capture_name, None
+    elif is_many:
+        return 'many', capture_name, syntax_part
+    elif is_named:
+        return 'named', capture_name, syntax_part
+    else:
+        return 'reference', None, syntax_part
+
+def iter_alternatives(syntax_part):
+    """Yields the alternatives of a chain of '|'s, in the order parse_stmt
+    tries them: ('|', ('|', a, b), c) -> a, b, c"""
+    if isinstance(syntax_part, tuple) and syntax_part[0] == '|':
+        yield from iter_alternatives(syntax_part[1])
+        yield from iter_alternatives(syntax_part[2])
+    else:
+        yield syntax_part
+
+def get_first(syntax_part, keywords, firsts):
+    """Returns (first, nullable) for syntax_part.
+    firsts maps the names in keywords to their (first, nullable)."""
+    if isinstance(syntax_part, tuple):
+        kind = syntax_part[0]
+        if kind == '[':
+            first, nullable = get_first(syntax_part[1], keywords, firsts)
+            return first, True
+        elif kind == '|':
+            first_a, nullable_a = get_first(syntax_part[1], keywords, firsts)
+            first_b, nullable_b = get_first(syntax_part[2], keywords, firsts)
+            return first_a | first_b, nullable_a or nullable_b
+        else: raise ValueError("Unexpected kind: {}"
+            .format(kind))
+    elif isinstance(syntax_part, list):
+        first = frozenset()
+        for sub_syntax in syntax_part:
+            sub_first, sub_nullable = get_first(sub_syntax, keywords, firsts)
+            first |= sub_first
+            if not sub_nullable: return first, False
+        return first, True
+
+    kind, capture_name, name = split_syntax_part(syntax_part, keywords)
+    if kind == 'flag':
+        return frozenset(), True
+    elif kind == 'keyword':
+        return frozenset([name]), False
+    elif kind in ('at', 'capture'):
+        return frozenset([ANY_LEXEME]), False
+    else:
+        first, nullable = firsts[name]
+        return first, nullable or kind == 'many'
+
+def get_keyword_firsts(keywords):
+    """Returns dict mapping the names in keywords to (first, nullable)
+    for their syntax"""
+    # Syntaxes refer to each other (and themselves), so we start with
+    # nothing and go over them all until nothing changes
+    firsts = {name: (frozenset(), False) for name in keywords}
+    changed = True
+    while changed:
+        changed = False
+        for name, syntax in keywords.items():
+            first = get_first(syntax, keywords, firsts)
+            if first != firsts[name]:
+                firsts[name] = first
+                changed = True
+    return firsts
+
+
+class MemoStmt(tuple):
+    """A stmt, along with the memo for matching it with matchers compiled
+    with memo=True"""
+
+    def __new__(cls, stmt):
+        self = super().__new__(cls, stmt)
+        # (name in keywords, lexeme_i) -> (new lexeme_i, captures)
+        self.memo = {}
+        return self
+
+
+class GrammarCompiler:
+    """Compiles the syntaxes in keywords into matchers.
+    If predict is false, alternatives are all tried one after the other,
+    like in parse_stmt.
+    If memo is true, the matchers memoize, and must be given MemoStmts.
+    If stats is a dict, alternatives count how many of them were 'tried'
+    and how many of those 'failed' (i.e. how much we backtracked), and
+    memoizing matchers count their 'memo_hits' and 'memo_misses'."""
+
+    def __init__(self, keywords, predict=True, memo=False, stats=None):
+        self.keywords = keywords
+        self.predict = predict
+        self.memo = memo
+        self.stats = stats
+        self.firsts = get_keyword_firsts(keywords)
+        self.matchers = {}
+
+    def compile_keywords(self):
+        """Returns dict mapping the names in keywords (like 'WRITE',
+        'log_exp') to the matchers for their syntax"""
+        for name, syntax in self.keywords.items():
+            match, atomic = self.compile_syntax(syntax)
+            if self.memo: match = self.compile_memo(name, match)
+            self.matchers[name] = match
+        return self.matchers
+
+    def compile_memo(self, name, sub_match):
+        stats = self.stats
+        if stats is not None:
+            stats.setdefault('memo_hits', 0)
+            stats.setdefault('memo_misses', 0)
+        def match(stmt, lexeme_i, captures):
+            key = (name, lexeme_i)
+            memo = stmt.memo
+            result = memo.get(key)
+            if result is None:
+                if stats is not None: stats['memo_misses'] += 1
+                sub_captures = {}
+                new_lexeme_i = sub_match(stmt, lexeme_i, sub_captures)
+                result = memo[key] = (new_lexeme_i, sub_captures)
+            elif stats is not None: stats['memo_hits'] += 1
+            new_lexeme_i, sub_captures = result
+            if new_lexeme_i is None: return None
+            captures.update(sub_captures)
+            return new_lexeme_i
+        return match
+
+    def compile_syntax(self, syntax_part):
+        """Returns (match, atomic) for syntax_part.
+        References to other keywords are looked up in self.matchers when
+        matching, so they don't have to be compiled yet."""
+        if isinstance(syntax_part, tuple):
+            kind = syntax_part[0]
+            if kind == '[':
+                return self.compile_optional(syntax_part[1])
+            elif kind == '|':
+                return self.compile_alternatives(
+                    list(iter_alternatives(syntax_part)))
+            else: raise ValueError("Unexpected kind: {}"
+                .format(kind))
+        elif isinstance(syntax_part, list):
+            return self.compile_sequence(syntax_part)
+
+        kind, capture_name, name = split_syntax_part(syntax_part,
+            self.keywords)
+        if kind == 'flag':
+            return self.compile_flag(capture_name)
+        elif kind == 'at':
+            return self.compile_at(capture_name)
+        elif kind == 'keyword':
+            return self.compile_keyword(name)
+        elif kind == 'capture':
+            return self.compile_capture(capture_name)
+        elif kind == 'many':
+            return self.compile_many(capture_name, name)
+        elif kind == 'named':
+            return self.compile_named(capture_name, name)
+        else:
+            return self.compile_reference(name)
+
+    def compile_optional(self, sub_syntax):
+        sub_match, sub_atomic = self.compile_syntax(sub_syntax)
+        if sub_atomic:
+            def match(stmt, lexeme_i, captures):
+                new_lexeme_i = sub_match(stmt, lexeme_i, captures)
+                return lexeme_i if new_lexeme_i is None else new_lexeme_i
+        else:
+            def match(stmt, lexeme_i, captures):
+                sub_captures = {}
+                new_lexeme_i = sub_match(stmt, lexeme_i, sub_captures)
+                if new_lexeme_i is None: return lexeme_i
+                captures.update(sub_captures)
+                return new_lexeme_i
+        return match, True
+
+    def get_leading_keyword(self, syntax_part):
+        """Returns the lexeme of the keyword syntax_part starts with, if
+        it's a sequence starting with one"""
+        if not isinstance(syntax_part, list) or not syntax_part: return None
+        if not isinstance(syntax_part[0], str): return None
+        kind, capture_name, name = split_syntax_part(syntax_part[0],
+            self.keywords)
+        return name if kind == 'keyword' else None
+
+    def compile_alternatives(self, alternatives):
+        # If they all start with the same keyword (e.g. the DATA
+        # syntaxes), match it once and predict from the lexeme after it.
+        # Keywords don't capture anything, so it's the same thing.
+        if self.predict:
+            keyword = self.get_leading_keyword(alternatives[0])
+            if keyword is not None and all(
+                    self.get_leading_keyword(alternative) == keyword
+                    for alternative in alternatives[1:]):
+                return self.compile_sequence([alternatives[0][0]],
+                    [self.compile_alternatives([alternative[1:]
+                        for alternative in alternatives])])
+
+        # (match, whether it can write straight into captures)
+        compiled = []
+        for i, alternative in enumerate(alternatives):
+            sub_match, sub_atomic = self.compile_syntax(alternative)
+            is_last = i == len(alternatives) - 1
+            compiled.append((sub_match, sub_atomic or is_last))
+        atomic = sub_atomic
+
+        # lexeme -> the alternatives worth trying when it's next
+        predictions = {}
+        # ...when the next lexeme isn't in predictions / there isn't one
+        other_candidates = []
+        end_candidates = []
+        if self.predict:
+            alternative_firsts = [get_first(alternative, self.keywords,
+                    self.firsts)
+                for alternative in alternatives]
+            lexemes = set()
+            for first, nullable in alternative_firsts:
+                lexemes |= first
+            lexemes.discard(ANY_LEXEME)
+            for lexeme in lexemes:
+                predictions[lexeme] = tuple(candidate
+                    for candidate, (first, nullable)
+                        in zip(compiled, alternative_firsts)
+                    if nullable or lexeme in first or ANY_LEXEME in first)
+            other_candidates = tuple(candidate
+                for candidate, (first, nullable)
+                    in zip(compiled, alternative_firsts)
+                if nullable or ANY_LEXEME in first)
+            end_candidates = tuple(candidate
+                for candidate, (first, nullable)
+                    in zip(compiled, alternative_firsts)
+                if nullable)
+        else:
+            other_candidates = end_candidates = tuple(compiled)
+
+        stats = self.stats
+        if stats is None:
+            def match(stmt, lexeme_i, captures):
+                if lexeme_i < len(stmt):
+                    candidates = predictions.get(stmt[lexeme_i],
+                        other_candidates)
+                else:
+                    candidates = end_candidates
+                for sub_match, direct in candidates:
+                    if direct:
+                        new_lexeme_i = sub_match(stmt, lexeme_i, captures)
+                        if new_lexeme_i is not None: return new_lexeme_i
+                    else:
+                        sub_captures = {}
+                        new_lexeme_i = sub_match(stmt, lexeme_i,
+                            sub_captures)
+                        if new_lexeme_i is not None:
+                            captures.update(sub_captures)
+                            return new_lexeme_i
+                return None
+        else:
+            stats.setdefault('tried', 0)
+            stats.setdefault('failed', 0)
+            def match(stmt, lexeme_i, captures):
+                if lexeme_i < len(stmt):
+                    candidates = predictions.get(stmt[lexeme_i],
+                        other_candidates)
+                else:
+                    candidates = end_candidates
+                for sub_match, direct in candidates:
+                    stats['tried'] += 1
+                    sub_captures = captures if direct else {}
+                    new_lexeme_i = sub_match(stmt, lexeme_i, sub_captures)
+                    if new_lexeme_i is not None:
+                        if not direct: captures.update(sub_captures)
+                        return new_lexeme_i
+                    stats['failed'] += 1
+                return None
+        return match, atomic
+
+    def compile_sequence(self, syntax, compiled=()):
+        """compiled: (match, atomic) for parts of the sequence which come
+        after syntax and have already been compiled"""
+        sub_matches = []
+        # A sequence is atomic if nothing in it writes to captures before
+        # the last thing in it which can fail.
+        # We keep it simple: only keywords are known not to write.
+        atomic = True
+        writes = False
+        compiled = [self.compile_syntax(sub_syntax)
+            for sub_syntax in syntax] + list(compiled)
+        for sub_match, sub_atomic in compiled:
+            sub_matches.append(sub_match)
+            atomic = atomic and sub_atomic and not writes
+            writes = writes or getattr(sub_match, 'writes', True)
+
+        if len(sub_matches) == 1:
+            return sub_matches[0], atomic
+
+        def match(stmt, lexeme_i, captures):
+            for sub_match in sub_matches:
+                lexeme_i = sub_match(stmt, lexeme_i, captures)
+                if lexeme_i is None: return None
+            return lexeme_i
+        return match, atomic
+
+    def compile_flag(self, capture_name):
+        def match(stmt, lexeme_i, captures):
+            captures[capture_name] = True
+            return lexeme_i
+        return match, True
+
+    def compile_keyword(self, keyword_lexeme):
+        def match(stmt, lexeme_i, captures):
+            if lexeme_i < len(stmt) and stmt[lexeme_i] == keyword_lexeme:
+                return lexeme_i + 1
+            return None
+        match.writes = False
+        return match, True
+
+    def compile_capture(self, capture_name):
+        def match(stmt, lexeme_i, captures):
+            if lexeme_i >= len(stmt): return None
+            captures[capture_name] = stmt[lexeme_i]
+            return lexeme_i + 1
+        return match, True
+
+    def compile_at(self, capture_name):
+        fullmatch = AT_REGEX.fullmatch
+        def match(stmt, lexeme_i, captures):
+            if lexeme_i >= len(stmt): return None
+            lexeme = stmt[lexeme_i]
+            if not fullmatch(lexeme): return None
+            captures[capture_name] = lexeme
+            return lexeme_i + 1
+        return match, True
+
+    def compile_many(self, capture_name, name):
+        matchers = self.matchers
+        def match(stmt, lexeme_i, captures):
+            sub_match = matchers[name]
+            many_captures = []
+            while True:
+                sub_captures = {}
+                new_lexeme_i = sub_match(stmt, lexeme_i, sub_captures)
+                if new_lexeme_i is None or not sub_captures: break
+                lexeme_i = new_lexeme_i
+                many_captures.append(sub_captures)
+            captures[capture_name] = many_captures
+            return lexeme_i
+        return match, True
+
+    def compile_named(self, capture_name, name):
+        matchers = self.matchers
+        def match(stmt, lexeme_i, captures):
+            sub_captures = {}
+            lexeme_i = matchers[name](stmt, lexeme_i, sub_captures)
+            if lexeme_i is None: return None
+            captures[capture_name] = sub_captures
+            return lexeme_i
+        return match, True
+
+    def compile_reference(self, name):
+        matchers = self.matchers
+        def match(stmt, lexeme_i, captures):
+            return matchers[name](stmt, lexeme_i, captures)
+        return match, False
+
+def compile_keywords(keywords, predict=True, memo=False, stats=None):
+    """Returns dict mapping the names in keywords (like 'WRITE',
+    'log_exp') to the matchers for their syntax"""
+    return GrammarCompiler(keywords, predict=predict, memo=memo,
+        stats=stats).compile_keywords()
+
+# (keywords, {memo: matchers})
+_compiled_keywords = (None, {})
+
+def get_keyword_matchers(keywords, memo=False):
+    """Like compile_keywords, but remembers the last keywords it
+    compiled (normally the ones from get_keywords)"""
+    global _compiled_keywords
+    compiled_keywords, compiled_matchers = _compiled_keywords
+    if compiled_keywords is not keywords:
+        compiled_matchers = {}
+        _compiled_keywords = (keywords, compiled_matchers)
+    matchers = compiled_matchers.get(memo)
+    if matchers is None:
+        matchers = compiled_matchers[memo] = compile_keywords(keywords,
+            memo=memo)
+    return matchers
+
+
+
+def iter_group(parsed_stmts, verbose=False, file=None):
+    """Generator version of group(), yielding each toplevel grouped stmt
+    as soon as it's complete (e.g. an IF as soon as its ENDIF is seen)"""
     grouped_stmts = []
     stack = [] # list of (parsed_stmt, grouped_stmts)
     for parsed_stmt in parsed_stmts:
@@ -280,23 +973,31 @@ def group(parsed_stmts, verbose=False, file=None):
             data_captures['block'] = grouped_stmts
             grouped_stmts = prev_grouped_stmts
             grouped_stmts.append(data_stmt)
-        elif keyword in {'while', 'do'}:
+        elif keyword in {'while', 'do', 'loop'}:
             new_stmt = (keyword, captures.copy())
             stack.append((new_stmt, grouped_stmts))
             grouped_stmts = []
-        elif keyword in {'endwhile', 'enddo'}:
+        elif keyword in {'endwhile', 'enddo', 'endloop'}:
             new_stmt, prev_grouped_stmts = stack.pop()
             new_keyword, new_captures = new_stmt
             assertEqual(new_keyword,
-                {'endwhile': 'while', 'enddo': 'do'}[keyword])
+                {'endwhile': 'while', 'enddo': 'do',
+                    'endloop': 'loop'}[keyword])
             new_captures['block'] = grouped_stmts
             grouped_stmts = prev_grouped_stmts
             grouped_stmts.append(new_stmt)
         else:
             grouped_stmt = parsed_stmt
             grouped_stmts.append(grouped_stmt)
+
+        if not stack:
+            # We're at the toplevel, so whatever we just grouped is done
+            yield from grouped_stmts
+            grouped_stmts = []
     assertFalse(stack)
-    return grouped_stmts
+
+def group(parsed_stmts, verbose=False, file=None):
+    return list(iter_group(parsed_stmts, verbose=verbose, file=file))
 
 def print_grouped_stmts(grouped_stmts, depth=0, file=None):
     tabs = '  ' * depth
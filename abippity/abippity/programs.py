@@ -0,0 +1,93 @@
+
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+from .lex import iter_lex, iter_stmts
+from .parse import GRAMMAR_VERSION, get_keywords, iter_parse, iter_group
+from .nodes import build_block
+
+
+# How many compiled programs PROGRAM_CACHE remembers
+PROGRAM_CACHE_SIZE = 64
+
+CacheInfo = namedtuple('CacheInfo',
+    ['hits', 'misses', 'evictions', 'size', 'maxsize'])
+
+
+def compile_program(text, keywords=None):
+    """Lexes, parses and groups text, returning the nodes of the grouped
+    stmts (ready to be given to Runner.run), see nodes.build_block"""
+    return build_block(iter_group(iter_parse(iter_stmts(iter_lex(text)),
+        keywords=keywords)))
+
+
+class ProgramCache:
+    """Remembers the compiled programs (see compile_program) of the last
+    maxsize texts, by the hash of their text.
+    Safe to use from several threads at once.
+
+    Programs are shared by everyone who compiles the same text, so
+    don't modify them!"""
+
+    def __init__(self, maxsize=PROGRAM_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.programs = OrderedDict() # key -> program, least recent first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_key(self, text):
+        digest = hashlib.sha1(text.encode()).hexdigest()
+        return (digest, GRAMMAR_VERSION)
+
+    def compile(self, text, keywords=None):
+        # We only know the grammar version of the default keywords
+        if keywords is not None and keywords is not get_keywords():
+            return compile_program(text, keywords=keywords)
+
+        key = self.get_key(text)
+        with self.lock:
+            program = self.programs.get(key)
+            if program is not None:
+                self.programs.move_to_end(key)
+                self.hits += 1
+                return program
+            self.misses += 1
+
+        # NOTE: we compile outside of the lock, so other threads don't
+        # wait for us. If two of them compile the same text at once,
+        # they both do the work, and the last one's program is kept.
+        program = compile_program(text)
+
+        with self.lock:
+            self.programs[key] = program
+            self.programs.move_to_end(key)
+            while len(self.programs) > self.maxsize:
+                self.programs.popitem(last=False)
+                self.evictions += 1
+        return program
+
+    def info(self):
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.evictions,
+                len(self.programs), self.maxsize)
+
+    def clear(self):
+        with self.lock:
+            self.programs.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+PROGRAM_CACHE = ProgramCache()
+
+def compile(text, keywords=None):
+    """Returns the compiled program for text (see compile_program), from
+    PROGRAM_CACHE if it's there"""
+    return PROGRAM_CACHE.compile(text, keywords=keywords)
+
+def cache_info():
+    """Returns the hits, misses, evictions, size and maxsize of
+    PROGRAM_CACHE"""
+    return PROGRAM_CACHE.info()
@@ -1,136 +1,213 @@
 
-import re
-
-from .internals import (Screen, Report, Type, Value, Var, VarRef,
-    StructFieldRef)
-from .datetimes import get_local_now
+import sys
+import time
+from itertools import islice
+
+from .internals import (SCREENS, StreamScreen, Report, Type, RefType, Value, Var, VarRef,
+    FieldSymbol, get_type)
+from .nodes import (iter_nodes, ReportStmt, DataDecl, StructDecl,
+    TableDecl, FieldSymbolDecl, Move, Assign, AssignFieldSymbol, Unassign,
+    GetReference, CreateData, Add, Subtract, Multiply, Divide, Append,
+    Insert, ReadTable, LoopAt, Assert, Check, If, While, Do, Continue, Exit,
+    Write, Uline, Skip)
+from .tables import TableType, RowRef, get_component_type
+from .symbols import SYSTEM_VAR_NAMES, SymbolTable
+from .system import SystemStruct, INT_TYPE
+from .conditions import get_compare, TESTS
 from .assertions import *
 
-SYSTEM_VAR_NAMES = {'sy'}
-
-
-def covers_pattern(s, pat):
-    """It's like a regex or a glob... kind of.
-
-    NOTE: In the following, "operand1" corresponds to our "s", "operand2"
-    to our "pattern".
-    from https://help.sap.com/doc/abapdocu_750_index_htm/7.50/en-US/abenlogexp_strings.htm:
-      Covers Pattern: True, if the content of operand1 fits the pattern in
-      operand2.
-      Wildcard characters can be used to create the operand2 pattern, where
-      "*" represents any character string (including a blank string) and "+"
-      represents any character.
-      It is not case-sensitive.
-      Trailing blanks in the left operand are respected.
-      If the comparison is true, sy-fdpos contains the offset of operand2 in
-      operand1.
-      Here, leading wildcard characters "*" in operand2 are ignored if
-      operand2 also contains other characters.
-      If the comparison is false, sy-fdpos contains the length of operand1.
-      Characters in operand2 can be selected for direct comparisons by
-      prefixing them with the escape character "#".
-      For characters flagged in this way in operand2, the operator is
-      case-sensitive.
-      Also, wildcard characters and the escape character are not subject to
-      special handling and trailing blanks are relevant."""
-
-    # nnnnope
-    return re.fullmatch(pat, s) is not None
-
 
 class LoopExit(Exception): pass
 class LoopContinue(Exception): pass
 
+class LimitExceeded(Exception):
+    """Raised when a Runner goes over one of its limits (see
+    Runner.check_limits), e.g. by running WHILE 1 = 1 forever"""
+
+
+# How many statements we run between checks of a Runner's limits
+LIMIT_CHECK_INTERVAL = 1000
+
+# How many rows of a table we look at to guess the size of all of them
+# (see get_approx_size)
+TABLE_SIZE_SAMPLES = 4
+
+# Roughly what a Value costs on top of its data, in bytes
+VALUE_SIZE = 64
+
+
+# The type of the values GET REFERENCE etc. put into data references,
+# which are converted to the references' own types
+REF_TO_DATA = RefType()
+
+
+def get_approx_size(value):
+    """Returns a guess at how many bytes value takes up: tables are
+    guessed from the size of their first few rows, so this stays cheap
+    however big they get"""
+    type = value.type
+    data = value.data
+    if type.is_struct():
+        return VALUE_SIZE + sum(get_approx_size(field) for field in data)
+    if type.is_table():
+        n_rows = len(data)
+        if not n_rows: return VALUE_SIZE
+        samples = list(islice(data, TABLE_SIZE_SAMPLES))
+        return VALUE_SIZE + n_rows * sum(get_approx_size(row)
+            for row in samples) // len(samples)
+    if type.is_textual():
+        return VALUE_SIZE + len(data)
+    return VALUE_SIZE
+
 
 class Runner:
 
     def __init__(self, w=80, h=40, verbose=False, verbose_bools=False,
-            file=None):
+            file=None, screen='memory', stream=None, max_stmts=None,
+            max_time=None, max_lines=None, max_memory=None):
 
         self.verbose = verbose
         self.verbose_bools = verbose_bools
         self.file = file
 
         self.report_title = ''
-        self.screen = Screen(w, h)
-        self.vars = {}
+        # screen: a key of SCREENS, e.g. 'mmap' for reports too big to
+        # keep in memory.
+        # stream: if given, the report's lines are handed to it as soon
+        # as they're written instead (see StreamScreen), framed by the
+        # header & trailer Report.print would print.
+        self.stream = stream
+        if stream is not None:
+            self.screen = StreamScreen(w, h, stream)
+        else:
+            Screen = SCREENS.get(screen)
+            if Screen is None:
+                raise ValueError("Unknown screen: {} (expected one of: {})"
+                    .format(screen, ', '.join(SCREENS)))
+            self.screen = Screen(w, h)
+
+        # Limits (None for no limit) on the number of statements run,
+        # seconds spent running, lines written and (approximate) KiB of
+        # variables: going over one raises LimitExceeded.
+        # NOTE: they're only checked every LIMIT_CHECK_INTERVAL
+        # statements, see check_limits
+        self.max_stmts = max_stmts
+        self.max_time = max_time
+        self.max_lines = max_lines
+        self.max_memory = max_memory
+        self.n_stmts = 0
+        self.start_time = None
+        self.next_check = sys.maxsize
+        if any(limit is not None for limit in (
+                max_stmts, max_time, max_lines, max_memory)):
+            self.next_check = 0
 
-    def add_var(self, name, type, value=None):
+        self.vars = {}
+        self.sy = SystemStruct(self.screen)
+        self.system_vars = {} # name -> Var, see get_var
+        # slot -> Var (or FieldSymbol), or None if not declared (yet)
+        self.slots = []
+
+        # resolves the operands of the grouped stmts given to self.run
+        self.symbols = SymbolTable()
+
+        # node class -> method running it
+        self.stmt_runners = {
+            ReportStmt: self.run_report,
+            DataDecl: self.run_data,
+            StructDecl: self.run_data,
+            TableDecl: self.run_data,
+            FieldSymbolDecl: self.run_field_symbols,
+            Move: self.run_move,
+            Assign: self.run_assign,
+            AssignFieldSymbol: self.run_assign_field_symbol,
+            Unassign: self.run_unassign,
+            GetReference: self.run_get_reference,
+            CreateData: self.run_create_data,
+            Add: self.run_arithmetic,
+            Subtract: self.run_arithmetic,
+            Multiply: self.run_arithmetic,
+            Divide: self.run_arithmetic,
+            Append: self.run_append,
+            Insert: self.run_insert,
+            ReadTable: self.run_read,
+            LoopAt: self.run_loop_at,
+            Assert: self.run_assert,
+            Check: self.run_check,
+            If: self.run_if,
+            While: self.run_loop,
+            Do: self.run_loop,
+            Continue: self.run_continue,
+            Exit: self.run_exit,
+            Write: self.run_write,
+            Uline: self.run_uline,
+            Skip: self.run_skip,
+        }
+
+    def add_var(self, name, type, value=None, slot=None, var=None):
+        """Declares a Var (or another var, e.g. a FieldSymbol)"""
         vars = self.vars
         assertNotIn(name, SYSTEM_VAR_NAMES)
         assertNotIn(name, vars)
-        var = Var(name, type, value)
-        vars[var.name] = var
+        if var is None: var = Var(name, type, value)
+        vars[name] = var
+        if slot is not None:
+            slots = self.slots
+            if slot >= len(slots):
+                slots.extend([None] * (slot + 1 - len(slots)))
+            slots[slot] = var
 
     def get_var(self, name):
         vars = self.vars
         if name in SYSTEM_VAR_NAMES:
-            value = self.get_system_value(name)
-            # HACK: We return a freshly-created variable...
-            return Var(name, value.type, value)
+            var = self.system_vars.get(name)
+            if var is None:
+                value = self.get_system_value(name)
+                var = self.system_vars[name] = Var(name, value.type)
+                # NOTE: not a copy, so it's always up to date
+                var.value = value
+            return var
         assertIn(name, vars)
         return vars[name]
 
     def get_system_value(self, name):
         if name == 'sy':
-
-            # MAYBE TODO: Just have self.sy_value, constantly update it,
-            # or have it magically update itself whenever you request a
-            # field... how does ABAP do this?
-
-            int_type = Type('i')
-            date_type = Type('d')
-            time_type = Type('t')
-
-            local_now = get_local_now()
-            date_value = Value(date_type, local_now.strftime('%Y%m%d'))
-            time_value = Value(time_type, local_now.strftime('%H%M%S'))
-
-            sy_data = [
-                # general
-                ('linsz', Value(int_type, self.screen.w)),
-
-                # date & time
-                ('datum', date_value),
-                ('datlo', date_value),
-                ('uzeit', time_value),
-                ('timlo', time_value),
-            ]
-
-            return Value.create_struct(sy_data)
+            return self.sy
         else:
             raise NotImplementedError("System var: {}"
                 .format(name))
 
     def parse_type(self, text, length=None):
-        type = Type(text, length)
+        type = get_type(text, length)
         return type
 
-    def parse_data(self, keyword, captures):
-        if keyword == 'data':
-            var_text = captures['var']
-            if 'dobj' in captures:
-                dobj_text = captures['dobj']
-                like_value = self.parse_value(dobj_text)
-                type = like_value.type
-                name = var_text
+    def parse_like(self, like, line_of=False):
+        """Returns the type of dobj Operand like, or of its lines"""
+        type = like.get_value(self).type
+        if line_of:
+            assertTrue(type.is_table())
+            type = type.line_type
+        return type
+
+    def parse_data(self, node):
+        if isinstance(node, DataDecl):
+            name = node.name
+            if node.like is not None:
+                type = self.parse_like(node.like, node.line_of)
+            elif node.ref_to and node.type_text == 'data':
+                type = None
             else:
-                type_text = captures['abap_type']
-                len_text = captures.get('len')
-                name, type = self.parse_var(var_text, type_text, len_text)
+                type = self.parse_type(node.type_text, node.length)
+            if node.ref_to: type = RefType(type)
 
             value = None
-            value_text = captures.get('val')
-            if value_text is not None:
-                value = self.parse_value(value_text)
-        elif keyword == 'data_begin':
-            name = captures['struc']
+            if node.value is not None:
+                value = node.value.get_value(self)
+        elif isinstance(node, StructDecl):
+            name = node.name
             type = Type('struct')
 
-            fields = []
-            for field_keyword, field_captures in captures['block']:
-                assertIn(field_keyword, {'data', 'data_begin'})
-                fields.append(self.parse_data(field_keyword, field_captures))
+            fields = [self.parse_data(field) for field in node.fields]
             for field_name, field_type, field_value in fields:
                 type.add_field(field_name, field_type)
 
@@ -139,59 +216,28 @@ class Runner:
                 if field_value is None: continue
                 value.set_field(field_name, field_value,
                     allow_structs=True)
+        elif isinstance(node, TableDecl):
+            name = node.name
+            if node.like is not None:
+                line_type = node.like.get_value(self).type
+            else:
+                line_type = self.parse_type(node.type_text)
+            type = TableType(node.kind, line_type, node.keys)
+            value = None
         else:
-            raise AssertionError("Weird keyword: {}".format(keyword))
+            raise AssertionError("Weird node: {}".format(node))
         return name, type, value
 
-    def parse_var(self, text, type_text, len_text=None):
-        match = re.fullmatch(
-            r'(?P<name>[a-zA-Z_][a-zA-Z_0-9]*)(\((?P<length>[0-9]+)\))?',
-            text)
-        groupdict = match.groupdict()
-        name = groupdict['name']
-        length = groupdict['length']
-        assertFalse(length is not None and len_text is not None)
-        if len_text is not None: length = int(len_text)
-        if length: length = int(length)
-        type = self.parse_type(type_text, length)
-        return name, type
-
     def parse_value(self, text):
-        c0 = text[0:1]
-        if c0 == '\'':
-            data = text[1:]
-
-            # from https://www.tutorialspoint.com/sap_abap/
-            # sap_abap_constants_literals.htm:
-            # Note − In text field literals, trailing blanks are ignored,
-            # but in string literals they are taken into account.
-            data = data.rstrip()
-
-            return Value(self.parse_type('c', len(data)), data)
-        if c0 == '`':
-            return Value(self.parse_type('string'), text[1:])
-        if c0.isdigit():
-            return Value(self.parse_type('i'), int(text))
-
-        parts = text.split('-')
-        var = self.get_var(parts[0])
-        value = var.get()
-        for part in parts[1:]:
-            value = value.get_field(part)
-        return value
+        """Returns the value of operand text (e.g. "'abc'", "x",
+        "point-x"). The Runner itself uses the operands which were
+        resolved when their nodes were built."""
+        return self.symbols.resolve(text).get_value(self)
 
     def parse_ref(self, text):
-        parts = text.split('-')
-        if len(parts) > 1:
-            var = self.get_var(parts[0])
-            value = var.get()
-            for part in parts[1:-1]:
-                value = value.get_field(part)
-            return StructFieldRef(value, parts[-1])
-        else:
-            return VarRef(self.get_var(text))
+        return self.symbols.resolve(text).get_ref(self)
 
-    def eval_bool(self, captures, depth=0):
+    def eval_bool(self, cond, depth=0):
         """
         log_exp
               { ( sub_exp:log_exp ) }
@@ -215,209 +261,373 @@ class Runner:
             | {BYTE-CO +byte-co}|{BYTE-CN +byte-cn}|{BYTE-CA +byte-ca}|{BYTE-NA +byte-na}|{BYTE-CS +byte-cs}|{BYTE-NS +byte-ns}
             | {O +o}|{Z +z}|{M +m}.
         """
+        if not self.verbose_bools:
+            return cond.predicate(self)
+
+        # Verbose: like cond.predicate, but printing every sub-condition
         tabs = '  ' * depth
-        verbose = self.verbose_bools
-        if verbose:
-            print("{}BOOL EVAL: {}".format(tabs, captures),
-                file=self.file)
+        print("{}BOOL EVAL: {}".format(tabs, cond),
+            file=self.file)
 
         # NOTE: result currently needs to be True by default, because
-        # ELSE-blocks are implemented as empty captures.
+        # ELSE-blocks are implemented as empty conditions.
         result = True
 
-        if 'sub_exp' in captures:
-            sub_exp = captures['sub_exp']
-            result = self.eval_bool(sub_exp, depth+1)
-            if 'not' in captures: result = not result
-        elif 'op' in captures:
-            op_dict = captures['op']
-            op = list(op_dict)[0]
-            lhs = self.parse_value(captures['operand1'])
-            rhs = self.parse_value(captures['operand2'])
-            if op == 'eq': result = lhs.eq(rhs)
-            elif op == 'ne': result = lhs.ne(rhs)
-            elif op == 'lt': result = lhs.lt(rhs)
-            elif op == 'gt': result = lhs.gt(rhs)
-            elif op == 'le': result = lhs.le(rhs)
-            elif op == 'ge': result = lhs.ge(rhs)
-            elif op in {'co', 'cn', 'ca', 'na', 'cs', 'ns', 'cp', 'np'}:
-                # See https://help.sap.com/doc/abapdocu_750_index_htm/7.50/en-US/abenlogexp_strings.htm
-                assertTrue(lhs.type.is_textual())
-                assertTrue(lhs.type.is_textual())
-                if op == 'co': # Contains Only
-                    result = not bool(set(lhs.data) - set(rhs.data))
-                elif op == 'cn': # Contains Not Only
-                    result = bool(set(lhs.data) - set(rhs.data))
-                elif op == 'ca': # Contains Any
-                    result = bool(set(lhs.data) & set(rhs.data))
-                elif op == 'cn': # Contains Not Any
-                    result = not bool(set(lhs.data) & set(rhs.data))
-                elif op == 'cs': # Contains String
-                    result = rhs.data in lhs.data
-                elif op == 'ns': # Contains No String
-                    result = rhs.data not in lhs.data
-                elif op == 'cp': # Covers Pattern
-                    result = covers_pattern(lhs.data, rhs.data)
-                elif op == 'np': # No Pattern
-                    result = not covers_pattern(lhs.data, rhs.data)
-                else:
-                    raise AssertionError("Weird textual comparison: {}"
-                        .format(captures))
-            else:
-                raise AssertionError("Weird comparison: {}"
-                    .format(captures))
-
-        if 'rhs_exp' in captures:
-            rhs_exp = captures['rhs_exp']
-            rhs_result = self.eval_bool(rhs_exp, depth+1)
-            if 'and' in captures:
-                result = result and rhs_result
-            elif 'or' in captures:
-                result = result or rhs_result
-            elif 'equiv' in captures:
+        if cond.sub_cond is not None:
+            result = self.eval_bool(cond.sub_cond, depth+1)
+            if cond.negate: result = not result
+        elif cond.op is not None:
+            lhs = cond.operand1.get_value(self)
+            rhs = cond.operand2.get_value(self)
+            result = get_compare(cond)(lhs, rhs)
+        elif cond.test is not None:
+            result = TESTS[cond.test](cond.operand1, self)
+            if cond.negate: result = not result
+
+        if cond.rhs_cond is not None:
+            connective = cond.connective
+            if connective == 'and':
+                if result:
+                    result = self.eval_bool(cond.rhs_cond, depth+1)
+            elif connective == 'or':
+                if not result:
+                    result = self.eval_bool(cond.rhs_cond, depth+1)
+            elif connective == 'equiv':
+                rhs_result = self.eval_bool(cond.rhs_cond, depth+1)
                 result = result == rhs_result
-            else:
-                raise AssertionError(
-                    "Weird right-hand side of condition: {}"
-                    .format(captures))
 
         return result
 
 
 
     def run(self, grouped_stmts, depth=0, toplevel=False):
+        """Runs grouped_stmts, which may be grouped stmts as returned by
+        parse.group, or their nodes (see nodes.build_block)"""
         tabs = '  ' * depth
         verbose = self.verbose
-        screen = self.screen
-        vars = self.vars
-
-        if toplevel and not grouped_stmts:
-            raise ValueError("Empty report!")
-
-        for i, grouped_stmt in enumerate(grouped_stmts):
+        stmt_runners = self.stmt_runners
+        if self.start_time is None: self.start_time = time.monotonic()
+
+        # NOTE: grouped_stmts may be a generator (see parse.iter_group),
+        # in which case we start running before it's all been parsed
+        empty = True
+        for i, node in enumerate(iter_nodes(grouped_stmts, self.symbols)):
+            empty = False
             if verbose:
-                print("{}Running: {}".format(tabs, grouped_stmt),
+                print("{}Running: {}".format(tabs, node),
                     file=self.file)
-            keyword, captures = grouped_stmt
 
-            if (toplevel and i == 0) != (keyword == 'report'):
-                if keyword == 'report':
+            is_report = type(node) is ReportStmt
+            if (toplevel and i == 0) != is_report:
+                if is_report:
                     raise ValueError("Unexpected 'report' "
                         "(should come exactly once, at top of file)")
                 else:
                     raise ValueError("Missing 'report' "
                         "(should come exactly once, at top of file)")
 
-            if keyword in {'data', 'data_begin'}:
-                name, type, value = self.parse_data(keyword, captures)
-                self.add_var(name, type, value)
-            elif keyword == 'move':
-                src_text = captures['source']
-                dest_text = captures['destination']
-                src = self.parse_value(src_text)
-                dest = self.parse_ref(dest_text)
-                dest.set(src)
-            elif keyword == '=':
-                lhs_list = captures['lhs']
-                rhs_list = captures['rhs']
-                assertEqual(len(lhs_list), 1)
-                assertEqual(len(rhs_list), 1)
-                lhs_text = lhs_list[0]
-                rhs_text = rhs_list[0]
-                lhs = self.parse_ref(lhs_text)
-                rhs = self.parse_value(rhs_text)
-                lhs.set(rhs)
-            elif keyword == 'add':
-                src = self.parse_value(captures['dobj1'])
-                dest = self.parse_ref(captures['dobj2'])
-                value = dest.get().add(src)
-                dest.set(value)
-            elif keyword == 'subtract':
-                src = self.parse_value(captures['dobj1'])
-                dest = self.parse_ref(captures['dobj2'])
-                value = dest.get().sub(src)
-                dest.set(value)
-            elif keyword == 'multiply':
-                dest = self.parse_ref(captures['dobj1'])
-                src = self.parse_value(captures['dobj2'])
-                value = dest.get().mul(src)
-                dest.set(value)
-            elif keyword == 'divide':
-                dest = self.parse_ref(captures['dobj1'])
-                src = self.parse_value(captures['dobj2'])
-                value = dest.get().div(src)
-                dest.set(value)
-            elif keyword == 'assert':
-                cond = self.eval_bool(captures, depth+1)
-                if not cond:
-                    raise AssertionError("Failed ABAP assertion at "
-                        "grouped stmt {}: {}"
-                        .format(i, captures))
-            elif keyword == 'if':
-                parts = captures
-                for part in parts:
-                    cond = self.eval_bool(part, depth+1)
-                    if cond:
-                        block = part['block']
-                        self.run(block, depth+1)
-                        break
-            elif keyword in {'while', 'do'}:
-                block = captures['block']
-                n = None
-                if 'n' in captures:
-                    n_value = self.parse_value(captures['n'])
-                    assertTrue(n_value.is_numeric())
-                    n = n_value.data
-                i = 0
-                while True:
-                    if keyword == 'while':
-                        cond = self.eval_bool(captures, depth+1)
-                        if not cond: break
-                    elif n is not None:
-                        if i >= n: break
-                        i += 1
-                    try:
-                        self.run(block, depth+1)
-                    except LoopExit: break
-                    except LoopContinue: continue
-            elif keyword == 'continue': raise LoopContinue()
-            elif keyword == 'exit': raise LoopExit()
-            elif keyword == 'check':
-                cond = self.eval_bool(captures, depth+1)
-                if not cond: raise LoopExit()
-            elif keyword == 'write':
-                at = captures.get('at')
-                newline = at and at.startswith('/')
-
-                if newline and screen.x > 0:
-                    screen.newline()
-
-                dobj = captures['dobj']
-                value = self.parse_value(dobj)
-
-                nozero = False
-                for option in captures['int_format_options']:
-                    if 'nozero' in option:
-                        nozero = True
-
-                screen.put_value(value, nozero=nozero)
-                if 'nogap' not in captures:
-                    screen.spacebar()
-            elif keyword == 'uline':
-                screen.uline()
-            elif keyword == 'skip':
-                to_line = captures.get('line')
-                if to_line is not None:
-                    raise NotImplementedError("SKIP TO LINE")
-                else:
-                    n = captures.get('n', 1)
-                    for i in range(n):
-                        screen.newline()
-            elif keyword == 'report':
-                self.report_title = captures['rep']
-            else:
-                raise ValueError('Keyword not implemented: {}'
-                    .format(keyword))
+            self.n_stmts += 1
+            if self.n_stmts >= self.next_check: self.check_limits()
+            stmt_runners[type(node)](node, depth)
+
+        if toplevel and empty:
+            raise ValueError("Empty report!")
 
-        report = Report(self.report_title, screen)
+        report = Report(self.report_title, self.screen)
+        if toplevel and self.stream is not None:
+            screen = self.screen
+            screen.close()
+            for line in report.get_trailer(): screen.sink(line)
         return report
+
+    def check_limits(self):
+        """Raises LimitExceeded if we've gone over one of our limits, and
+        works out when (after how many statements) to check them next"""
+        n_stmts = self.n_stmts
+        max_stmts = self.max_stmts
+        if max_stmts is not None and n_stmts > max_stmts:
+            raise LimitExceeded("Ran more than {} statements"
+                .format(max_stmts))
+        if self.max_time is not None:
+            if self.start_time is None: self.start_time = time.monotonic()
+            if time.monotonic() - self.start_time > self.max_time:
+                raise LimitExceeded("Ran for more than {} seconds"
+                    .format(self.max_time))
+        if self.max_lines is not None and self.screen.y >= self.max_lines:
+            raise LimitExceeded("Wrote more than {} lines"
+                .format(self.max_lines))
+        if (self.max_memory is not None and
+                self.get_memory() > self.max_memory * 1024):
+            raise LimitExceeded("Variables take up more than {} KiB"
+                .format(self.max_memory))
+
+        next_check = n_stmts + LIMIT_CHECK_INTERVAL
+        if max_stmts is not None:
+            next_check = min(next_check, max_stmts + 1)
+        self.next_check = next_check
+
+    def get_memory(self):
+        """Returns roughly how many bytes our variables take up (see
+        get_approx_size).
+        NOTE: data only reachable through references (e.g. from CREATE
+        DATA) isn't counted"""
+        return sum(get_approx_size(var.value)
+            for var in self.vars.values() if isinstance(var, Var))
+
+    def run_block(self, block, depth):
+        """Runs the nodes of a block (e.g. of an IF): like run, but
+        quicker"""
+        stmt_runners = self.stmt_runners
+        # NOTE: each pass through a block counts as its statements plus
+        # one (for e.g. the loop's own iteration, so that even an empty
+        # WHILE 1 = 1 goes over max_stmts)
+        n_stmts = self.n_stmts = self.n_stmts + len(block) + 1
+        if n_stmts >= self.next_check: self.check_limits()
+        if self.verbose:
+            tabs = '  ' * depth
+            for node in block:
+                print("{}Running: {}".format(tabs, node), file=self.file)
+                if type(node) is ReportStmt:
+                    raise ValueError("Unexpected 'report' "
+                        "(should come exactly once, at top of file)")
+                stmt_runners[type(node)](node, depth)
+        else:
+            for node in block:
+                if type(node) is ReportStmt:
+                    raise ValueError("Unexpected 'report' "
+                        "(should come exactly once, at top of file)")
+                stmt_runners[type(node)](node, depth)
+
+    def run_data(self, node, depth):
+        name, type, value = self.parse_data(node)
+        self.add_var(name, type, value, slot=node.slot)
+
+    def run_field_symbols(self, node, depth):
+        type = None
+        if node.like is not None:
+            type = self.parse_like(node.like, node.line_of)
+        elif node.type_text not in (None, 'any', 'data'):
+            type = self.parse_type(node.type_text)
+        name = node.name
+        self.add_var(name, type, slot=node.slot,
+            var=FieldSymbol(name, type))
+
+    def run_assign_field_symbol(self, node, depth):
+        ref = node.mem_area.get_ref(self)
+        node.field_symbol.get_field_symbol(self).assign(ref)
+
+    def run_unassign(self, node, depth):
+        node.field_symbol.get_field_symbol(self).unassign()
+
+    def set_dref(self, dref, ref):
+        """Sets data reference Operand dref to ref"""
+        dref.get_ref(self).set(Value(REF_TO_DATA, ref))
+
+    def run_get_reference(self, node, depth):
+        self.set_dref(node.dref, node.dobj.get_ref(self))
+
+    def run_create_data(self, node, depth):
+        if node.like is not None:
+            type = self.parse_like(node.like)
+        elif node.type_text is not None:
+            type = self.parse_type(node.type_text)
+        else:
+            dref_type = node.dref.get_value(self).type
+            assertTrue(dref_type.is_ref())
+            type = dref_type.target_type
+            if type is None:
+                raise AssertionError("CREATE DATA needs a type for {}"
+                    .format(node.dref.text))
+        # NOTE: the new var has no name, nor a slot: it's only kept by
+        # the refs to it
+        self.set_dref(node.dref, VarRef(Var('', type)))
+
+    def run_move(self, node, depth):
+        src = node.source.get_value(self)
+        dest = node.destination.get_ref(self)
+        dest.set(src, allow_structs=True)
+
+    def run_assign(self, node, depth):
+        lhs = node.lhs.get_ref(self)
+        rhs = node.rhs.get_value(self)
+        lhs.set(rhs, allow_structs=True)
+
+    def run_arithmetic(self, node, depth):
+        # NOTE: order matters, e.g. for "MULTIPLY dest BY src" we used
+        # to get dest before src
+        if type(node) in (Add, Subtract):
+            src = node.src.get_value(self)
+            dest = node.dest.get_ref(self)
+        else:
+            dest = node.dest.get_ref(self)
+            src = node.src.get_value(self)
+        dest_value = dest.get()
+        result_type = Type.numeric_lcd(dest_value.type, src.type)
+        data = node.op(dest_value.data, src.data)
+        if result_type is dest_value.type and result_type.length is None:
+            # Nothing to convert (or check the length of), so we can
+            # update dest in place
+            dest.set_data(data)
+        else:
+            dest.set(Value(result_type, data))
+
+    def get_table(self, operand, change=False):
+        """Returns the Table operand refers to. If change, it's one we can
+        change in place: any structs it's in are unshared from their
+        copies first (see Value.copy)."""
+        if change:
+            value = operand.get_ref(self).get_to_change()
+        else:
+            value = operand.get_value(self)
+        assertTrue(value.is_table())
+        return value.data
+
+    def get_row(self, table, wa):
+        """Returns a new row for table, from the value of wa"""
+        value = wa.get_value(self)
+        return table.type.line_type.convert(value, allow_structs=True).copy()
+
+    def set_wa(self, wa, row):
+        """Sets wa to a copy of table row"""
+        wa.get_ref(self).set(row, allow_structs=True)
+
+    def set_result(self, node, table, row):
+        """Puts table row where READ TABLE or LOOP AT node says"""
+        if node.wa is not None:
+            self.set_wa(node.wa, row)
+        elif node.assigning is not None:
+            node.assigning.get_field_symbol(self).assign(RowRef(table, row))
+        elif node.reference_into is not None:
+            self.set_dref(node.reference_into, RowRef(table, row))
+
+    def run_append(self, node, depth):
+        table = self.get_table(node.itab, change=True)
+        row = self.get_row(table, node.wa)
+        if not table.add(row, append=True):
+            raise AssertionError("Duplicate key: {}".format(row))
+        self.sy.tabix = len(table)
+
+    def run_insert(self, node, depth):
+        table = self.get_table(node.itab, change=True)
+        row = self.get_row(table, node.wa)
+        self.sy.subrc = 0 if table.add(row) else 4
+
+    def run_read(self, node, depth):
+        table = self.get_table(node.itab, change=node.wa is None)
+        if node.index is not None:
+            position = INT_TYPE.convert(node.index.get_value(self)).data - 1
+            row = table.get_index(node.key_name).get(position)
+            found = None if row is None else (position, row)
+        else:
+            line_type = table.type.line_type
+            datas = [get_component_type(line_type, component)
+                .convert(operand.get_value(self)).data
+                for component, operand in zip(node.components, node.values)]
+            found = table.find(node.components, datas, node.key_name)
+
+        sy = self.sy
+        if found is None:
+            sy.subrc = 4
+            sy.tabix = 0
+            return
+        position, row = found
+        sy.subrc = 0
+        sy.tabix = 0 if position is None else position + 1
+        self.set_result(node, table, row)
+
+    def run_loop_at(self, node, depth):
+        # NOTE: rows assigned to field symbols (or referenced) may be
+        # changed in place
+        table = self.get_table(node.itab, change=node.wa is None)
+        index = table.get_index(node.key_name)
+        has_positions = index.key.kind != 'hashed'
+        block = node.block
+        wa = node.wa
+        sy = self.sy
+        tabix = sy.tabix
+        if node.assigning is not None:
+            field_symbol = node.assigning.get_field_symbol(self)
+
+        # NOTE: we loop over the rows which were there when we started
+        rows = list(index)
+        for position, row in enumerate(rows):
+            sy.tabix = position + 1 if has_positions else 0
+            if wa is not None:
+                self.set_wa(wa, row)
+            elif node.assigning is not None:
+                # NOTE: no copies: the block changes the row itself
+                field_symbol.assign(RowRef(table, row))
+            elif node.reference_into is not None:
+                self.set_dref(node.reference_into, RowRef(table, row))
+            try:
+                self.run_block(block, depth+1)
+            except LoopExit: break
+            except LoopContinue: continue
+
+        sy.tabix = tabix
+        sy.subrc = 0 if rows else 4
+
+    def run_assert(self, node, depth):
+        cond = self.eval_bool(node.cond, depth+1)
+        if not cond:
+            raise AssertionError("Failed ABAP assertion: {}"
+                .format(node.cond))
+
+    def run_if(self, node, depth):
+        for cond, block in node.branches:
+            if self.eval_bool(cond, depth+1):
+                self.run_block(block, depth+1)
+                break
+
+    def run_loop(self, node, depth):
+        block = node.block
+        is_while = type(node) is While
+        n = None
+        if not is_while and node.n is not None:
+            n_value = node.n.get_value(self)
+            assertTrue(n_value.is_numeric())
+            n = n_value.data
+        i = 0
+        while True:
+            if is_while:
+                cond = self.eval_bool(node.cond, depth+1)
+                if not cond: break
+            elif n is not None:
+                if i >= n: break
+                i += 1
+            try:
+                self.run_block(block, depth+1)
+            except LoopExit: break
+            except LoopContinue: continue
+
+    def run_continue(self, node, depth): raise LoopContinue()
+    def run_exit(self, node, depth): raise LoopExit()
+
+    def run_check(self, node, depth):
+        cond = self.eval_bool(node.cond, depth+1)
+        if not cond: raise LoopExit()
+
+    def run_write(self, node, depth):
+        screen = self.screen
+        if node.newline and screen.x > 0:
+            screen.newline()
+        value = node.dobj.get_value(self)
+        screen.put_value(value, nozero=node.nozero)
+        if not node.nogap:
+            screen.spacebar()
+
+    def run_uline(self, node, depth):
+        self.screen.uline()
+
+    def run_skip(self, node, depth):
+        if node.to_line is not None:
+            raise NotImplementedError("SKIP TO LINE")
+        for i in range(node.n):
+            self.screen.newline()
+
+    def run_report(self, node, depth):
+        self.report_title = node.title
+        if self.stream is not None:
+            screen = self.screen
+            for line in Report(node.title, screen).get_header():
+                screen.sink(line)
@@ -0,0 +1,284 @@
+
+from .internals import get_type, Value, VarRef, StructFieldRef
+from .tables import lines
+from .assertions import *
+
+SYSTEM_VAR_NAMES = {'sy'}
+
+# name -> function(*arg_values) returning its value
+BUILTIN_FUNCTIONS = {
+    'lines': lines,
+}
+
+
+# Operands are resolved once, when their nodes are built: instead of
+# their text, nodes hold accessors, which the Runner asks for the
+# operand's value (get_value) or for a ref to it (get_ref).
+# Variables are given slots by the program's SymbolTable; the Runner
+# keeps their Vars in a list (Runner.slots) indexed by slot.
+# NOTE: a slot only means something in the SymbolTable which gave it
+# out, and a Runner may run programs built with different ones (e.g. by
+# abippity.compile), so the slots are only a shortcut: if the var in
+# ours has another name, we look it up by name instead.
+# Field symbols (whose names start with '<') get slots too, where the
+# Runner keeps their internals.FieldSymbols.
+
+
+class Operand:
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text # as written in the program
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, repr(self.text))
+
+    def get_ref(self, runner):
+        raise AssertionError("Not a variable: {}".format(self.text))
+
+
+class Literal(Operand):
+    """A text field literal, string literal or number.
+    Its value is built once & shared by everyone, so don't modify it!"""
+    __slots__ = ('value',)
+
+    def __init__(self, text, value):
+        super().__init__(text)
+        self.value = value
+
+    def get_value(self, runner):
+        return self.value
+
+
+class VarAccess(Operand):
+    """A variable, or a field (of a field...) of a struct variable, e.g.
+    "point-x" is the field path ('x',) of the variable in point's slot"""
+    __slots__ = ('name', 'slot', 'path')
+
+    def __init__(self, text, name, slot, path=()):
+        super().__init__(text)
+        self.name = name
+        self.slot = slot
+        self.path = path # tuple of field names
+
+    def __repr__(self):
+        return "{}({}, slot={})".format(type(self).__name__,
+            repr(self.text), self.slot)
+
+    def get_var(self, runner):
+        try:
+            var = runner.slots[self.slot]
+        except IndexError:
+            var = None
+        if var is None or var.name != self.name:
+            # Not declared (yet), or slot is some other program's: look it
+            # up (or fail) the way Runner.get_var does
+            var = runner.get_var(self.name)
+        return var
+
+    def get_value(self, runner):
+        value = self.get_var(runner).get()
+        for name in self.path:
+            value = value.get_field(name)
+        return value
+
+    def get_ref(self, runner):
+        ref = VarRef(self.get_var(runner))
+        for name in self.path:
+            ref = StructFieldRef(ref, name)
+        return ref
+
+
+class FieldSymbolAccess(Operand):
+    """A field symbol, or a field (of a field...) of the struct it's
+    assigned to, e.g. "<fs>-x" """
+    __slots__ = ('name', 'slot', 'path')
+
+    def __init__(self, text, name, slot, path=()):
+        super().__init__(text)
+        self.name = name
+        self.slot = slot
+        self.path = path # tuple of field names
+
+    def __repr__(self):
+        return "{}({}, slot={})".format(type(self).__name__,
+            repr(self.text), self.slot)
+
+    def get_field_symbol(self, runner):
+        try:
+            field_symbol = runner.slots[self.slot]
+        except IndexError:
+            field_symbol = None
+        if field_symbol is None or field_symbol.name != self.name:
+            # Not declared (yet), or slot is some other program's: look it
+            # up (or fail) the way Runner.get_var does
+            field_symbol = runner.get_var(self.name)
+        return field_symbol
+
+    def is_assigned(self, runner):
+        return self.get_field_symbol(runner).ref is not None
+
+    def get_value(self, runner):
+        value = self.get_field_symbol(runner).get_ref().get()
+        for name in self.path:
+            value = value.get_field(name)
+        return value
+
+    def get_ref(self, runner):
+        ref = self.get_field_symbol(runner).get_ref()
+        for name in self.path:
+            ref = StructFieldRef(ref, name)
+        return ref
+
+
+class DerefAccess(Operand):
+    """Whatever a data reference refers to, or a field (of a field...) of
+    it, e.g. "dref->*-x" """
+    __slots__ = ('dref', 'path')
+
+    def __init__(self, text, dref, path=()):
+        super().__init__(text)
+        self.dref = dref # Operand
+        self.path = path # tuple of field names
+
+    def get_target_ref(self, runner):
+        value = self.dref.get_value(runner)
+        assertTrue(value.type.is_ref())
+        ref = value.data
+        if ref is None:
+            raise AssertionError("Data reference not bound: {}"
+                .format(self.dref.text))
+        return ref
+
+    def get_value(self, runner):
+        value = self.get_target_ref(runner).get()
+        for name in self.path:
+            value = value.get_field(name)
+        return value
+
+    def get_ref(self, runner):
+        ref = self.get_target_ref(runner)
+        for name in self.path:
+            ref = StructFieldRef(ref, name)
+        return ref
+
+
+class SystemAccess(Operand):
+    """A system variable (e.g. sy), or a field of one"""
+    __slots__ = ('name', 'path')
+
+    def __init__(self, text, name, path=()):
+        super().__init__(text)
+        self.name = name
+        self.path = path # tuple of field names
+
+    def get_value(self, runner):
+        value = runner.get_system_value(self.name)
+        for name in self.path:
+            value = value.get_field(name)
+        return value
+
+    def get_ref(self, runner):
+        ref = VarRef(runner.get_var(self.name))
+        for name in self.path:
+            ref = StructFieldRef(ref, name)
+        return ref
+
+
+class FunctionCall(Operand):
+    """A call of a builtin function, e.g. "lines( itab )" """
+    __slots__ = ('function', 'args')
+
+    def __init__(self, text, function, args):
+        super().__init__(text)
+        self.function = function
+        self.args = args # tuple of Operands
+
+    def get_value(self, runner):
+        return self.function(*[arg.get_value(runner) for arg in self.args])
+
+
+def parse_literal(text):
+    """Returns the Value of literal text, or None if it's not a literal"""
+    c0 = text[0:1]
+    if c0 == '\'':
+        data = text[1:]
+
+        # from https://www.tutorialspoint.com/sap_abap/
+        # sap_abap_constants_literals.htm:
+        # Note − In text field literals, trailing blanks are ignored,
+        # but in string literals they are taken into account.
+        data = data.rstrip()
+
+        return Value(get_type('c', len(data)), data)
+    if c0 == '`':
+        return Value(get_type('string'), text[1:])
+    if c0.isdigit():
+        return Value(get_type('i'), int(text))
+    return None
+
+
+class SymbolTable:
+    """The variables of a program: gives each variable name a slot (the
+    index of its Var in Runner.slots) the first time it's declared or
+    used.
+    Operands are shared by every node using the same text."""
+
+    def __init__(self):
+        self.slots = {} # name -> slot
+        self.names = [] # slot -> name
+        self.operands = {} # text -> Operand
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_slot(self, name):
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.slots[name] = len(self.names)
+            self.names.append(name)
+        return slot
+
+    def resolve(self, text):
+        """Returns the Operand for text, e.g. "'abc'", "x", "sy-datum" """
+        operand = self.operands.get(text)
+        if operand is not None: return operand
+
+        value = parse_literal(text)
+        if value is not None:
+            operand = Literal(text, value)
+        elif '->*' in text:
+            dref_text, path_text = text.split('->*', 1)
+            path = tuple(path_text.split('-')[1:])
+            operand = DerefAccess(text, self.resolve(dref_text), path)
+        else:
+            parts = text.split('-')
+            name = parts[0]
+            path = tuple(parts[1:])
+            if name in SYSTEM_VAR_NAMES:
+                operand = SystemAccess(text, name, path)
+            elif name.startswith('<'):
+                operand = FieldSymbolAccess(text, name,
+                    self.get_slot(name), path)
+            else:
+                operand = VarAccess(text, name, self.get_slot(name), path)
+        self.operands[text] = operand
+        return operand
+
+    def resolve_call(self, lexemes):
+        """Returns the Operand for a function call, given its lexemes,
+        e.g. ['lines(', 'itab', ')'] """
+        text = ' '.join(lexemes)
+        operand = self.operands.get(text)
+        if operand is not None: return operand
+
+        assertGreaterEqual(len(lexemes), 2)
+        assertTrue(lexemes[0].endswith('('))
+        assertEqual(lexemes[-1], ')')
+        name = lexemes[0][:-1]
+        function = BUILTIN_FUNCTIONS.get(name)
+        if function is None:
+            raise ValueError("Function not implemented: {}".format(name))
+        args = tuple(self.resolve(arg) for arg in lexemes[1:-1])
+        operand = self.operands[text] = FunctionCall(text, function, args)
+        return operand
@@ -0,0 +1,91 @@
+
+from collections import OrderedDict
+
+from .internals import Type, Value, get_type
+from .datetimes import get_local_tz, get_local_now
+from .assertions import *
+
+
+INT_TYPE = get_type('i')
+DATE_TYPE = get_type('d')
+TIME_TYPE = get_type('t')
+
+
+class SystemStruct(Value):
+    """The value of a Runner's sy.
+    It's created once per Runner, and its fields are only worked out when
+    they're read: e.g. sy-linsz follows the Runner's screen, and sy-datum
+    & friends look at the clock, but only the first read of one of them
+    looks up the local timezone."""
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.local_tz = None # looked up on first use, see get_local_now
+        self.linsz_value = None
+
+        # Set by the Runner, e.g. by READ TABLE
+        self.subrc = 0
+        self.tabix = 0
+
+        # field name -> (type, method returning its value)
+        self.getters = OrderedDict([
+            # general
+            ('linsz', (INT_TYPE, self.get_linsz)),
+            ('subrc', (INT_TYPE, self.get_subrc)),
+            ('tabix', (INT_TYPE, self.get_tabix)),
+
+            # date & time
+            ('datum', (DATE_TYPE, self.get_date)),
+            ('datlo', (DATE_TYPE, self.get_date)),
+            ('uzeit', (TIME_TYPE, self.get_time)),
+            ('timlo', (TIME_TYPE, self.get_time)),
+        ])
+
+        type = Type('struct')
+        for name, (field_type, getter) in self.getters.items():
+            type.add_field(name, field_type)
+        self.type = type
+
+    @property
+    def data(self):
+        return [getter() for field_type, getter in self.getters.values()]
+
+    def get_field(self, name):
+        assertIn(name, self.getters)
+        field_type, getter = self.getters[name]
+        return getter()
+
+    def copy(self):
+        # The fields' values as of now
+        return Value(self.type, tuple(self.data))
+
+    def set_field(self, name, value, allow_structs=False):
+        raise AssertionError("System field is read-only: sy-{}"
+            .format(name))
+
+    def set_field_data(self, name, data):
+        self.set_field(name, None)
+
+    def get_local_now(self):
+        local_tz = self.local_tz
+        if local_tz is None: local_tz = self.local_tz = get_local_tz()
+        return get_local_now(local_tz)
+
+    def get_linsz(self):
+        w = self.screen.w
+        value = self.linsz_value
+        if value is None or value.data != w:
+            value = self.linsz_value = Value(INT_TYPE, w)
+        return value
+
+    def get_subrc(self):
+        return Value(INT_TYPE, self.subrc)
+
+    def get_tabix(self):
+        return Value(INT_TYPE, self.tabix)
+
+    def get_date(self):
+        return Value(DATE_TYPE, self.get_local_now().strftime('%Y%m%d'))
+
+    def get_time(self):
+        return Value(TIME_TYPE, self.get_local_now().strftime('%H%M%S'))
@@ -0,0 +1,443 @@
+
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+from .internals import Type, Value, Ref, CONVERTERS, get_type
+from .assertions import *
+
+
+TABLE_KINDS = {'standard', 'sorted', 'hashed'}
+
+# The name of a table's primary key, e.g. for READ TABLE ... USING KEY
+PRIMARY_KEY_NAME = 'primary_key'
+
+# A SortedIndex keeps its rows in blocks, each split in two once it's
+# got more than this many rows
+SORTED_BLOCK_SIZE = 1000
+
+
+# Internal tables.
+# A table's rows are Values of its line type, which belong to the table
+# (so they're copied on the way in & out, see Value.copy).
+# Each key of the table (its primary key, plus any secondary keys) has an
+# index of the rows, depending on the key's kind:
+#   standard: a list, in the order the rows were added (primary key only)
+#   sorted: a list sorted by key, see SortedIndex
+#   hashed: a dict from key to row
+# Secondary keys' indexes are kept up to date as rows are added.
+# An index's "keys" are tuples of the data of the key's components.
+# Rows can be changed in place (through a RowRef, e.g. by LOOP AT ...
+# ASSIGNING), except for components of sorted & hashed keys.
+
+
+class TableKey:
+    def __init__(self, name, kind, unique, components, line_type):
+        assertIn(kind, TABLE_KINDS)
+        if kind == 'hashed': assertTrue(unique)
+        if kind == 'standard': assertFalse(unique)
+        self.name = name
+        self.kind = kind
+        self.unique = unique
+        self.components = components # tuple of field names or 'table_line'
+
+        for component in components:
+            get_component_type(line_type, component)
+        self.get_key = get_key_getter(components, line_type)
+
+    def __str__(self):
+        return "{}{} KEY {} COMPONENTS {}".format(
+            'UNIQUE ' if self.unique else 'NON-UNIQUE ',
+            self.kind.upper(), self.name,
+            ' '.join(self.components) or '(EMPTY)')
+
+def get_component_type(line_type, component):
+    if component == 'table_line': return line_type
+    assertTrue(line_type.is_struct())
+    assertIn(component, line_type.fields)
+    return line_type.fields[component]
+
+def get_component_data(row, component):
+    if component == 'table_line': return row.data
+    return row.get_field(component).data
+
+def get_key_getter(components, line_type):
+    """Returns function(row) returning its key"""
+    if components == ('table_line',):
+        return lambda row: (row.data,)
+    offsets = tuple(line_type.offsets[component]
+        for component in components)
+    if len(offsets) == 1:
+        offset, = offsets
+        return lambda row: (row.data[offset].data,)
+    return lambda row: tuple(row.data[offset].data for offset in offsets)
+
+def get_default_components(line_type):
+    """The components of the "default key": the whole line, or for
+    structs, their textual fields"""
+    if not line_type.is_struct(): return ('table_line',)
+    return tuple(name for name, field_type in line_type.fields.items()
+        if field_type.is_textual())
+
+
+class TableType(Type):
+    """The type of an internal table.
+    key_decls are (name, kind, unique, components) for the keys declared
+    with the table: name is None for the primary key, components None for
+    its default key."""
+    __slots__ = ('kind', 'line_type', 'primary_key', 'secondary_keys',
+        'protected_components')
+
+    def __init__(self, kind, line_type, key_decls=()):
+        super().__init__('table')
+        assertIn(kind, TABLE_KINDS)
+        self.kind = kind
+        self.line_type = line_type
+
+        primary_key = None
+        secondary_keys = []
+        for name, key_kind, unique, components in key_decls:
+            if components is None:
+                components = get_default_components(line_type)
+            if name is None or name == PRIMARY_KEY_NAME:
+                assertTrue(primary_key is None)
+                if kind == 'hashed': unique = True
+                primary_key = TableKey(PRIMARY_KEY_NAME, kind, unique,
+                    components, line_type)
+            else:
+                assertNotEqual(key_kind, 'standard')
+                secondary_keys.append(TableKey(name, key_kind, unique,
+                    components, line_type))
+        if primary_key is None:
+            primary_key = TableKey(PRIMARY_KEY_NAME, kind,
+                kind == 'hashed', get_default_components(line_type),
+                line_type)
+        if not primary_key.components: assertEqual(kind, 'standard')
+        self.primary_key = primary_key
+        self.secondary_keys = tuple(secondary_keys)
+        self.protected_components = frozenset(component
+            for key in (primary_key,) + self.secondary_keys
+            if key.kind != 'standard' for component in key.components)
+
+    def __str__(self):
+        return "{} TABLE OF {} WITH {}".format(self.kind.upper(),
+            self.line_type, ' WITH '.join(str(key)
+                for key in (self.primary_key,) + self.secondary_keys))
+
+    def get_initial_data(self):
+        return Table(self)
+
+    def is_compatible(self, other):
+        if self is other: return True
+        if not other.is_table(): return False
+        def get_key_decls(type):
+            return [(key.name, key.kind, key.unique, key.components)
+                for key in (type.primary_key,) + type.secondary_keys]
+        return self.kind == other.kind and (
+            self.line_type.is_compatible(other.line_type)) and (
+            get_key_decls(self) == get_key_decls(other))
+
+    def get_key(self, key_name=None):
+        if key_name is None or key_name == PRIMARY_KEY_NAME:
+            return self.primary_key
+        for key in self.secondary_keys:
+            if key.name == key_name: return key
+        raise AssertionError("No such key: {}".format(key_name))
+
+
+class StandardIndex:
+    """The rows of a standard table, in the order they were added.
+    Their keys are worked out when they're needed, since rows may have
+    been changed in place since then (see Table.check_change)."""
+
+    def __init__(self, key):
+        self.key = key
+        self.rows = []
+        self.keys = [] # or None if they need working out
+
+    def get_keys(self):
+        keys = self.keys
+        if keys is None:
+            keys = self.keys = list(map(self.key.get_key, self.rows))
+        return keys
+
+    def __len__(self): return len(self.rows)
+    def __iter__(self): return iter(self.rows)
+
+    def get(self, position):
+        if 0 <= position < len(self.rows): return self.rows[position]
+        return None
+
+    def find(self, prefix):
+        """Returns (position, row) for the first row whose key starts with
+        prefix, or None"""
+        n = len(prefix)
+        keys = self.get_keys()
+        if n == len(self.key.components):
+            try: position = keys.index(prefix)
+            except ValueError: return None
+            return position, self.rows[position]
+        for position, key in enumerate(keys):
+            if key[:n] == prefix: return position, self.rows[position]
+        return None
+
+    def has(self, key):
+        return key in self.get_keys()
+
+    def add(self, key, row, append=False):
+        if self.keys is not None: self.keys.append(key)
+        self.rows.append(row)
+
+
+class SortedIndex:
+    """Rows sorted by key (rows with the same key in the order they were
+    added), in blocks of up to 2 * SORTED_BLOCK_SIZE rows, so that adding
+    a row only moves the rows after it in its own block"""
+
+    def __init__(self, key):
+        self.key = key
+        self.blocks = [] # list of (keys, rows)
+        self.maxes = [] # last key of each block
+        self.offsets = None # position of each block's first row
+        self.size = 0
+
+    def __len__(self): return self.size
+
+    def __iter__(self):
+        for keys, rows in self.blocks:
+            yield from rows
+
+    def get_offsets(self):
+        offsets = self.offsets
+        if offsets is None:
+            offsets = self.offsets = [0]
+            offsets.extend(accumulate(len(keys)
+                for keys, rows in self.blocks))
+        return offsets
+
+    def get(self, position):
+        if not 0 <= position < self.size: return None
+        offsets = self.get_offsets()
+        i = bisect_right(offsets, position) - 1
+        keys, rows = self.blocks[i]
+        return rows[position - offsets[i]]
+
+    def find(self, prefix):
+        i = bisect_left(self.maxes, prefix)
+        if i == len(self.maxes): return None
+        keys, rows = self.blocks[i]
+        j = bisect_left(keys, prefix)
+        key = keys[j]
+        if key != prefix and key[:len(prefix)] != prefix: return None
+        return self.get_offsets()[i] + j, rows[j]
+
+    def has(self, key):
+        maxes = self.maxes
+        i = bisect_left(maxes, key)
+        if i == len(maxes): return False
+        keys, rows = self.blocks[i]
+        return keys[bisect_left(keys, key)] == key
+
+    def add(self, key, row, append=False):
+        blocks = self.blocks
+        maxes = self.maxes
+        if not blocks:
+            blocks.append(([key], [row]))
+            maxes.append(key)
+            self.offsets = None
+            self.size = 1
+            return
+
+        if append and key < maxes[-1]:
+            raise AssertionError("Appending {} to sorted table would "
+                "break its order".format(key))
+
+        i = bisect_right(maxes, key)
+        if i == len(maxes): i -= 1
+        keys, rows = blocks[i]
+        j = bisect_right(keys, key)
+        keys.insert(j, key)
+        rows.insert(j, row)
+        maxes[i] = keys[-1]
+        self.size += 1
+
+        if len(keys) > 2 * SORTED_BLOCK_SIZE:
+            blocks[i:i+1] = [
+                (keys[:SORTED_BLOCK_SIZE], rows[:SORTED_BLOCK_SIZE]),
+                (keys[SORTED_BLOCK_SIZE:], rows[SORTED_BLOCK_SIZE:])]
+            maxes[i:i+1] = [keys[SORTED_BLOCK_SIZE-1], keys[-1]]
+            self.offsets = None
+        elif self.offsets is not None:
+            offsets = self.offsets
+            for k in range(i + 1, len(offsets)): offsets[k] += 1
+
+
+class HashedIndex:
+    """Rows by key, in the order they were added"""
+
+    def __init__(self, key):
+        self.key = key
+        self.rows = {} # key -> row
+
+    def __len__(self): return len(self.rows)
+    def __iter__(self): return iter(self.rows.values())
+
+    def get(self, position):
+        raise AssertionError("Hashed key {} has no index"
+            .format(self.key.name))
+
+    def find(self, prefix):
+        row = self.rows.get(prefix)
+        if row is None: return None
+        return None, row # rows have no position
+
+    def has(self, key):
+        return key in self.rows
+
+    def add(self, key, row, append=False):
+        if append:
+            raise AssertionError("Can't append to hashed key {}"
+                .format(self.key.name))
+        self.rows[key] = row
+
+INDEX_CLASSES = {
+    'standard': StandardIndex,
+    'sorted': SortedIndex,
+    'hashed': HashedIndex,
+}
+
+
+class Table:
+    """The data of a table Value"""
+
+    def __init__(self, type):
+        self.type = type
+        self.primary_index = INDEX_CLASSES[type.kind](type.primary_key)
+        self.secondary_indexes = [INDEX_CLASSES[key.kind](key)
+            for key in type.secondary_keys]
+        self.indexes = {index.key.name: index
+            for index in [self.primary_index] + self.secondary_indexes}
+        self.unique_indexes = [index for index in self.indexes.values()
+            if index.key.unique]
+
+    def __len__(self): return len(self.primary_index)
+    def __iter__(self): return iter(self.primary_index)
+
+    def __str__(self):
+        return "[{}]".format(', '.join(str(row) for row in self))
+    def __repr__(self):
+        return "Table({})".format(self)
+
+    def get_index(self, key_name=None):
+        if key_name is None: return self.primary_index
+        index = self.indexes.get(key_name)
+        if index is None:
+            raise AssertionError("No such key: {}".format(key_name))
+        return index
+
+    def add(self, row, append=False):
+        """Adds row (which is now ours) to every index, or if one of its
+        unique keys already has a row with the same key, adds it to none
+        of them and returns False.
+        If append, row must go at the end of the primary index (so it
+        can't be hashed)."""
+        for index in self.unique_indexes:
+            if index.has(index.key.get_key(row)): return False
+        index = self.primary_index
+        index.add(index.key.get_key(row), row, append=append)
+        for index in self.secondary_indexes:
+            index.add(index.key.get_key(row), row)
+        return True
+
+    def check_change(self, component=None):
+        """Raises an error if the given component of a row (or the whole
+        row, if None) can't be changed in place, since it's part of a
+        sorted or hashed key"""
+        protected_components = self.type.protected_components
+        if protected_components and (component is None or
+                component in protected_components or
+                'table_line' in protected_components):
+            raise AssertionError("Can't change key component {} of table"
+                " row in place".format(component or 'table_line'))
+        if self.type.kind == 'standard':
+            self.primary_index.keys = None
+
+    def copy(self, type=None):
+        """Returns a copy of the table, optionally of another table type"""
+        if type is None: type = self.type
+        table = Table(type)
+        line_type = type.line_type
+        for row in self:
+            row = line_type.convert(row, allow_structs=True).copy()
+            if not table.add(row):
+                raise AssertionError("Duplicate key: {}".format(row))
+        return table
+
+    def find(self, components, datas, key_name=None):
+        """Returns (position, row) for the first row (in the order of the
+        given key) whose components have the given data, or None.
+        position is None if that key is hashed.
+        Uses the key's index if components are (a prefix of) the key's
+        components (all of them, if it's hashed), otherwise looks at
+        every row."""
+        index = self.get_index(key_name)
+        key = index.key
+        if components == key.components:
+            return index.find(tuple(datas))
+
+        n = len(components)
+        key_components = key.components[:n]
+        if n and len(key_components) == n and (
+                set(components) == set(key_components)) and (
+                n == len(key.components) or key.kind != 'hashed'):
+            data_by_component = dict(zip(components, datas))
+            return index.find(tuple(data_by_component[component]
+                for component in key_components))
+
+        items = tuple(zip(components, datas))
+        for position, row in enumerate(index):
+            for component, data in items:
+                if get_component_data(row, component) != data: break
+            else:
+                if key.kind == 'hashed': position = None
+                return position, row
+        return None
+
+
+class RowRef(Ref):
+    """A row of a table, e.g. the one LOOP AT ... ASSIGNING is at"""
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+    def __str__(self):
+        return "REF TO ROW {}".format(self.row)
+    def get(self):
+        return self.row
+    def get_to_change(self):
+        return self.row
+    def set(self, value, allow_structs=False):
+        self.check_change()
+        row = self.row
+        value = row.type.convert(value, allow_structs=allow_structs)
+        if value.type.is_struct() or value.type.is_table():
+            row.data = value.copy().data
+        else:
+            row.data = value.data
+    def set_data(self, data):
+        self.check_change()
+        self.row.data = data
+    def check_change(self, field_name=None):
+        self.table.check_change(field_name)
+
+
+def convert_table(type, value):
+    return Value(type, value.data.copy(type))
+
+CONVERTERS['table', 'table'] = convert_table
+
+
+def lines(value):
+    """The ABAP function lines( itab )"""
+    assertTrue(value.type.is_table())
+    return Value(get_type('i'), len(value.data))
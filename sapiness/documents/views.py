@@ -8,8 +8,10 @@ from django.db.models import Q
 from django.views.generic import ListView, DetailView, CreateView, UpdateView
 from django.views.generic import TemplateView
 from django.contrib.auth import get_user_model
+from django.conf import settings
 
 from abippity.main import main, parse_options, list_args
+from abippity.run import LimitExceeded
 from abippity.parse import get_keywords_text
 
 from .models import Document
@@ -21,7 +23,7 @@ class ArgsHelpView(TemplateView):
     template_name = 'documents/args_help.html'
     def get_context_data(self):
         context = super().get_context_data()
-        context['args'] = list_args
+        context['args'] = list_args(settings.ABIPPITY_WEB_OPTIONS)
         return context
 
 class KeywordsHelpView(TemplateView):
@@ -78,10 +80,16 @@ class DocumentDetailView(DetailView):
             # Get args from POST, parse as abippity options
             args_text = request.POST.get('args', '')
             args = args_text.split()
-            options = parse_options(args)
-
-            # Run abippity interpreter on document's content
-            output = self.run(doc.content, options)
+            try:
+                options = parse_options(args,
+                    names=settings.ABIPPITY_WEB_OPTIONS)
+            except ValueError as e:
+                # e.g. "--max-lines" without a number after it, or
+                # "--parse-jobs", which isn't allowed here
+                output = "*** ERROR: {}".format(e)
+            else:
+                # Run abippity interpreter on document's content
+                output = self.run(doc.content, options)
 
             context['args'] = args_text
             context['output'] = output
@@ -90,16 +98,27 @@ class DocumentDetailView(DetailView):
         return self.render_to_response(context)
 
     def run(self, text, options):
-        """Wrapper around abippity.main, returning its output as a str"""
+        """Wrapper around abippity.main, returning its output as a str.
+        Since text is a str, main gets the compiled program from
+        abippity.compile's cache, so running the same document over and
+        over only lexes & parses it once per process."""
 
         # Hack, abippity.main just uses print statements with file=file,
         # we pass it a StringIO as file in order to get text we can
         # stuff into the response...
         output_io = io.StringIO()
 
+        # Users may lower the limits, but not raise them
+        for name, limit in settings.ABIPPITY_LIMITS.items():
+            value = options.get(name)
+            options[name] = limit if value is None else min(value, limit)
+
         # Run abippity interpreter
         try:
             main(text, options, file=output_io)
+        except LimitExceeded as e:
+            msg = "*** STOPPED: {}".format(e)
+            output_io.write(msg)
         except (ValueError, TypeError, AssertionError) as e:
             # TODO: Make AbippityException or whatever, so we don't
             # accidentally show users errors they were never meant to
@@ -125,3 +125,27 @@ USE_TZ = True
 STATIC_URL = '/static/'
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
+
+# The abippity options (see abippity.main.OPTIONS) people may give when
+# running documents: not e.g. PARSE_JOBS, which would start as many
+# processes as they ask for, or SCREEN & STREAM_REPORT: the screen is
+# the server's choice (an mmap one would fill files on its disk, which
+# MAX_MEMORY doesn't count).
+ABIPPITY_WEB_OPTIONS = {
+    'PRINT_KEYWORDS', 'PRINT_CACHE_INFO',
+    'LEX', 'LEX_VERBOSE', 'LEX_SYNTAX', 'PRINT_LEXEMES', 'PRINT_STMTS',
+    'PARSE', 'PARSE_VERBOSE', 'PRINT_PARSED_STMTS',
+    'GROUP', 'GROUP_VERBOSE', 'PRINT_GROUPED_STMTS',
+    'RUN', 'RUN_VERBOSE', 'PRINT_REPORT', 'PRINT_VARS', 'VERBOSE_BOOLS',
+    'MAX_STMTS', 'MAX_TIME', 'MAX_LINES', 'MAX_MEMORY',
+}
+
+# Limits on running abippity documents (see abippity.run.Runner), so a
+# WHILE 1 = 1 can't tie up a worker forever. Users can ask for lower
+# ones with e.g. "--max-time 1", but not higher ones.
+ABIPPITY_LIMITS = {
+    'MAX_STMTS': 10000000,
+    'MAX_TIME': 10, # seconds
+    'MAX_LINES': 10000,
+    'MAX_MEMORY': 64 * 1024, # KiB
+}